@@ -0,0 +1,52 @@
+"""Unique index on conversation user pair
+
+Revision ID: 0a635c72546b
+Revises: c71bd8bb17c7
+Create Date: 2026-10-18 11:02:17.530914
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a635c72546b'
+down_revision: Union[str, Sequence[str], None] = 'c71bd8bb17c7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Merge duplicate conversations created by the old select-then-insert race,
+    # keeping the most recently active row so last_message_at stays current
+    op.execute("""
+        CREATE TEMPORARY TABLE conversation_dupes ON COMMIT DROP AS
+        SELECT id, keep_id FROM (
+            SELECT id, first_value(id) OVER (
+                PARTITION BY user_one_id, user_two_id ORDER BY last_message_at DESC NULLS LAST, id
+            ) AS keep_id
+            FROM conversations
+        ) ranked
+        WHERE id <> keep_id;
+    """)
+    op.execute("""
+        UPDATE messages m SET conversation_id = d.keep_id
+        FROM conversation_dupes d
+        WHERE m.conversation_id = d.id;
+    """)
+    op.execute("DELETE FROM conversations WHERE id IN (SELECT id FROM conversation_dupes);")
+
+    op.create_index(
+        'ix_conversations_user_one_id_user_two_id',
+        'conversations',
+        ['user_one_id', 'user_two_id'],
+        unique=True
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_conversations_user_one_id_user_two_id', table_name='conversations')
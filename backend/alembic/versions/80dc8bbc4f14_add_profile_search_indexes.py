@@ -0,0 +1,60 @@
+"""Add trigram, composite and partial indexes for profile search
+
+Revision ID: 80dc8bbc4f14
+Revises: 92564586a2e0
+Create Date: 2026-10-18 15:32:47.190562
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '80dc8bbc4f14'
+down_revision: Union[str, Sequence[str], None] = '92564586a2e0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    # location_city ILIKE '%x%'
+    op.create_index(
+        'ix_profiles_location_city_trgm',
+        'profiles',
+        ['location_city'],
+        unique=False,
+        postgresql_using='gin',
+        postgresql_ops={'location_city': 'gin_trgm_ops'}
+    )
+    # ethnicity/position/build equality filters ORDER BY created_at DESC
+    op.create_index(
+        'ix_profiles_ethnicity_position_build_created_at',
+        'profiles',
+        ['ethnicity', 'position', 'build', sa.text('created_at DESC')],
+        unique=False
+    )
+    op.create_index(
+        'ix_profiles_created_at',
+        'profiles',
+        [sa.text('created_at DESC')],
+        unique=False
+    )
+    op.create_index(
+        'ix_profiles_trans_interested_created_at',
+        'profiles',
+        [sa.text('created_at DESC')],
+        unique=False,
+        postgresql_where=sa.text('is_trans_interested IS true')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_profiles_trans_interested_created_at', table_name='profiles')
+    op.drop_index('ix_profiles_created_at', table_name='profiles')
+    op.drop_index('ix_profiles_ethnicity_position_build_created_at', table_name='profiles')
+    op.drop_index('ix_profiles_location_city_trgm', table_name='profiles')
@@ -0,0 +1,37 @@
+"""Add earthdistance GiST index on profile coordinates
+
+Revision ID: 92564586a2e0
+Revises: 0a635c72546b
+Create Date: 2026-10-18 14:05:12.408331
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '92564586a2e0'
+down_revision: Union[str, Sequence[str], None] = '0a635c72546b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.execute("CREATE EXTENSION IF NOT EXISTS cube")
+    op.execute("CREATE EXTENSION IF NOT EXISTS earthdistance")
+    # Serves radius search: earth_box(origin, r) @> ll_to_earth(location_lat, location_lng)
+    op.create_index(
+        'ix_profiles_location_earth',
+        'profiles',
+        [sa.text('ll_to_earth(location_lat, location_lng)')],
+        unique=False,
+        postgresql_using='gist'
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_profiles_location_earth', table_name='profiles')
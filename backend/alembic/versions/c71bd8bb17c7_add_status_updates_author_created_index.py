@@ -0,0 +1,34 @@
+"""Add composite author/created_at index on status_updates
+
+Revision ID: c71bd8bb17c7
+Revises: 6a8aa043491d
+Create Date: 2026-10-18 09:20:41.118203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c71bd8bb17c7'
+down_revision: Union[str, Sequence[str], None] = '6a8aa043491d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Serves feed rebuilds: author_id IN (...) ORDER BY created_at DESC LIMIT n
+    op.create_index(
+        'ix_status_updates_author_id_created_at',
+        'status_updates',
+        ['author_id', sa.text('created_at DESC')],
+        unique=False
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_status_updates_author_id_created_at', table_name='status_updates')
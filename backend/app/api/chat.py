@@ -8,15 +8,44 @@ from app.models.user import User
 from app.models.chat import ChatRoom, Message, Conversation
 from app.schemas.chat import ChatRoom as ChatRoomSchema, Message as MessageSchema, Conversation as ConversationSchema
 from app.services.storage import storage_service
-from app.services.chat import chat_service
+from app.services.chat import chat_service, recent_messages_key, serialize_message
 import uuid
+from datetime import datetime
 from sqlalchemy import select, desc, or_, and_
+from sqlalchemy.orm import selectinload
 
 from app.schemas.common import PaginatedResponse
-from app.core.pagination import paginate_query
+from app.core.pagination import paginate_query, encode_cursor
 
 router = APIRouter()
 
+async def get_message_history(db: AsyncSession, key: str, stmt, limit: int, cursor: Optional[str]):
+    """
+    First pages are served from the Redis ring buffer of recent messages;
+    older cursors, and buffers that cannot answer, go to Postgres.
+    """
+    if cursor is None:
+        recent = await chat_service.get_recent(key, limit)
+        if recent is not None:
+            has_next = len(recent) > limit
+            return {
+                "items": recent[:limit],
+                "metadata": {
+                    "has_next": has_next,
+                    "next_cursor": encode_cursor(datetime.fromisoformat(recent[limit - 1]["created_at"])) if has_next else None,
+                    "count": min(len(recent), limit)
+                }
+            }
+
+    page = await paginate_query(db, stmt, Message, limit, cursor)
+    if cursor is None:
+        await chat_service.fill_recent(
+            key,
+            [serialize_message(MessageSchema.model_validate(m).model_dump()) for m in page["items"]],
+            complete=not page["metadata"]["has_next"]
+        )
+    return page
+
 @router.get("/rooms", response_model=PaginatedResponse[ChatRoomSchema])
 async def get_rooms(
     db: Annotated[AsyncSession, Depends(get_db)],
@@ -32,13 +61,13 @@ async def get_rooms(
 @router.get("/rooms/{room_id}/history", response_model=PaginatedResponse[MessageSchema])
 async def get_room_history(
     room_id: uuid.UUID,
+    current_user: Annotated[User, Depends(deps.get_current_user)],
     db: Annotated[AsyncSession, Depends(get_db)],
     limit: int = 50,
     cursor: Optional[str] = None
 ):
-    from sqlalchemy.orm import selectinload
     stmt = select(Message).where(Message.room_id == room_id).options(selectinload(Message.sender))
-    return await paginate_query(db, stmt, Message, limit, cursor)
+    return await get_message_history(db, recent_messages_key(room_id=room_id), stmt, limit, cursor)
 
 @router.post("/media", response_model=dict)
 async def upload_chat_media(
@@ -68,14 +97,24 @@ async def get_or_create_conversation(
     current_user: Annotated[User, Depends(deps.get_current_user)],
     db: Annotated[AsyncSession, Depends(get_db)]
 ):
-    return await chat_service.get_or_create_conversation(db, current_user.id, recipient_id)
+    conversation = await chat_service.get_or_create_conversation(db, current_user.id, recipient_id)
+    await db.commit()
+    return conversation
 
 @router.get("/conversations/{conv_id}/history", response_model=PaginatedResponse[MessageSchema])
 async def get_conversation_history(
     conv_id: uuid.UUID,
+    current_user: Annotated[User, Depends(deps.get_current_user)],
     db: Annotated[AsyncSession, Depends(get_db)],
     limit: int = 50,
     cursor: Optional[str] = None
 ):
+    # Checked before either the ring buffer or the table is read
+    conversation = await db.get(Conversation, conv_id)
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    if current_user.id not in (conversation.user_one_id, conversation.user_two_id):
+        raise HTTPException(status_code=403, detail="Not authorized")
+
     stmt = select(Message).where(Message.conversation_id == conv_id).options(selectinload(Message.sender))
-    return await paginate_query(db, stmt, Message, limit, cursor)
+    return await get_message_history(db, recent_messages_key(conversation_id=conv_id), stmt, limit, cursor)
@@ -11,6 +11,26 @@ from app.models.user import User
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login", auto_error=False)
 
+NEXTAUTH_COOKIES = ("next-auth.session-token", "__Secure-next-auth.session-token")
+
+def decode_token_user_id(token: str) -> uuid.UUID:
+    """
+    Validate a Bearer/NextAuth JWT and return the user ID it was issued for.
+    Raises JWTError or ValueError if the token is invalid.
+    """
+    # Use NEXTAUTH_SECRET if it looks like a NextAuth token, otherwise SECRET_KEY
+    # NextAuth tokens are usually JWS signed with NEXTAUTH_SECRET
+    secret = settings.NEXTAUTH_SECRET if settings.NEXTAUTH_SECRET else settings.SECRET_KEY
+    payload = jwt.decode(token, secret, algorithms=[settings.ALGORITHM])
+    
+    # NextAuth often puts the user ID in 'sub' or 'user.id'
+    user_id_str: Optional[str] = payload.get("sub") or payload.get("user", {}).get("id")
+    
+    if user_id_str is None:
+        raise ValueError("Token has no subject")
+        
+    return uuid.UUID(user_id_str)
+
 async def get_current_user(
     request: Request,
     db: Annotated[AsyncSession, Depends(get_db)],
@@ -27,24 +47,13 @@ async def get_current_user(
     
     # 2. Try getting token from cookie (NextAuth)
     if not token:
-        token = request.cookies.get("next-auth.session-token") or request.cookies.get("__Secure-next-auth.session-token")
+        token = request.cookies.get(NEXTAUTH_COOKIES[0]) or request.cookies.get(NEXTAUTH_COOKIES[1])
         
     if not token:
         raise credentials_exception
 
     try:
-        # Use NEXTAUTH_SECRET if it looks like a NextAuth token, otherwise SECRET_KEY
-        # NextAuth tokens are usually JWS signed with NEXTAUTH_SECRET
-        secret = settings.NEXTAUTH_SECRET if settings.NEXTAUTH_SECRET else settings.SECRET_KEY
-        payload = jwt.decode(token, secret, algorithms=[settings.ALGORITHM])
-        
-        # NextAuth often puts the user ID in 'sub' or 'user.id'
-        user_id_str: str = payload.get("sub") or payload.get("user", {}).get("id")
-        
-        if user_id_str is None:
-            raise credentials_exception
-            
-        user_id = uuid.UUID(user_id_str)
+        user_id = decode_token_user_id(token)
     except (JWTError, ValueError):
         raise credentials_exception
     
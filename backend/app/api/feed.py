@@ -10,12 +10,11 @@ from app.schemas.community import (
     StatusUpdateSchema, StatusUpdateCreate,
     PostCommentSchema, PostCommentCreate
 )
-from app.services.feed_service import feed_service
+from app.services.feed_service import feed_service, post_score
 import uuid
 
 from app.schemas.common import PaginatedResponse
-from app.core.pagination import encode_cursor, decode_cursor
-import time
+from app.core.pagination import encode_score_cursor, decode_score_cursor
 
 router = APIRouter()
 
@@ -29,44 +28,29 @@ async def get_feed(
 ):
     user_id = current_user.id if feed_type == "following" else None
     
-    # Decode cursor (it's a base64 encoded ISO timestamp, but for Redis we want float)
-    dt_cursor = decode_cursor(cursor)
-    float_cursor = dt_cursor.timestamp() if dt_cursor else None
+    # Opaque (score, post_id) cursor; an exclusive bound into the feed zset
+    score_cursor = decode_score_cursor(cursor)
     
-    post_ids = await feed_service.get_feed(user_id=user_id, limit=limit, cursor=float_cursor)
+    entries = await feed_service.get_feed(user_id=user_id, limit=limit, cursor=score_cursor, db=db)
     
-    if not post_ids:
+    if not entries:
         return {
             "items": [],
             "metadata": {"has_next": False, "next_cursor": None, "count": 0}
         }
     
-    has_next = len(post_ids) > limit
-    page_ids = post_ids[:limit]
+    has_next = len(entries) > limit
+    page = entries[:limit]
+    page_ids = [member for member, _score in page]
     
-    # Convert string IDs back to UUIDs
-    post_uuids = [uuid.UUID(pid) for pid in page_ids]
-    
-    # Fetch actual objects from DB
-    # We want to maintain the order from Redis
-    stmt = (
-        select(StatusUpdate)
-        .where(StatusUpdate.id.in_(post_uuids))
-        .options(selectinload(StatusUpdate.author))
-    )
-    result = await db.execute(stmt)
-    updates = {u.id: u for u in result.scalars().all()}
-    
-    # Re-order
-    items = [updates[pid] for pid in post_uuids if pid in updates]
-    
-    # Get next cursor from the last item
+    # Serve hydrated items from the item cache; only misses go to the DB
+    items = await feed_service.hydrate_items(db, page_ids)
+
+    # Next cursor comes straight from the zset scores, not the hydrated rows
     next_cursor = None
-    if has_next and items:
-        # We need the score of the LAST item in page_ids to use as next cursor
-        # But wait, Redis returned them in order.
-        # I'll just use the created_at of the last item in 'items'
-        next_cursor = encode_cursor(items[-1].created_at)
+    if has_next:
+        last_member, last_score = page[-1]
+        next_cursor = encode_score_cursor(last_score, last_member)
 
     return {
         "items": items,
@@ -92,6 +76,9 @@ async def create_status_update(
     db.add(new_update)
     await db.commit()
     await db.refresh(new_update)
+
+    # Write-through so followers' first read is a cache hit
+    await feed_service.cache_items([StatusUpdateSchema.model_validate(new_update)])
     
     # Fan-out in background via Celery
     # 1. Get follower IDs
@@ -106,11 +93,30 @@ async def create_status_update(
     # Convert UUIDs to strings for Celery (JSON serializable)
     fan_out_post.delay(
         post_id_str=str(new_update.id),
-        follower_ids_str=[str(fid) for fid in follower_ids]
+        follower_ids_str=[str(fid) for fid in follower_ids],
+        author_id_str=str(current_user.id),
+        score=post_score(new_update.created_at)
     )
     
     return new_update
 
+@router.delete("/{post_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_status_update(
+    post_id: uuid.UUID,
+    current_user: Annotated[User, Depends(deps.get_current_user)],
+    db: Annotated[AsyncSession, Depends(get_db)]
+):
+    result = await db.execute(select(StatusUpdate).where(StatusUpdate.id == post_id))
+    update = result.scalars().first()
+    if not update:
+        raise HTTPException(status_code=404, detail="Status update not found")
+    if update.author_id != current_user.id and not current_user.is_superuser:
+        raise HTTPException(status_code=403, detail="Not authorized")
+
+    await db.delete(update)
+    await db.commit()
+    await feed_service.remove_post(post_id, update.author_id)
+
 @router.get("/{post_id}/comments", response_model=List[PostCommentSchema])
 async def get_post_comments(
     post_id: uuid.UUID,
@@ -55,8 +55,9 @@ async def resolve_report(
     
     report.status = "RESOLVED"
     report.reviewed_by = current_user.id
-    
-    # Logic for action (dismiss vs delete) would go here
-    
     await db.commit()
+
+    if action == "delete_content":
+        await moderation_service.delete_content(db, report.content_type, report.content_id)
+
     return {"status": "resolved", "action": action}
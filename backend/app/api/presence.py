@@ -0,0 +1,31 @@
+from typing import Annotated, Any, Callable, Iterable, List, Type
+from fastapi import APIRouter, Depends
+from pydantic import BaseModel
+from app.api import deps
+from app.models.user import User
+from app.schemas.presence import BulkPresenceRequest, BulkPresenceResponse
+from app.services.presence import presence_service
+import uuid
+
+router = APIRouter()
+
+async def with_presence(
+    items: Iterable[Any],
+    schema: Type[BaseModel],
+    user_id_of: Callable[[Any], uuid.UUID]
+) -> List[BaseModel]:
+    """Serialize items with the is_online flag of the user each one refers to."""
+    items = list(items)
+    flags = await presence_service.are_users_online(user_id_of(item) for item in items)
+    return [
+        schema.model_validate(item).model_copy(update={"is_online": flags[str(user_id_of(item))]})
+        for item in items
+    ]
+
+@router.post("/bulk", response_model=BulkPresenceResponse)
+async def get_bulk_presence(
+    request: BulkPresenceRequest,
+    current_user: Annotated[User, Depends(deps.get_current_user)]
+):
+    flags = await presence_service.are_users_online(request.user_ids)
+    return {"online": flags}
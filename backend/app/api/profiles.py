@@ -2,7 +2,7 @@ from typing import List, Annotated
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
-from app.core.database import get_db
+from app.core.database import get_db, SessionLocal
 from app.api import deps
 from app.models.user import User, Profile as ProfileModel, Media, ProfileRating
 from app.schemas.profile import Profile, ProfileUpdate
@@ -32,6 +32,9 @@ async def get_my_profile(
         db.add(profile)
         await db.commit()
         await db.refresh(profile)
+        # Drop a cached "not found" from views before the profile existed
+        await profile_cache.invalidate(str(current_user.id))
+        await bump_city_versions(profile.location_city)
     return profile
 
 @router.put("/me", response_model=Profile)
@@ -42,6 +45,7 @@ async def update_my_profile(
 ):
     result = await db.execute(select(ProfileModel).where(ProfileModel.id == current_user.id))
     profile = result.scalars().first()
+    previous_city = profile.location_city
     
     update_data = profile_in.model_dump(exclude_unset=True)
     for field, value in update_data.items():
@@ -53,23 +57,26 @@ async def update_my_profile(
     
     # Invalidate cache
     await profile_cache.invalidate(str(current_user.id))
+    await bump_city_versions(previous_city, profile.location_city)
     
     return profile
 
 from app.services.cache import profile_cache
+from app.services.search_service import bump_city_versions
 
 @router.get("/{user_id}", response_model=Profile)
 async def get_user_profile(
-    user_id: uuid.UUID,
-    db: Annotated[AsyncSession, Depends(get_db)]
+    user_id: uuid.UUID
 ):
+    # May run as a background refresh after the response, so it opens its own session
     async def fetch_from_db():
-        result = await db.execute(
-            select(ProfileModel)
-            .where(ProfileModel.id == user_id)
-            .options(selectinload(ProfileModel.user))
-        )
-        return result.scalars().first()
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(ProfileModel)
+                .where(ProfileModel.id == user_id)
+                .options(selectinload(ProfileModel.user))
+            )
+            return result.scalars().first()
 
     profile = await profile_cache.get_or_set(
         str(user_id),
@@ -18,55 +18,33 @@ from app.core.database import get_db
 from app.models.user import User, Profile
 from app.schemas.profile import Profile as ProfileSchema
 from app.schemas.common import PaginatedResponse
-from app.core.pagination import paginate_query
-from app.services.location import search_users_nearby
+from app.schemas.search import SearchFacets, SearchFilters
+from app.services.search_service import cached_search_profiles, get_facets
+from app.api.presence import with_presence
 import uuid
 
 router = APIRouter()
 
 @router.get("/", response_model=PaginatedResponse[ProfileSchema])
 async def search_users(
+    filters: Annotated[SearchFilters, Depends()],
     min_age: Optional[int] = Query(None),
     max_age: Optional[int] = Query(None),
-    ethnicity: Optional[str] = Query(None),
-    location: Optional[str] = Query(None), # city name
-    position: Optional[str] = Query(None),
-    build: Optional[str] = Query(None),
-    hiv_status: Optional[str] = Query(None),
-    privacy_mode: Optional[str] = Query(None),
-    trans_interested: Optional[bool] = Query(None),
-    radius_km: Optional[float] = Query(50),
-    lat: Optional[float] = Query(None),
-    lng: Optional[float] = Query(None),
     limit: int = 20,
     cursor: Optional[str] = None,
+    include_presence: bool = Query(False),
     db: AsyncSession = Depends(get_db)
 ):
-    query = select(Profile)
-    filters = []
-
-    if ethnicity:
-        filters.append(Profile.ethnicity == ethnicity)
-    if location:
-        filters.append(Profile.location_city.ilike(f"%{location}%"))
-    if position:
-        filters.append(Profile.position == position)
-    if build:
-        filters.append(Profile.build == build)
-    if hiv_status:
-        filters.append(Profile.hiv_status == hiv_status)
-    if privacy_mode:
-        filters.append(Profile.privacy_mode == privacy_mode)
-    if trans_interested is not None:
-        filters.append(Profile.is_trans_interested == trans_interested)
-    
-    # Location-based filtering using Redis if lat/lng provided
-    if lat is not None and lng is not None:
-        nearby_results = await search_users_nearby(lat, lng, radius_km)
-        nearby_ids = [uuid.UUID(res[0]) for res in nearby_results]
-        filters.append(Profile.id.in_(nearby_ids))
+    page = await cached_search_profiles(db, filters, limit, cursor)
 
-    if filters:
-        query = query.where(and_(*filters))
+    if include_presence:
+        page["items"] = await with_presence(page["items"], ProfileSchema, lambda profile: profile.id)
+    return page
 
-    return await paginate_query(db, query, Profile, limit, cursor)
+@router.get("/facets", response_model=SearchFacets)
+async def search_facets(
+    filters: Annotated[SearchFilters, Depends()],
+    db: AsyncSession = Depends(get_db)
+):
+    """Result counts per ethnicity, position and build for a filter set."""
+    return await get_facets(db, filters)
@@ -8,6 +8,8 @@ from app.models.user import User, Relationship
 from app.schemas.social import Relationship as RelationshipSchema
 from app.schemas.common import PaginatedResponse
 from app.core.pagination import paginate_query
+from app.services.tasks import backfill_friendship
+from app.api.presence import with_presence
 import uuid
 
 router = APIRouter()
@@ -91,6 +93,12 @@ async def accept_friend_request(
     rel.status = "ACCEPTED"
     await db.commit()
     await db.refresh(rel)
+
+    # The requester now follows current_user; backfill their feed in the background
+    backfill_friendship.delay(
+        follower_id_str=str(user_id),
+        author_id_str=str(current_user.id)
+    )
     return rel
 
 @router.get("/relationships", response_model=PaginatedResponse[RelationshipSchema])
@@ -98,7 +106,8 @@ async def get_my_relationships(
     current_user: Annotated[User, Depends(deps.get_current_user)],
     db: Annotated[AsyncSession, Depends(get_db)],
     limit: int = 20,
-    cursor: Optional[str] = None
+    cursor: Optional[str] = None,
+    include_presence: bool = Query(False)
 ):
     query = select(Relationship).where(
         or_(
@@ -106,4 +115,8 @@ async def get_my_relationships(
             Relationship.to_user_id == current_user.id
         )
     )
-    return await paginate_query(db, query, Relationship, limit, cursor)
\ No newline at end of file
+    page = await paginate_query(db, query, Relationship, limit, cursor)
+    if include_presence:
+        other_user = lambda rel: rel.to_user_id if rel.from_user_id == current_user.id else rel.from_user_id
+        page["items"] = await with_presence(page["items"], RelationshipSchema, other_user)
+    return page
\ No newline at end of file
@@ -1,4 +1,8 @@
+import asyncio
+from typing import Optional
 from celery import Celery
+from celery.schedules import crontab
+from celery.signals import worker_process_init, worker_process_shutdown
 from app.core.config import settings
 
 celery_app = Celery(
@@ -13,11 +17,70 @@ celery_app.conf.update(
     result_serializer="json",
     timezone="UTC",
     enable_utc=True,
+    beat_schedule={
+        "maintain-message-partitions": {
+            "task": "app.services.tasks.maintain_message_partitions",
+            "schedule": crontab(hour=3, minute=15),
+        },
+        "clear-offline-users": {
+            "task": "app.services.tasks.clear_offline_users",
+            "schedule": crontab(minute="*/5"),
+        },
+        "replay-dead-letter-messages": {
+            "task": "app.services.tasks.replay_dead_letter_messages",
+            "schedule": crontab(minute="*"),
+        },
+    },
 )
 
 # Autodiscover tasks in the app
 celery_app.autodiscover_tasks(["app.services"])
 
+# One long-lived event loop per worker process. The Redis client and the
+# SQLAlchemy engine pool their connections per loop, so reusing the loop
+# lets tasks reuse warm connections instead of reconnecting every time.
+_worker_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def get_worker_loop() -> asyncio.AbstractEventLoop:
+    global _worker_loop
+    if _worker_loop is None or _worker_loop.is_closed():
+        _worker_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_worker_loop)
+    return _worker_loop
+
+def run_async(coro):
+    """Run a coroutine to completion on the worker's persistent loop."""
+    return get_worker_loop().run_until_complete(coro)
+
+@worker_process_init.connect
+def init_worker_process(**kwargs):
+    """
+    Forked pool children inherit the parent's loop and sockets; start
+    each child with a fresh loop and empty connection pools.
+    """
+    global _worker_loop
+    from app.core.redis import binary_redis_client, redis_client
+    from app.core.database import engine
+
+    _worker_loop = None
+    redis_client.connection_pool.reset()
+    binary_redis_client.connection_pool.reset()
+    engine.sync_engine.dispose(close=False)
+
+@worker_process_shutdown.connect
+def shutdown_worker_process(**kwargs):
+    global _worker_loop
+    if _worker_loop is None or _worker_loop.is_closed():
+        return
+    from app.core.redis import binary_redis_client, redis_client
+    from app.core.database import engine
+
+    _worker_loop.run_until_complete(redis_client.aclose())
+    _worker_loop.run_until_complete(binary_redis_client.aclose())
+    _worker_loop.run_until_complete(engine.dispose())
+    _worker_loop.close()
+    _worker_loop = None
+
 @celery_app.task
 def test_task(arg):
     return f"Test task executed with {arg}"
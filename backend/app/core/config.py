@@ -19,6 +19,84 @@ class Settings(BaseSettings):
     SUPABASE_KEY: str = ""
     MEDIA_BUCKET_NAME: str = "bgclive-media"
 
+    # Feed fan-out
+    FEED_MAX_LENGTH: int = 500
+    FEED_FANOUT_CHUNK_SIZE: int = 1000
+    # Authors with at least this many followers are pulled at read time instead of fanned out
+    FEED_PULL_THRESHOLD: int = 5000
+    FEED_ITEM_CACHE_TTL: int = 3600
+    # Fleet-wide feed warmup: rebuild tasks dispatched per second
+    FEED_WARMUP_RATE: int = 50
+
+    # Chat write-behind: "async" acks once queued, "sync" waits for the batch commit
+    CHAT_WRITE_MODE: str = "async"
+    CHAT_FLUSH_INTERVAL_MS: int = 20
+    CHAT_FLUSH_BATCH_SIZE: int = 200
+    CHAT_WRITE_QUEUE_SIZE: int = 10000
+    # Failed flushes are retried with exponential backoff, then dead-lettered to Redis
+    CHAT_FLUSH_RETRIES: int = 5
+    CHAT_FLUSH_BACKOFF_MS: int = 100
+    # Longest message content accepted from clients
+    CHAT_MAX_MESSAGE_LENGTH: int = 4000
+    # Per-process LRU of user pair -> conversation ID, backed by Redis
+    CHAT_CONVERSATION_CACHE_SIZE: int = 10000
+    CHAT_CONVERSATION_CACHE_TTL: int = 86400
+    # Newest messages kept per room/conversation for first-page history
+    CHAT_RECENT_SIZE: int = 100
+    CHAT_RECENT_TTL: int = 86400
+    # Typing indicators: transitions broadcast per room every interval;
+    # a typist idle for the timeout is reported as stopped
+    TYPING_FLUSH_INTERVAL_MS: int = 500
+    TYPING_IDLE_TIMEOUT_MS: int = 5000
+
+    # Presence: online zset sharded by user ID hash, heartbeats batched per process
+    PRESENCE_SHARDS: int = 16
+    PRESENCE_ONLINE_WINDOW: int = 60
+    PRESENCE_FLUSH_INTERVAL_MS: int = 1000
+    PRESENCE_RETENTION: int = 3600
+    # Max user IDs per POST /api/presence/bulk
+    PRESENCE_BULK_MAX_IDS: int = 500
+    # presence_changed events to friends are batched over this window
+    PRESENCE_FANOUT_WINDOW_MS: int = 2000
+    # Socket connections count only while their node refreshes its liveness key
+    PRESENCE_NODE_TTL: int = 30
+
+    # Radius search backend: "postgres" (earthdistance index) or "redis" (geo:users)
+    GEO_SEARCH_BACKEND: str = "postgres"
+    # Upper bound on candidates one nearest-first page reads from geo:users
+    GEO_NEARBY_MAX_CANDIDATES: int = 5000
+    # Facet counts per normalized filter set
+    SEARCH_FACETS_TTL: int = 60
+    # Result ID pages per normalized filter set
+    SEARCH_CACHE_TTL: int = 30
+
+    # In-process tier of CacheService: entry lifetime, and profile_cache capacity
+    CACHE_LOCAL_TTL: int = 30
+    PROFILE_CACHE_LOCAL_SIZE: int = 10000
+    # Cross-worker fill lock per key, and XFetch early-expiry aggressiveness
+    CACHE_LOCK_TIMEOUT_MS: int = 3000
+    CACHE_XFETCH_BETA: float = 1.0
+    # Lifetime of cached "not found" results (0 disables). Workers older than
+    # the "not found" marker fail to parse it: set this (60 is a good value)
+    # only once every worker runs a version that reads it
+    CACHE_NEGATIVE_TTL: int = 0
+    # Early and stale-while-revalidate refreshes date entries by their Redis
+    # TTL. This also stores each entry's expiry and measured fetch time in
+    # the value; older workers cannot read those entries, so turn it on only
+    # after every worker runs a version that can
+    CACHE_WRITE_ENVELOPE: bool = False
+    # Cache value encoding: json (plain text, readable by every worker), or
+    # msgpack/orjson once no worker older than the binary formats is running.
+    # Binary bodies of at least CACHE_COMPRESS_MIN_BYTES are zstd-compressed (0 disables)
+    CACHE_SERIALIZER: str = "json"
+    CACHE_COMPRESS_MIN_BYTES: int = 1024
+    CACHE_COMPRESS_LEVEL: int = 3
+
+    # messages table partition lifecycle
+    MESSAGE_PARTITIONS_AHEAD: int = 3
+    MESSAGE_PARTITION_RETENTION_MONTHS: int = 12
+    MESSAGE_ARCHIVE_DIR: str = "archive/messages"
+
     model_config = SettingsConfigDict(env_file=".env", extra="ignore")
 
 
@@ -1,7 +1,7 @@
 import base64
 from datetime import datetime
-from typing import Any, Dict, List, Optional, Union
-from sqlalchemy import select, desc
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from sqlalchemy import select, desc, and_, or_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 def encode_cursor(dt: datetime) -> str:
@@ -18,6 +18,20 @@ def decode_cursor(cursor: Optional[str]) -> Optional[datetime]:
     except (TypeError, ValueError, base64.binascii.Error):
         return None
 
+def encode_score_cursor(score: float, member: str) -> str:
+    """Encodes a (score, member) keyset position into an opaque string."""
+    return base64.urlsafe_b64encode(f"{score!r}|{member}".encode()).decode()
+
+def decode_score_cursor(cursor: Optional[str]) -> Optional[Tuple[float, str]]:
+    """Decodes a cursor produced by encode_score_cursor."""
+    if not cursor:
+        return None
+    try:
+        score, member = base64.urlsafe_b64decode(cursor).decode().split("|", 1)
+        return float(score), member
+    except (TypeError, ValueError, UnicodeDecodeError, base64.binascii.Error):
+        return None
+
 def get_pagination_metadata(
     items: List[Any], 
     limit: int, 
@@ -75,3 +89,40 @@ async def paginate_query(
         "items": items[:limit],
         "metadata": metadata
     }
+
+async def paginate_by_score(
+    session: AsyncSession,
+    query: select,
+    score: Any,
+    tiebreak: Any,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    parse_member: Callable[[str], Any] = str
+) -> Dict[str, Any]:
+    """
+    Keyset pagination in ascending (score, tiebreak) order, e.g. distance
+    then ID. Items are the query's rows with the score appended as the last
+    column; the cursor is a score cursor over the last row served.
+    """
+    position = decode_score_cursor(cursor)
+
+    stmt = query.add_columns(score).order_by(score, tiebreak)
+    if position:
+        value, member = position
+        member = parse_member(member)
+        stmt = stmt.where(or_(score > value, and_(score == value, tiebreak > member)))
+
+    result = await session.execute(stmt.limit(limit + 1))
+    rows = result.all()
+
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_next:
+        last = rows[-1]
+        next_cursor = encode_score_cursor(float(last[-1]), str(getattr(last[0], tiebreak.key)))
+
+    return {
+        "items": rows,
+        "metadata": {"has_next": has_next, "next_cursor": next_cursor, "count": len(rows)}
+    }
@@ -3,10 +3,15 @@ from app.core.config import settings
 import json
 
 redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+# Returns raw bytes, for serialized cache values
+binary_redis_client = redis.from_url(settings.REDIS_URL, decode_responses=False)
 
 async def get_redis():
     return redis_client
 
+async def get_binary_redis():
+    return binary_redis_client
+
 async def set_session(session_token: str, user_id: str, expire: int = 86400):
     await redis_client.setex(
         f"session:{session_token}",
@@ -1,8 +1,15 @@
 import socketio
+from http.cookies import SimpleCookie
+from typing import Dict, List, Optional
+from jose import JWTError
+from app.api.deps import NEXTAUTH_COOKIES, decode_token_user_id
 from app.core.config import settings
-from app.services.chat import chat_service
-from app.services.presence import presence_service
+from app.services.chat import chat_service, message_error, serialize_message
 from app.core.database import SessionLocal
+from app.models.user import User
+from app.services.presence import PresencePublisher, presence_service
+from app.services.typing import TypingAggregator
+from app.services.user_service import get_friend_ids
 from app.core.redis import get_redis
 import uuid
 from datetime import datetime
@@ -17,6 +24,16 @@ sio = socketio.AsyncServer(
     client_manager=mgr
 )
 
+async def emit_typing(room: str, frame: dict):
+    await sio.emit("user_typing", frame, room=room)
+
+typing_aggregator = TypingAggregator(emit_typing)
+
+async def emit_presence(user_id: str, frame: dict):
+    await sio.emit("presence_changed", frame, room=user_id)
+
+presence_publisher = PresencePublisher(emit_presence)
+
 async def check_rate_limit(user_id: str) -> bool:
     """
     Simple rate limit: max 5 messages per 10 seconds.
@@ -28,100 +45,144 @@ async def check_rate_limit(user_id: str) -> bool:
         await redis.expire(key, 10)
     return count <= 5
 
+class SocketIdentity:
+    """Authenticated user behind a socket connection, resolved once at connect."""
+    __slots__ = ("user_id", "user_uuid", "friend_ids")
+
+    def __init__(self, user_uuid: uuid.UUID, friend_ids: Optional[List[str]] = None):
+        self.user_uuid = user_uuid
+        self.user_id = str(user_uuid)
+        # Loaded once per connection for presence fan-out
+        self.friend_ids = friend_ids or []
+
+# sid -> identity for the connections handled by this process
+_identities: Dict[str, SocketIdentity] = {}
+
+def get_identity(sid: str) -> Optional[SocketIdentity]:
+    """Fast per-event accessor; avoids a session-manager lookup."""
+    return _identities.get(sid)
+
+def extract_token(environ: dict, auth: Optional[dict]) -> Optional[str]:
+    """Token from the connect auth payload, a Bearer header or the NextAuth cookie."""
+    if auth and auth.get('token'):
+        return auth['token']
+
+    header = environ.get('HTTP_AUTHORIZATION', '')
+    if header.lower().startswith('bearer '):
+        return header[7:]
+
+    cookies = SimpleCookie(environ.get('HTTP_COOKIE', ''))
+    for name in NEXTAUTH_COOKIES:
+        if name in cookies:
+            return cookies[name].value
+    return None
+
+async def load_identity(user_uuid: uuid.UUID) -> Optional[SocketIdentity]:
+    """Identity of an existing, active user; None for deleted or deactivated accounts."""
+    async with SessionLocal() as db:
+        user = await db.get(User, user_uuid)
+        if user is None or not user.is_active:
+            return None
+        friend_ids = await get_friend_ids(db, user_uuid)
+    return SocketIdentity(user_uuid, friend_ids)
+
 @sio.event
 async def connect(sid, environ, auth):
+    token = extract_token(environ, auth)
+    if not token:
+        raise socketio.exceptions.ConnectionRefusedError("Authentication required")
     try:
-        # In production, validate JWT session from cookies or headers
-        if auth and 'user_id' in auth:
-            user_id = auth['user_id']
-            # Basic UUID validation
-            uuid.UUID(user_id)
-            
-            await sio.save_session(sid, {'user_id': user_id})
-            await sio.enter_room(sid, str(user_id))
-            await presence_service.update_presence(uuid.UUID(user_id), "online")
-            print(f"Authenticated user {user_id} connected on {sid}")
-        else:
-            print(f"Anonymous client connected: {sid}")
-    except Exception as e:
-        print(f"Connection rejected for {sid}: {str(e)}")
-        return False # Reject connection
+        user_uuid = decode_token_user_id(token)
+    except (JWTError, ValueError):
+        raise socketio.exceptions.ConnectionRefusedError("Invalid credentials")
+
+    identity = await load_identity(user_uuid)
+    if identity is None:
+        raise socketio.exceptions.ConnectionRefusedError("Invalid credentials")
+    _identities[sid] = identity
+    await sio.enter_room(sid, identity.user_id)
+    await presence_service.update_presence(user_uuid, "online")
+    if await presence_service.open_connection(user_uuid, sid):
+        presence_publisher.publish(identity.user_id, True, identity.friend_ids)
+    print(f"Authenticated user {identity.user_id} connected on {sid}")
 
 @sio.event
 async def disconnect(sid):
-    session = await sio.get_session(sid)
-    if session and 'user_id' in session:
-        user_id = session['user_id']
-        await presence_service.update_presence(uuid.UUID(user_id), "offline")
+    identity = _identities.pop(sid, None)
+    if identity:
+        typing_aggregator.stop_user(identity.user_id)
+        # Other tabs or devices may still be connected
+        if await presence_service.close_connection(identity.user_uuid, sid):
+            await presence_service.update_presence(identity.user_uuid, "offline")
+            presence_publisher.publish(identity.user_id, False, identity.friend_ids)
     print(f"Client disconnected: {sid}")
 
 @sio.event
 async def presence(sid, data):
-    session = await sio.get_session(sid)
-    if session and 'user_id' in session:
-        user_id = session['user_id']
-        status = data.get('status', 'online')
-        await presence_service.update_presence(uuid.UUID(user_id), status)
+    identity = get_identity(sid)
+    if identity:
+        # Heartbeats are batched; connect/disconnect above are written immediately
+        presence_service.record_heartbeat(identity.user_id, data.get('status', 'online'))
 
 @sio.event
 async def typing(sid, data):
-    session = await sio.get_session(sid)
-    if not session or 'user_id' not in session:
+    identity = get_identity(sid)
+    if not identity:
         return
     
-    user_id = session['user_id']
     room_id = data.get('room_id')
     recipient_id = data.get('recipient_id')
-    
-    event_data = {"user_id": user_id, "is_typing": True}
-    
-    if room_id:
-        await sio.emit("user_typing", event_data, room=str(room_id), skip_sid=sid)
-    elif recipient_id:
-        await sio.emit("user_typing", event_data, room=str(recipient_id), skip_sid=sid)
+    target = str(room_id or recipient_id or '')
+    if not target:
+        return
+
+    # Aggregated and broadcast as start/stop transitions by typing_aggregator
+    if data.get('is_typing', True):
+        typing_aggregator.touch(target, identity.user_id)
+    else:
+        typing_aggregator.stop(target, identity.user_id)
 
 @sio.event
 async def send_dm(sid, data):
-    session = await sio.get_session(sid)
-    if not session or 'user_id' not in session:
+    identity = get_identity(sid)
+    if not identity:
         return
     
-    user_id = session['user_id']
+    user_id = identity.user_id
     if not await check_rate_limit(user_id):
         await sio.emit("error", {"detail": "Rate limit exceeded. Slow down!"}, to=sid)
         return
 
-    sender_id = uuid.UUID(user_id)
+    sender_id = identity.user_uuid
     recipient_id = uuid.UUID(data['recipient_id'])
-    content = data['content']
+    content = data.get('content')
     msg_type = data.get('type', 'TEXT')
+    error = message_error(content, msg_type)
+    if error:
+        await sio.emit("error", {"detail": error}, to=sid)
+        return
 
-    async with SessionLocal() as db:
-        conv = await chat_service.get_or_create_conversation(db, sender_id, recipient_id)
-        msg = await chat_service.save_message(
-            db, 
-            sender_id=sender_id, 
-            content=content, 
-            type=msg_type, 
-            conversation_id=conv.id
-        )
-        
-        msg_data = {
-            "id": str(msg.id),
-            "sender_id": str(msg.sender_id),
-            "conversation_id": str(msg.conversation_id),
-            "content": msg.content,
-            "type": msg.type,
-            "created_at": msg.created_at.isoformat()
-        }
-        
-        await sio.emit("new_dm", msg_data, room=str(recipient_id))
-        await sio.emit("new_dm", msg_data, room=str(sender_id))
+    conv_id = await chat_service.get_conversation_id(sender_id, recipient_id)
+
+    # Persisted by the write-behind writer; emit without waiting for the INSERT
+    msg = await chat_service.queue_message(
+        sender_id=sender_id, 
+        content=content, 
+        type=msg_type, 
+        conversation_id=conv_id
+    )
+    msg_data = serialize_message(msg)
+    typing_aggregator.stop(str(recipient_id), user_id)
+    
+    await sio.emit("new_dm", msg_data, room=str(recipient_id))
+    await sio.emit("new_dm", msg_data, room=str(sender_id))
 
 @sio.event
 async def join_room(sid, data):
-    session = await sio.get_session(sid)
-    user_id = session.get('user_id') if session else "Anonymous"
+    identity = get_identity(sid)
+    if not identity:
+        return
+    user_id = identity.user_id
     
     room_id = data['room_id']
     await sio.enter_room(sid, str(room_id))
@@ -140,36 +201,30 @@ async def join_room(sid, data):
 
 @sio.event
 async def send_room_message(sid, data):
-    session = await sio.get_session(sid)
-    if not session or 'user_id' not in session:
+    identity = get_identity(sid)
+    if not identity:
         return
     
-    user_id = session['user_id']
+    user_id = identity.user_id
     if not await check_rate_limit(user_id):
         await sio.emit("error", {"detail": "Rate limit exceeded. Slow down!"}, to=sid)
         return
 
-    sender_id = uuid.UUID(user_id)
+    sender_id = identity.user_uuid
     room_id = uuid.UUID(data['room_id'])
-    content = data['content']
+    content = data.get('content')
     msg_type = data.get('type', 'TEXT')
+    error = message_error(content, msg_type)
+    if error:
+        await sio.emit("error", {"detail": error}, to=sid)
+        return
 
-    async with SessionLocal() as db:
-        msg = await chat_service.save_message(
-            db, 
-            sender_id=sender_id, 
-            content=content, 
-            type=msg_type, 
-            room_id=room_id
-        )
-        
-        msg_data = {
-            "id": str(msg.id),
-            "sender_id": str(msg.sender_id),
-            "room_id": str(msg.room_id),
-            "content": msg.content,
-            "type": msg.type,
-            "created_at": msg.created_at.isoformat()
-        }
-        
-        await sio.emit("new_room_message", msg_data, room=str(room_id))
\ No newline at end of file
+    msg = await chat_service.queue_message(
+        sender_id=sender_id, 
+        content=content, 
+        type=msg_type, 
+        room_id=room_id
+    )
+    
+    typing_aggregator.stop(str(room_id), user_id)
+    await sio.emit("new_room_message", serialize_message(msg), room=str(room_id))
\ No newline at end of file
@@ -1,10 +1,16 @@
 import os
+import asyncio
+from typing import List
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.core.middleware import CacheControlMiddleware, SecurityHeadersMiddleware
 import socketio
-from app.core.socket import sio
+from app.core.socket import sio, typing_aggregator, presence_publisher
+from app.services.chat import chat_service
+from app.services.partitions import partition_manager
+from app.services.presence import presence_service
+from app.services.cache import listen_for_invalidations
 from app.api.auth import router as auth_router
 from app.api.profiles import router as profile_router
 from app.api.social import router as social_router
@@ -15,6 +21,8 @@ from app.api.groups import router as groups_router
 from app.api.moderation import router as moderation_router
 from app.api.media import router as media_router
 from app.api.stories import router as stories_router
+from app.api.chat import router as chat_router
+from app.api.presence import router as presence_router
 from app.core.database import SessionLocal
 from app.core.redis import get_redis
 from app.core.config import settings
@@ -66,11 +74,35 @@ app = FastAPI(title="BGCLive Replica API")
 if os.getenv("TESTING") != "true" and os.getenv("ENABLE_OTEL") == "true":
     FastAPIInstrumentor.instrument_app(app)
 
+# Long-running tasks started at startup; referenced so they are not
+# garbage-collected, and cancelled on shutdown
+background_tasks: List[asyncio.Task] = []
+
 @app.on_event("startup")
 async def startup():
     r = redis.from_url(settings.REDIS_URL, encoding="utf-8", decode_responses=True)
     await FastAPILimiter.init(r)
 
+    # Expose messages partition sizes alongside the request metrics
+    if os.getenv("TESTING") != "true":
+        background_tasks.append(asyncio.create_task(partition_manager.refresh_metrics_periodically()))
+        # Keep in-process cache tiers consistent across workers
+        background_tasks.append(asyncio.create_task(listen_for_invalidations()))
+
+@app.on_event("shutdown")
+async def shutdown():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+
+    # Flush buffered chat messages before the process exits
+    await chat_service.writer.stop()
+    await typing_aggregator.close()
+    await presence_service.flush_heartbeats()
+    await presence_publisher.flush()
+    await presence_service.close_node()
+
 # Instrument Prometheus
 if os.getenv("TESTING") != "true":
     Instrumentator().instrument(app).expose(app)
@@ -133,6 +165,8 @@ app.include_router(groups_router, prefix="/api/groups", tags=["groups"])
 app.include_router(moderation_router, prefix="/api/moderation", tags=["moderation"])
 app.include_router(media_router, prefix="/api/media", tags=["media"])
 app.include_router(stories_router, prefix="/api/stories", tags=["stories"])
+app.include_router(chat_router, prefix="/api/chat", tags=["chat"])
+app.include_router(presence_router, prefix="/api/presence", tags=["presence"])
 
 # Mount Socket.io
 socket_app = socketio.ASGIApp(sio, socketio_path="socket.io")
@@ -27,6 +27,10 @@ class Conversation(Base):
     last_message_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
     
     messages: Mapped[List["Message"]] = relationship(back_populates="conversation", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        Index("ix_conversations_user_one_id_user_two_id", "user_one_id", "user_two_id", unique=True),
+    )
 
 class Message(Base):
     __tablename__ = "messages"
@@ -109,3 +109,6 @@ class ContentReport(Base):
     reviewed_by: Mapped[Optional[uuid.UUID]] = mapped_column(ForeignKey("users.id"))
     status: Mapped[str] = mapped_column(String(50), default="PENDING") # PENDING, RESOLVED, DISMISSED
     created_at: Mapped[datetime] = mapped_column(DateTime, default=datetime.utcnow)
+
+# Additional Indices for performance
+Index("ix_status_updates_author_id_created_at", StatusUpdate.author_id, StatusUpdate.created_at.desc())
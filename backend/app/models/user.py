@@ -1,7 +1,7 @@
 import uuid
 from datetime import datetime
 from typing import List, Optional
-from sqlalchemy import String, Boolean, DateTime, ForeignKey, Text, JSON, Index, Float, CheckConstraint
+from sqlalchemy import String, Boolean, DateTime, ForeignKey, Text, JSON, Index, Float, CheckConstraint, func
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from app.core.database import Base
@@ -211,3 +211,35 @@ Index("ix_users_metadata_gin", User.metadata_json, postgresql_using="gin")
 Index("ix_profiles_roles_gin", Profile.roles, postgresql_using="gin")
 
 Index("ix_profiles_interests_gin", Profile.interests, postgresql_using="gin")
+
+# Radius search via earthdistance (requires the cube and earthdistance extensions)
+Index(
+    "ix_profiles_location_earth",
+    func.ll_to_earth(Profile.location_lat, Profile.location_lng),
+    postgresql_using="gist"
+)
+
+# Profile search: substring city match (requires pg_trgm)
+Index(
+    "ix_profiles_location_city_trgm",
+    Profile.location_city,
+    postgresql_using="gin",
+    postgresql_ops={"location_city": "gin_trgm_ops"}
+)
+
+# Profile search: common equality filters in newest-first order
+Index(
+    "ix_profiles_ethnicity_position_build_created_at",
+    Profile.ethnicity,
+    Profile.position,
+    Profile.build,
+    Profile.created_at.desc()
+)
+
+Index("ix_profiles_created_at", Profile.created_at.desc())
+
+Index(
+    "ix_profiles_trans_interested_created_at",
+    Profile.created_at.desc(),
+    postgresql_where=Profile.is_trans_interested.is_(True)
+)
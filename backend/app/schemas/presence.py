@@ -0,0 +1,10 @@
+from typing import Dict, List
+from pydantic import BaseModel, Field
+import uuid
+from app.core.config import settings
+
+class BulkPresenceRequest(BaseModel):
+    user_ids: List[uuid.UUID] = Field(..., max_length=settings.PRESENCE_BULK_MAX_IDS)
+
+class BulkPresenceResponse(BaseModel):
+    online: Dict[uuid.UUID, bool]
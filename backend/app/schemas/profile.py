@@ -33,6 +33,10 @@ class ProfileUpdate(ProfileBase):
 class Profile(ProfileBase):
     id: uuid.UUID
     last_active: datetime
+    # Only set when the endpoint was asked to include presence
+    is_online: Optional[bool] = None
+    # Only set by distance-ordered searches
+    distance_km: Optional[float] = None
 
     class Config:
         from_attributes = True
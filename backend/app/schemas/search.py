@@ -0,0 +1,21 @@
+from typing import Dict, Optional
+from pydantic import BaseModel
+
+class SearchFilters(BaseModel):
+    ethnicity: Optional[str] = None
+    location: Optional[str] = None # city name, or part of one
+    # Match location as the whole city name (case-insensitive) rather than a substring
+    exact_city: bool = False
+    position: Optional[str] = None
+    build: Optional[str] = None
+    hiv_status: Optional[str] = None
+    privacy_mode: Optional[str] = None
+    trans_interested: Optional[bool] = None
+    radius_km: Optional[float] = 50
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+
+class SearchFacets(BaseModel):
+    total: int
+    # facet field -> value -> number of matching profiles
+    facets: Dict[str, Dict[str, int]]
@@ -18,6 +18,8 @@ class Relationship(RelationshipBase):
     from_user_id: uuid.UUID
     status: str
     created_at: datetime
+    # Presence of the other user; only set when requested
+    is_online: Optional[bool] = None
 
     class Config:
         from_attributes = True
@@ -1,52 +1,501 @@
+import functools
 import json
-from typing import Any, Optional, Type, TypeVar, Callable, Awaitable
+import logging
+import math
+import random
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Mapping, NamedTuple, Optional, Sequence, Tuple, Type, TypeVar, Union, Callable, Awaitable
+from prometheus_client import Counter
 from pydantic import BaseModel
-from app.core.redis import get_redis
+from app.core.config import settings
+from app.core.redis import get_binary_redis, get_redis
+from app.services.serialization import Serializer, cache_serializer
 from sqlalchemy.ext.asyncio import AsyncSession
+import asyncio
 import uuid
 
+logger = logging.getLogger(__name__)
+
 T = TypeVar("T", bound=BaseModel)
 
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Cache lookups by cache, tier and result", ["cache", "tier", "result"]
+)
+CACHE_EVICTIONS = Counter(
+    "cache_local_evictions_total", "Entries evicted from the in-process cache tier", ["cache"]
+)
+CACHE_NEGATIVE_HITS = Counter(
+    "cache_negative_hits_total", "Lookups answered by a cached 'does not exist'", ["cache"]
+)
+
+# Stored in place of a value the database does not have; never valid JSON
+NEGATIVE_SENTINEL = "!missing"
+_NEGATIVE_SENTINEL_BYTES = NEGATIVE_SENTINEL.encode()
+
+# Cross-worker invalidation of the in-process tier
+INVALIDATION_CHANNEL = "cache:invalidate"
+# Identifies this process's own messages, which it has already applied
+_ORIGIN = uuid.uuid4().hex
+
+# prefix -> CacheService, for routing invalidation messages
+_caches: Dict[str, "CacheService"] = {}
+
+_MISSING = object()
+
+# Delete the fill lock only if we still own it
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+# Write a value only if the key's generation is still the one read before
+# fetching it; invalidate() bumps the generation, so a fetch that started
+# before an update cannot put the old value back afterwards
+STORE_IF_CURRENT_SCRIPT = """
+if (redis.call("get", KEYS[2]) or "") ~= ARGV[1] then
+    return 0
+end
+redis.call("setex", KEYS[1], ARGV[2], ARGV[3])
+return 1
+"""
+
+class CacheEntry(NamedTuple):
+    value: Any
+    # Epoch seconds after which the value is stale
+    fresh_until: float
+    # Seconds the fetcher took to produce it, for early expiration
+    delta: float
+
+class LocalCache:
+    """Bounded per-process LRU whose entries expire after ttl seconds."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        entry = self._entries.get(key)
+        if entry is None:
+            return default
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return default
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any) -> int:
+        """Store a value; returns the number of entries evicted to make room."""
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        evicted = 0
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def delete(self, key: str):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
 class CacheService:
-    def __init__(self, prefix: str, ttl: int = 3600):
+    """
+    Redis-backed object cache, optionally fronted by an in-process LRU of
+    validated objects (local_size > 0). Invalidations are broadcast over
+    Redis pub/sub so every worker drops its local copy.
+
+    Misses are filled once: concurrent callers in a process share one
+    fetch, and a short Redis lock makes other workers wait for its result.
+    Entries are refreshed probabilistically shortly before they expire
+    (XFetch), and with stale_ttl > 0 an expired entry is served for up to
+    stale_ttl more seconds while one background refresh runs; fetchers for
+    such caches must not depend on request-scoped state. A fetch that
+    finds nothing is remembered for negative_ttl seconds. The *_many
+    methods read and write a batch of keys in one round trip each.
+
+    Freshness is read from each entry's remaining Redis lifetime (PTTL),
+    fetched in the same round trip as the value, so entries stay plain
+    values that older workers can read. With envelope=True
+    (CACHE_WRITE_ENVELOPE) the expiry and the fetch time are also stored
+    with each entry; workers older than that format cannot read it, so
+    only enable it once every worker runs this version. Without it, early
+    refreshes use this process's recent fetch times.
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        ttl: int = 3600,
+        local_size: int = 0,
+        local_ttl: int = settings.CACHE_LOCAL_TTL,
+        stale_ttl: int = 0,
+        negative_ttl: int = settings.CACHE_NEGATIVE_TTL,
+        lock_timeout_ms: int = settings.CACHE_LOCK_TIMEOUT_MS,
+        beta: float = settings.CACHE_XFETCH_BETA,
+        serializer: Serializer = cache_serializer,
+        envelope: bool = settings.CACHE_WRITE_ENVELOPE
+    ):
         self.prefix = prefix
         self.ttl = ttl
+        self.local = LocalCache(local_size, local_ttl) if local_size > 0 else None
+        self.stale_ttl = stale_ttl
+        # Fetches that found nothing are cached this long (0 disables)
+        self.negative_ttl = negative_ttl
+        self.lock_timeout_ms = lock_timeout_ms
+        self.beta = beta
+        self.serializer = serializer
+        self.envelope = envelope
+        # Moving average of fetch times, for entries that do not carry one
+        self.fetch_time = 0.0
+        # key -> fetch task shared by concurrent callers in this process
+        self._inflight: Dict[str, asyncio.Task] = {}
+        _caches[prefix] = self
 
-    async def get_cached_object(self, key: str, schema: Type[T]) -> Optional[T]:
-        redis = await get_redis()
-        data = await redis.get(f"{self.prefix}:{key}")
+    def _count(self, tier: str, result: str):
+        CACHE_REQUESTS.labels(cache=self.prefix, tier=tier, result=result).inc()
+
+    def _remember(self, key: str, entry: CacheEntry):
+        if self.local is not None:
+            evicted = self.local.set(key, entry)
+            if evicted:
+                CACHE_EVICTIONS.labels(cache=self.prefix).inc(evicted)
+
+    def _generation_key(self, key: str) -> str:
+        return f"{self.prefix}:{key}:gen"
+
+    async def _generations(self, keys: Sequence[str]) -> List[str]:
+        redis = await get_binary_redis()
+        values = await redis.mget([self._generation_key(key) for key in keys])
+        return [value.decode() if value else "" for value in values]
+
+    def encode(self, obj: BaseModel, delta: float = 0.0) -> bytes:
+        if not self.envelope:
+            return self.serializer.dumps(obj.model_dump(mode="json"))
+        return self.serializer.dumps(
+            {"f": time.time() + self.ttl, "d": round(delta, 4), "v": obj.model_dump(mode="json")}
+        )
+
+    def decode(self, data: Union[bytes, str], schema: Type[T]) -> CacheEntry:
+        if data == _NEGATIVE_SENTINEL_BYTES or data == NEGATIVE_SENTINEL:
+            # Expires with its Redis TTL; never refreshed early
+            return CacheEntry(None, math.inf, 0.0)
+        payload = self.serializer.loads(data)
+        if isinstance(payload, dict) and payload.keys() == {"f", "d", "v"}:
+            return CacheEntry(schema.model_validate(payload["v"]), payload["f"], payload["d"])
+        # Plain value: fresh until Redis drops it, unless _with_ttl knows better
+        return CacheEntry(schema.model_validate(payload), math.inf, 0.0)
+
+    def _with_ttl(self, entry: CacheEntry, pttl_ms: int) -> CacheEntry:
+        """Date a plain value by its remaining Redis lifetime: the last stale_ttl seconds are stale."""
+        if entry.value is None or entry.fresh_until != math.inf or pttl_ms < 0:
+            return entry
+        return CacheEntry(entry.value, time.time() + pttl_ms / 1000 - self.stale_ttl, entry.delta)
+
+    async def _read_entry(self, key: str, schema: Type[T]) -> Optional[CacheEntry]:
+        if self.local is not None:
+            entry = self.local.get(key, _MISSING)
+            if entry is not _MISSING:
+                self._count("local", "hit")
+                if entry.value is None:
+                    CACHE_NEGATIVE_HITS.labels(cache=self.prefix).inc()
+                return entry
+            self._count("local", "miss")
+
+        redis = await get_binary_redis()
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.get(f"{self.prefix}:{key}")
+            pipe.pttl(f"{self.prefix}:{key}")
+            data, pttl_ms = await pipe.execute()
         if data:
-            return schema.model_validate_json(data)
+            self._count("redis", "hit")
+            entry = self._with_ttl(self.decode(data, schema), pttl_ms)
+            if entry.value is None:
+                CACHE_NEGATIVE_HITS.labels(cache=self.prefix).inc()
+            self._remember(key, entry)
+            return entry
+        self._count("redis", "miss")
         return None
 
-    async def set_cached_object(self, key: str, obj: T):
+    async def _broadcast(self, keys: Sequence[str]):
+        """Tell other workers to drop their local copies of keys."""
+        if self.local is None or not keys:
+            return
         redis = await get_redis()
-        await redis.setex(
-            f"{self.prefix}:{key}",
-            self.ttl,
-            obj.model_dump_json()
-        )
+        async with redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.publish(INVALIDATION_CHANNEL, json.dumps({"prefix": self.prefix, "key": key, "origin": _ORIGIN}))
+            await pipe.execute()
+
+    async def _write(self, key: str, ttl: int, data: Union[bytes, str], generation: Optional[str]) -> bool:
+        """SETEX, or with a generation, only if the key was not invalidated since."""
+        redis = await get_binary_redis()
+        if generation is None:
+            await redis.setex(f"{self.prefix}:{key}", ttl, data)
+            return True
+        return bool(await redis.eval(
+            STORE_IF_CURRENT_SCRIPT, 2, f"{self.prefix}:{key}", self._generation_key(key), generation, ttl, data
+        ))
+
+    async def _store(self, key: str, obj: T, delta: float = 0.0, generation: Optional[str] = None):
+        if not await self._write(key, self.ttl + self.stale_ttl, self.encode(obj, delta), generation):
+            return
+        self._remember(key, CacheEntry(obj, time.time() + self.ttl, delta))
+        await self._broadcast([key])
+
+    async def _store_negative(self, key: str, generation: Optional[str] = None):
+        if not await self._write(key, self.negative_ttl, NEGATIVE_SENTINEL, generation):
+            return
+        self._remember(key, CacheEntry(None, time.time() + self.negative_ttl, 0.0))
+        await self._broadcast([key])
+
+    async def get_cached_object(self, key: str, schema: Type[T]) -> Optional[T]:
+        entry = await self._read_entry(key, schema)
+        if entry is None or time.time() >= entry.fresh_until + self.stale_ttl:
+            return None
+        return entry.value
+
+    async def set_cached_object(self, key: str, obj: T):
+        await self._store(key, obj)
+
+    async def _read_many(self, keys: Sequence[str], schema: Type[T]) -> List[Optional[CacheEntry]]:
+        """Entries for keys in order: local tier first, then one MGET (with TTLs) for the rest."""
+        entries: List[Optional[CacheEntry]] = [None] * len(keys)
+        remote = []
+        for i, key in enumerate(keys):
+            entry = self.local.get(key, _MISSING) if self.local is not None else _MISSING
+            if entry is _MISSING:
+                remote.append(i)
+                continue
+            self._count("local", "hit")
+            if entry.value is None:
+                CACHE_NEGATIVE_HITS.labels(cache=self.prefix).inc()
+            entries[i] = entry
+        if self.local is not None and remote:
+            CACHE_REQUESTS.labels(cache=self.prefix, tier="local", result="miss").inc(len(remote))
+        if not remote:
+            return entries
+
+        redis = await get_binary_redis()
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.mget([f"{self.prefix}:{keys[i]}" for i in remote])
+            for i in remote:
+                pipe.pttl(f"{self.prefix}:{keys[i]}")
+            values, *pttls = await pipe.execute()
+        for i, data, pttl_ms in zip(remote, values, pttls):
+            if not data:
+                self._count("redis", "miss")
+                continue
+            self._count("redis", "hit")
+            entry = self._with_ttl(self.decode(data, schema), pttl_ms)
+            if entry.value is None:
+                CACHE_NEGATIVE_HITS.labels(cache=self.prefix).inc()
+            self._remember(keys[i], entry)
+            entries[i] = entry
+        return entries
+
+    async def get_many(self, keys: Sequence[str], schema: Type[T]) -> List[Optional[T]]:
+        """Cached objects for keys, in input order; None where missing."""
+        now = time.time()
+        return [
+            entry.value if entry is not None and now < entry.fresh_until + self.stale_ttl else None
+            for entry in await self._read_many(keys, schema)
+        ]
+
+    async def set_many(
+        self,
+        items: Mapping[str, T],
+        missing: Sequence[str] = (),
+        generations: Optional[Mapping[str, str]] = None
+    ):
+        """
+        Store objects, and negative entries for missing keys, in one pipeline.
+        Keys with an entry in generations are skipped if invalidated since.
+        """
+        writes = [(key, self.ttl + self.stale_ttl, self.encode(obj), obj) for key, obj in items.items()]
+        if self.negative_ttl:
+            writes += [(key, self.negative_ttl, NEGATIVE_SENTINEL, None) for key in missing]
+        if not writes:
+            return
+        generations = generations or {}
+        redis = await get_binary_redis()
+        async with redis.pipeline(transaction=False) as pipe:
+            for key, ttl, data, _ in writes:
+                if key in generations:
+                    pipe.eval(
+                        STORE_IF_CURRENT_SCRIPT, 2, f"{self.prefix}:{key}", self._generation_key(key),
+                        generations[key], ttl, data
+                    )
+                else:
+                    pipe.setex(f"{self.prefix}:{key}", ttl, data)
+            results = await pipe.execute()
+
+        stored = []
+        for (key, ttl, _, obj), result in zip(writes, results):
+            if key in generations and not result:
+                continue
+            self._remember(key, CacheEntry(obj, time.time() + (self.ttl if obj is not None else ttl), 0.0))
+            stored.append(key)
+        await self._broadcast(stored)
+
+    async def get_or_set_many(
+        self,
+        keys: Sequence[str],
+        schema: Type[T],
+        bulk_fetcher: Callable[[List[str]], Awaitable[Mapping[str, Any]]]
+    ) -> List[Optional[T]]:
+        """
+        Bulk cache-aside: one MGET, then a single bulk_fetcher call with only
+        the missing keys (it returns key -> object for those it found). Keys
+        the fetcher does not return are cached negatively. Results follow
+        the input order, with None for objects that do not exist.
+        """
+        now = time.time()
+        found: Dict[str, Optional[T]] = {}
+        for key, entry in zip(keys, await self._read_many(keys, schema)):
+            # Stale entries are refetched with the misses; it is one query either way
+            if entry is not None and now < entry.fresh_until:
+                found[key] = entry.value
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing:
+            generations = dict(zip(missing, await self._generations(missing)))
+            fetched = {
+                key: schema.model_validate(obj)
+                for key, obj in (await bulk_fetcher(missing)).items()
+                if obj is not None
+            }
+            await self.set_many(fetched, [key for key in missing if key not in fetched], generations)
+            found.update(fetched)
+        return [found.get(key) for key in keys]
 
     async def invalidate(self, key: str):
         redis = await get_redis()
-        await redis.delete(f"{self.prefix}:{key}")
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.delete(f"{self.prefix}:{key}")
+            # Outlives any fetch that could have started before this call
+            pipe.incr(self._generation_key(key))
+            pipe.expire(self._generation_key(key), self.ttl + self.stale_ttl)
+            await pipe.execute()
+        # Callers already waiting keep the old fetch; new ones start afresh
+        self._inflight.pop(key, None)
+        if self.local is not None:
+            self.local.delete(key)
+            await self._broadcast([key])
+
+    def _should_refresh(self, entry: CacheEntry) -> bool:
+        """XFetch: refresh early with a probability that grows as expiry nears."""
+        delta = entry.delta or self.fetch_time
+        jitter = -delta * self.beta * math.log(1.0 - random.random())
+        return time.time() + jitter >= entry.fresh_until
 
     async def get_or_set(
-        self, 
-        key: str, 
-        schema: Type[T], 
-        fetcher: Callable[[], Awaitable[Optional[T]]]
+        self,
+        key: str,
+        schema: Type[T],
+        fetcher: Callable[[], Awaitable[Optional[Any]]]
     ) -> Optional[T]:
         """Cache-aside pattern implementation."""
-        cached = await self.get_cached_object(key, schema)
-        if cached:
-            return cached
-        
-        fresh = await fetcher()
-        if fresh:
-            await self.set_cached_object(key, fresh)
-        return fresh
+        entry = await self._read_entry(key, schema)
+        if entry is not None and time.time() < entry.fresh_until + self.stale_ttl:
+            if not self._should_refresh(entry):
+                return entry.value
+            if self.stale_ttl:
+                # Serve the current value; one background task refreshes it
+                self._start_fetch(key, schema, fetcher)
+                return entry.value
+
+        return await asyncio.shield(self._start_fetch(key, schema, fetcher))
+
+    def _start_fetch(self, key: str, schema: Type[T], fetcher) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch_locked(key, schema, fetcher))
+            self._inflight[key] = task
+            task.add_done_callback(functools.partial(self._fetch_done, key))
+        return task
+
+    def _fetch_done(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Cache fill of %s:%s failed: %s", self.prefix, key, task.exception())
+
+    async def _fetch_locked(self, key: str, schema: Type[T], fetcher) -> Optional[T]:
+        redis = await get_binary_redis()
+        lock_key = f"{self.prefix}:{key}:lock"
+        token = uuid.uuid4().hex
+
+        if not await redis.set(lock_key, token, nx=True, px=self.lock_timeout_ms):
+            # Another worker is filling this key; wait for its result
+            deadline = time.monotonic() + self.lock_timeout_ms / 1000
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+                data = await redis.get(f"{self.prefix}:{key}")
+                if data:
+                    entry = self.decode(data, schema)
+                    if time.time() < entry.fresh_until:
+                        self._remember(key, entry)
+                        return entry.value
+            # The lock holder is slow or gone: fetch without the lock
+            token = None
+
+        try:
+            started = time.monotonic()
+            generation = (await self._generations([key]))[0]
+            fresh = await fetcher()
+            if fresh:
+                # Fetchers may return ORM rows; cache the validated schema
+                fresh = schema.model_validate(fresh)
+                elapsed = time.monotonic() - started
+                self.fetch_time = elapsed if not self.fetch_time else 0.8 * self.fetch_time + 0.2 * elapsed
+                await self._store(key, fresh, elapsed, generation)
+            elif self.negative_ttl:
+                await self._store_negative(key, generation)
+            return fresh
+        finally:
+            if token:
+                await redis.eval(RELEASE_LOCK_SCRIPT, 1, lock_key, token)
+
+def apply_invalidation(message: str):
+    """Drop a key from the local tier of the cache named in a pub/sub message."""
+    payload = json.loads(message)
+    if payload.get("origin") == _ORIGIN:
+        return
+    cache = _caches.get(payload["prefix"])
+    if cache is not None and cache.local is not None:
+        cache.local.delete(payload["key"])
+
+async def listen_for_invalidations():
+    """Apply invalidations published by other workers (run as a background task)."""
+    while True:
+        try:
+            redis = await get_redis()
+            pubsub = redis.pubsub()
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    apply_invalidation(message["data"])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Entries missed while disconnected still expire after CACHE_LOCAL_TTL
+            logger.warning("Cache invalidation listener failed: %s", e)
+            for cache in _caches.values():
+                if cache.local is not None:
+                    cache.local.clear()
+            await asyncio.sleep(1)
 
 # Specific caches
-profile_cache = CacheService(prefix="profile", ttl=3600)
+profile_cache = CacheService(
+    prefix="profile", ttl=3600, local_size=settings.PROFILE_CACHE_LOCAL_SIZE, stale_ttl=300
+)
 session_cache = CacheService(prefix="session", ttl=86400) # 24h
@@ -1,35 +1,456 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
+from collections import OrderedDict
+import asyncio
+import json
+import logging
 import uuid
 from datetime import datetime
-from sqlalchemy import select, or_, and_
+from sqlalchemy import select, insert, update, or_, and_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DataError, IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from prometheus_client import Counter
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.core.redis import get_redis
+from redis.exceptions import WatchError
 from app.models.chat import Message, ChatRoom, Conversation
 from app.services.location import search_users_nearby
 import bleach
 
+logger = logging.getLogger(__name__)
+
+CHAT_FLUSH_FAILURES = Counter(
+    "chat_message_flush_failures_total",
+    "Chat message rows whose flush failed, by what happened next",
+    ["outcome"]
+)
+
+# Rows that could not be written after every retry, replayed by a periodic task
+DEAD_LETTER_KEY = "chat:dead_letter"
+# Rows the database rejects on their own; kept for inspection, never retried
+POISON_KEY = "chat:poison"
+
+# Message types clients may send; SYSTEM messages are only created server-side
+CLIENT_MESSAGE_TYPES = ("TEXT", "IMAGE", "VIDEO")
+
+# Remove replayed entries by value, leaving any a concurrent replay or a
+# new dead-lettering added untouched
+REMOVE_ENTRIES_SCRIPT = """
+local removed = 0
+for _, entry in ipairs(ARGV) do
+    removed = removed + redis.call("lrem", KEYS[1], 1, entry)
+end
+return removed
+"""
+
+def message_error(content: Any, type: Any) -> Optional[str]:
+    """Why a client-sent message cannot be stored, or None if it can."""
+    if type not in CLIENT_MESSAGE_TYPES:
+        return f"Message type must be one of {', '.join(CLIENT_MESSAGE_TYPES)}"
+    if not isinstance(content, str) or not content:
+        return "Message content is required"
+    if len(content) > settings.CHAT_MAX_MESSAGE_LENGTH:
+        return f"Messages are limited to {settings.CHAT_MAX_MESSAGE_LENGTH} characters"
+    return None
+
+def serialize_message(row: Dict[str, Any]) -> Dict[str, Any]:
+    """JSON-safe socket payload for a message row."""
+    return {
+        key: (value.isoformat() if isinstance(value, datetime) else str(value) if isinstance(value, uuid.UUID) else value)
+        for key, value in row.items()
+        if value is not None
+    }
+
+def deserialize_message(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Inverse of serialize_message, for rows read back from Redis."""
+    row = dict(data)
+    # serialize_message omits None; batched INSERTs need the same keys in every row
+    for key in ("id", "sender_id", "room_id", "conversation_id"):
+        row[key] = uuid.UUID(row[key]) if row.get(key) else None
+    row["created_at"] = datetime.fromisoformat(row["created_at"])
+    return row
+
+class MessageWriter:
+    """
+    Write-behind buffer for chat messages.
+
+    Messages are queued with their ID and timestamp already assigned and
+    flushed to the messages table in multi-row INSERTs every
+    flush_interval_ms or batch_size messages, whichever comes first. The
+    queue is bounded: when it is full, submit() waits, which pushes back on
+    the sending socket handlers. In "sync" durability mode submit() also
+    waits until the batch containing the message has been committed.
+
+    A failed flush is retried with exponential backoff (the queue keeps
+    absorbing new messages meanwhile); rows that still fail are pushed to
+    a Redis dead-letter list for replay_dead_letters rather than dropped.
+    A batch the database rejects for its data is split in halves until
+    the offending rows are isolated; those are parked on their own list so
+    the rest of the batch is written.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = settings.CHAT_FLUSH_BATCH_SIZE,
+        flush_interval_ms: int = settings.CHAT_FLUSH_INTERVAL_MS,
+        max_queue: int = settings.CHAT_WRITE_QUEUE_SIZE,
+        durability: str = settings.CHAT_WRITE_MODE,
+        retries: int = settings.CHAT_FLUSH_RETRIES,
+        backoff_ms: int = settings.CHAT_FLUSH_BACKOFF_MS
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_queue = max_queue
+        self.durability = durability
+        self.retries = retries
+        self.backoff = backoff_ms / 1000
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            if self._queue is None:
+                self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, row: Dict[str, Any]):
+        self._ensure_started()
+        done = asyncio.get_running_loop().create_future() if self.durability == "sync" else None
+        await self._queue.put((row, done))
+        if done is not None:
+            await done
+
+    async def stop(self):
+        """Flush everything still queued and stop the background task."""
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[Dict[str, Any], Optional[asyncio.Future]]]):
+        rows = [row for row, _ in batch]
+        error = None
+        rejected: Dict[uuid.UUID, Exception] = {}
+        for attempt in range(self.retries + 1):
+            if attempt:
+                CHAT_FLUSH_FAILURES.labels(outcome="retried").inc(len(rows))
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                # Halves written before a failed attempt are already committed
+                rejected = await self._write_isolating(rows, skip_existing=attempt > 0)
+                error = None
+                break
+            except Exception as e:
+                error = e
+                logger.warning("Message flush of %d rows failed (attempt %d): %s", len(rows), attempt + 1, e)
+
+        if error is not None:
+            await self._dead_letter(rows)
+        elif rejected:
+            await self._park([row for row in rows if row["id"] in rejected])
+
+        for row, done in batch:
+            if done is not None and not done.done():
+                row_error = error or rejected.get(row["id"])
+                if row_error is None:
+                    done.set_result(None)
+                else:
+                    done.set_exception(row_error)
+            self._queue.task_done()
+
+    async def _write_isolating(
+        self, rows: List[Dict[str, Any]], skip_existing: bool = False
+    ) -> Dict[uuid.UUID, Exception]:
+        """
+        Write rows, bisecting around any the database rejects for their data.
+        Returns message ID -> error for the rows that could not be written;
+        other errors (connection loss and the like) propagate.
+        """
+        try:
+            await self._write(rows, skip_existing=skip_existing)
+            return {}
+        except (DataError, IntegrityError) as e:
+            if len(rows) == 1:
+                return {rows[0]["id"]: e}
+        middle = len(rows) // 2
+        rejected = await self._write_isolating(rows[:middle], skip_existing)
+        rejected.update(await self._write_isolating(rows[middle:], skip_existing))
+        return rejected
+
+    async def _park(self, rows: List[Dict[str, Any]]):
+        CHAT_FLUSH_FAILURES.labels(outcome="rejected").inc(len(rows))
+        logger.error("Parking %d chat messages the database rejected", len(rows))
+        try:
+            redis = await get_redis()
+            await redis.rpush(POISON_KEY, *[json.dumps(serialize_message(row)) for row in rows])
+        except Exception as e:
+            logger.error("Could not park rejected chat messages: %s", e)
+
+    async def _dead_letter(self, rows: List[Dict[str, Any]]):
+        try:
+            redis = await get_redis()
+            await redis.rpush(DEAD_LETTER_KEY, *[json.dumps(serialize_message(row)) for row in rows])
+            CHAT_FLUSH_FAILURES.labels(outcome="dead_lettered").inc(len(rows))
+            logger.error("Dead-lettered %d chat messages after failed flush", len(rows))
+        except Exception as e:
+            CHAT_FLUSH_FAILURES.labels(outcome="dropped").inc(len(rows))
+            logger.error("Dropping %d chat messages: flush and dead-letter both failed: %s", len(rows), e)
+
+    async def replay_dead_letters(self, batch_size: int = 1000) -> int:
+        """
+        Write dead-lettered rows back to the messages table; returns the
+        number replayed. Rows the database rejects are parked rather than
+        blocking the list.
+        """
+        redis = await get_redis()
+        replayed = 0
+        while True:
+            entries = await redis.lrange(DEAD_LETTER_KEY, 0, batch_size - 1)
+            if not entries:
+                return replayed
+            rows = [deserialize_message(json.loads(e)) for e in entries]
+            # Idempotent: a flush that failed after its commit landed, or a
+            # concurrent replay, may already have stored these
+            rejected = await self._write_isolating(rows, skip_existing=True)
+            if rejected:
+                await self._park([row for row in rows if row["id"] in rejected])
+            await redis.eval(REMOVE_ENTRIES_SCRIPT, 1, DEAD_LETTER_KEY, *entries)
+            replayed += len(entries) - len(rejected)
+
+    async def _write(self, rows: List[Dict[str, Any]], skip_existing: bool = False):
+        # Latest message per conversation, for a single last_message_at bump each
+        latest: Dict[uuid.UUID, datetime] = {}
+        for row in rows:
+            conv_id = row.get("conversation_id")
+            if conv_id and (conv_id not in latest or row["created_at"] > latest[conv_id]):
+                latest[conv_id] = row["created_at"]
+
+        async with SessionLocal() as db:
+            stmt = pg_insert(Message).on_conflict_do_nothing() if skip_existing else insert(Message)
+            await db.execute(stmt, rows)
+            for conv_id, created_at in latest.items():
+                await db.execute(
+                    update(Conversation)
+                    .where(Conversation.id == conv_id)
+                    .values(last_message_at=created_at)
+                )
+            await db.commit()
+
+def conversation_pair_key(u1: uuid.UUID, u2: uuid.UUID) -> str:
+    return f"chat:conv:{u1}:{u2}"
+
+def recent_messages_key(room_id: Optional[uuid.UUID] = None, conversation_id: Optional[uuid.UUID] = None) -> str:
+    if room_id:
+        return f"chat:recent:room:{room_id}"
+    return f"chat:recent:conv:{conversation_id}"
+
 class ChatService:
+    def __init__(self, conversation_cache_size: int = settings.CHAT_CONVERSATION_CACHE_SIZE):
+        self.writer = MessageWriter()
+        self.conversation_cache_size = conversation_cache_size
+        # Sorted user pair -> conversation ID, least recently used first
+        self._conversation_ids: "OrderedDict[Tuple[uuid.UUID, uuid.UUID], uuid.UUID]" = OrderedDict()
+
+    async def _upsert_conversation(self, db: AsyncSession, u1: uuid.UUID, u2: uuid.UUID) -> uuid.UUID:
+        """
+        Race-free creation: concurrent first messages between the same pair
+        both land on the unique (user_one_id, user_two_id) index. Runs in the
+        caller's transaction; committing is left to the caller.
+        """
+        stmt = (
+            pg_insert(Conversation)
+            .values(id=uuid.uuid4(), user_one_id=u1, user_two_id=u2, last_message_at=datetime.utcnow())
+            .on_conflict_do_nothing(index_elements=["user_one_id", "user_two_id"])
+            .returning(Conversation.id)
+        )
+        conv_id = (await db.execute(stmt)).scalar()
+        if conv_id is None:
+            result = await db.execute(
+                select(Conversation.id).where(
+                    and_(
+                        Conversation.user_one_id == u1,
+                        Conversation.user_two_id == u2
+                    )
+                )
+            )
+            conv_id = result.scalar_one()
+        return conv_id
+
+    def _remember_conversation(self, pair: Tuple[uuid.UUID, uuid.UUID], conv_id: uuid.UUID):
+        self._conversation_ids[pair] = conv_id
+        self._conversation_ids.move_to_end(pair)
+        while len(self._conversation_ids) > self.conversation_cache_size:
+            self._conversation_ids.popitem(last=False)
+
+    async def get_conversation_id(self, user_one: uuid.UUID, user_two: uuid.UUID) -> uuid.UUID:
+        """
+        Resolve the conversation for a user pair: in-process LRU, then Redis,
+        then a single upsert. Warm lookups cost no database queries.
+        """
+        pair = tuple(sorted([user_one, user_two]))
+        conv_id = self._conversation_ids.get(pair)
+        if conv_id:
+            self._conversation_ids.move_to_end(pair)
+            return conv_id
+
+        redis = await get_redis()
+        key = conversation_pair_key(*pair)
+        cached = await redis.get(key)
+        if cached:
+            conv_id = uuid.UUID(cached)
+        else:
+            async with SessionLocal() as db:
+                conv_id = await self._upsert_conversation(db, *pair)
+                await db.commit()
+            await redis.setex(key, settings.CHAT_CONVERSATION_CACHE_TTL, str(conv_id))
+
+        self._remember_conversation(pair, conv_id)
+        return conv_id
+
     async def get_or_create_conversation(
         self, db: AsyncSession, user_one: uuid.UUID, user_two: uuid.UUID
     ) -> Conversation:
         # Sort IDs to ensure consistency
         u1, u2 = sorted([user_one, user_two])
         
-        stmt = select(Conversation).where(
-            and_(
-                Conversation.user_one_id == u1,
-                Conversation.user_two_id == u2
-            )
-        )
-        result = await db.execute(stmt)
-        conv = result.scalars().first()
-        
-        if not conv:
-            conv = Conversation(user_one_id=u1, user_two_id=u2)
-            db.add(conv)
-            await db.commit()
-            await db.refresh(conv)
-        
-        return conv
+        # Not remembered in the LRU: the caller may still roll the insert back
+        conv_id = await self._upsert_conversation(db, u1, u2)
+        result = await db.execute(select(Conversation).where(Conversation.id == conv_id))
+        return result.scalars().first()
+
+    def build_message(
+        self,
+        sender_id: uuid.UUID,
+        content: str,
+        type: str = "TEXT",
+        room_id: Optional[uuid.UUID] = None,
+        conversation_id: Optional[uuid.UUID] = None
+    ) -> Dict[str, Any]:
+        """Sanitize content and assign the message ID and timestamp up front."""
+        return {
+            "id": uuid.uuid4(),
+            "sender_id": sender_id,
+            "room_id": room_id,
+            "conversation_id": conversation_id,
+            "content": bleach.clean(content, tags=[], attributes={}, strip=True),
+            "type": type,
+            "created_at": datetime.utcnow()
+        }
+
+    async def queue_message(
+        self,
+        sender_id: uuid.UUID,
+        content: str,
+        type: str = "TEXT",
+        room_id: Optional[uuid.UUID] = None,
+        conversation_id: Optional[uuid.UUID] = None
+    ) -> Dict[str, Any]:
+        """
+        Hand a message to the write-behind writer and return its row so the
+        caller can emit it without waiting for the INSERT.
+        """
+        row = self.build_message(sender_id, content, type, room_id, conversation_id)
+        await self.writer.submit(row)
+        await self.push_recent(row)
+        return row
+
+    async def push_recent(self, row: Dict[str, Any]):
+        """Prepend a message to its room/conversation ring buffer."""
+        redis = await get_redis()
+        key = recent_messages_key(row.get("room_id"), row.get("conversation_id"))
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.lpush(key, json.dumps(serialize_message(row)))
+            pipe.ltrim(key, 0, settings.CHAT_RECENT_SIZE - 1)
+            pipe.expire(key, settings.CHAT_RECENT_TTL)
+            # Keep the completeness marker alive exactly as long as the list
+            pipe.expire(f"{key}:complete", settings.CHAT_RECENT_TTL)
+            await pipe.execute()
+
+    async def get_recent(self, key: str, limit: int) -> Optional[List[Dict[str, Any]]]:
+        """
+        Newest-first messages from the ring buffer, up to limit + 1 so the
+        caller can detect has_next. Returns None when the buffer cannot
+        answer the request and Postgres must be used instead.
+
+        The list always holds a contiguous run of the newest messages, so
+        more than limit entries is a full page. Fewer is only the whole
+        history if the list was marked complete when backfilled.
+        """
+        if limit + 1 > settings.CHAT_RECENT_SIZE:
+            return None
+        redis = await get_redis()
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.exists(f"{key}:complete")
+            pipe.lrange(key, 0, limit)
+            complete, raw = await pipe.execute()
+
+        if len(raw) <= limit and not complete:
+            return None
+        return [json.loads(item) for item in raw]
+
+    async def fill_recent(self, key: str, messages: List[Dict[str, Any]], complete: bool):
+        """
+        Backfill a cold ring buffer from a first-page DB read, keeping any
+        messages pushed since the query ran. complete marks that the page
+        was the entire history. The merge is retried if a push lands while
+        it is computed.
+        """
+        redis = await get_redis()
+        async with redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    pushed = [json.loads(item) for item in await pipe.lrange(key, 0, -1)]
+                    merged = self._merge_recent(pushed, messages)
+                    pipe.multi()
+                    pipe.delete(key)
+                    if merged:
+                        pipe.rpush(key, *merged)
+                    pipe.expire(key, settings.CHAT_RECENT_TTL)
+                    if complete:
+                        pipe.setex(f"{key}:complete", settings.CHAT_RECENT_TTL, 1)
+                    else:
+                        pipe.delete(f"{key}:complete")
+                    await pipe.execute()
+                    return
+                except WatchError:
+                    continue
+
+    @staticmethod
+    def _merge_recent(pushed: List[Dict[str, Any]], messages: List[Dict[str, Any]]) -> List[str]:
+        """Newest-first, de-duplicated union of two message lists, capped to the buffer size."""
+        seen = set()
+        merged = []
+        for message in sorted(
+            pushed + messages, key=lambda m: datetime.fromisoformat(m["created_at"]), reverse=True
+        ):
+            if message["id"] in seen:
+                continue
+            seen.add(message["id"])
+            merged.append(json.dumps(message))
+        return merged[:settings.CHAT_RECENT_SIZE]
 
     async def save_message(
         self,
@@ -53,12 +474,12 @@ class ChatService:
         db.add(message)
         
         if conversation_id:
-            # Update last_message_at for the conversation
-            stmt = select(Conversation).where(Conversation.id == conversation_id)
-            result = await db.execute(stmt)
-            conv = result.scalars().first()
-            if conv:
-                conv.last_message_at = datetime.utcnow()
+            # Update last_message_at for the conversation in one statement
+            await db.execute(
+                update(Conversation)
+                .where(Conversation.id == conversation_id)
+                .values(last_message_at=datetime.utcnow())
+            )
         
         await db.commit()
         await db.refresh(message)
@@ -79,4 +500,4 @@ class ChatService:
             }]
         return []
 
-chat_service = ChatService()
\ No newline at end of file
+chat_service = ChatService()
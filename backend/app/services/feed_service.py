@@ -1,37 +1,363 @@
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+from datetime import datetime, timezone
+import heapq
+import logging
 import time
+from sqlalchemy import select, desc, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
 from app.core.redis import get_redis
+from app.services.cache import CacheService
+from app.models.community import StatusUpdate
+from app.models.user import Relationship
+from app.schemas.community import StatusUpdateSchema
 import uuid
 
+logger = logging.getLogger(__name__)
+
+GLOBAL_FEED_KEY = "feed:global"
+# Authors whose posts are pulled at read time instead of fanned out
+PULL_AUTHORS_KEY = "feed:pull_authors"
+
+FeedEntry = Tuple[str, float]
+
+def post_score(created_at: datetime) -> float:
+    """Feed score for a post: its creation time as a UTC epoch timestamp."""
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at.timestamp()
+
+def user_feed_key(user_id: Union[uuid.UUID, str]) -> str:
+    return f"feed:user:{user_id}"
+
+def author_feed_key(author_id: Union[uuid.UUID, str]) -> str:
+    return f"feed:author:{author_id}"
+
+def item_cache_key(post_id: Union[uuid.UUID, str]) -> str:
+    return f"feed:item:{post_id}"
+
+def pull_sources_key(user_id: Union[uuid.UUID, str]) -> str:
+    """Set of pull-mode authors a reader follows."""
+    return f"feed:pull:{user_id}"
+
 class FeedService:
-    async def add_post_to_feeds(self, post_id: uuid.UUID, author_id: uuid.UUID, follower_ids: List[uuid.UUID]):
+    def __init__(
+        self,
+        max_length: int = settings.FEED_MAX_LENGTH,
+        chunk_size: int = settings.FEED_FANOUT_CHUNK_SIZE,
+        pull_threshold: int = settings.FEED_PULL_THRESHOLD,
+        item_ttl: int = settings.FEED_ITEM_CACHE_TTL
+    ):
+        self.max_length = max_length
+        self.chunk_size = chunk_size
+        self.pull_threshold = pull_threshold
+        self.item_ttl = item_ttl
+        # Pre-serialized feed items under feed:item:<post_id>
+        self.items = CacheService(prefix="feed:item", ttl=item_ttl)
+
+    def is_pull_author(self, follower_count: int) -> bool:
+        return follower_count >= self.pull_threshold
+
+    async def add_post_to_feeds(
+        self,
+        post_id: Union[uuid.UUID, str],
+        author_id: Optional[Union[uuid.UUID, str]],
+        follower_ids: Sequence[Union[uuid.UUID, str]],
+        score: Optional[float] = None
+    ) -> List[Dict[str, float]]:
         """
-        Fan-out-on-Write: Add post to global feed and all followers' feeds.
+        Hybrid fan-out: Add post to the global and author feeds, then either
+        push it into every follower's feed or, for high-follower authors,
+        leave it to be merged in at read time by get_feed.
+
+        Followers are processed in chunks; each chunk is sent as a single
+        non-transactional pipeline, so the cost is one round trip per chunk
+        instead of two per follower. Returns per-chunk timing stats.
         """
         redis = await get_redis()
-        timestamp = int(time.time())
+        timestamp = score if score is not None else time.time()
         post_id_str = str(post_id)
 
-        # 1. Add to Global Feed
-        await redis.zadd("feed:global", {post_id_str: timestamp})
+        # 1. Add to Global and Author Feeds
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zadd(GLOBAL_FEED_KEY, {post_id_str: timestamp})
+            if author_id:
+                pipe.zadd(author_feed_key(author_id), {post_id_str: timestamp})
+                pipe.zremrangebyrank(author_feed_key(author_id), 0, -(self.max_length + 1))
+            await pipe.execute()
+
+        # 2. Pull mode: register the author with its followers once, skip the push
+        if author_id and self.is_pull_author(len(follower_ids)):
+            if await redis.sadd(PULL_AUTHORS_KEY, str(author_id)):
+                await self.register_pull_author(author_id, follower_ids)
+            return []
+
+        # 3. Push mode: add to Follower Feeds (Personalized), one pipeline per chunk
+        def queue_push(pipe, follower_id):
+            key = user_feed_key(follower_id)
+            pipe.zadd(key, {post_id_str: timestamp})
+            # Trim feed to the newest max_length items to save memory
+            pipe.zremrangebyrank(key, 0, -(self.max_length + 1))
 
-        # 2. Add to Follower Feeds (Personalized)
-        for follower_id in follower_ids:
-            await redis.zadd(f"feed:user:{follower_id}", {post_id_str: timestamp})
-            # Optional: Trim feed to last 500 items to save memory
-            await redis.zremrangebyrank(f"feed:user:{follower_id}", 0, -501)
+        return await self._run_chunked(redis, follower_ids, queue_push, f"post {post_id_str}")
 
-    async def get_feed(self, user_id: Optional[uuid.UUID] = None, limit: int = 20, cursor: Optional[float] = None) -> List[str]:
+    async def register_pull_author(
+        self,
+        author_id: Union[uuid.UUID, str],
+        follower_ids: Sequence[Union[uuid.UUID, str]]
+    ) -> List[Dict[str, float]]:
         """
-        Retrieve post IDs using score-based (timestamp) cursor pagination.
+        Record a pull-mode author in each follower's pull set so get_feed
+        knows which author feeds to merge.
         """
         redis = await get_redis()
-        key = f"feed:user:{user_id}" if user_id else "feed:global"
-        
-        # If no cursor, use +inf (latest)
-        max_score = cursor if cursor is not None else "+inf"
-        
-        # Fetch limit + 1 to detect has_next
-        return await redis.zrevrangebyscore(key, max_score, "-inf", start=0, num=limit + 1)
+        author_id_str = str(author_id)
+
+        def queue_register(pipe, follower_id):
+            pipe.sadd(pull_sources_key(follower_id), author_id_str)
+
+        return await self._run_chunked(redis, follower_ids, queue_register, f"pull author {author_id_str}")
+
+    async def follow_author(self, follower_id: Union[uuid.UUID, str], author_id: Union[uuid.UUID, str]):
+        """Register a newly followed author for pull-mode merging if needed."""
+        redis = await get_redis()
+        if await redis.sismember(PULL_AUTHORS_KEY, str(author_id)):
+            await redis.sadd(pull_sources_key(follower_id), str(author_id))
+
+    async def followed_pull_authors(self, db: AsyncSession, user_id: Union[uuid.UUID, str]) -> List[str]:
+        """
+        Pull-mode authors the reader still follows. The pull set is only
+        added to at fan-out time, so it is checked against the current
+        accepted relationships and authors no longer followed are dropped.
+        """
+        redis = await get_redis()
+        registered = await redis.smembers(pull_sources_key(user_id))
+        if not registered:
+            return []
+
+        result = await db.execute(select(Relationship.to_user_id).where(
+            Relationship.from_user_id == user_id,
+            Relationship.to_user_id.in_([uuid.UUID(a) for a in registered]),
+            Relationship.type == "FRIEND",
+            Relationship.status == "ACCEPTED"
+        ))
+        followed = [str(author_id) for author_id in result.scalars()]
+        stale = registered.difference(followed)
+        if stale:
+            await redis.srem(pull_sources_key(user_id), *stale)
+        return followed
+
+    async def rebuild_user_feed(self, db: AsyncSession, user_id: Union[uuid.UUID, str]) -> int:
+        """
+        Materialize a reader's feed from status_updates with a single query
+        over the authors they follow, then replace the zset atomically.
+        Returns the number of entries loaded.
+        """
+        following = select(Relationship.to_user_id).where(
+            Relationship.from_user_id == user_id,
+            Relationship.type == "FRIEND",
+            Relationship.status == "ACCEPTED"
+        )
+        stmt = (
+            select(StatusUpdate.id, StatusUpdate.created_at)
+            .where(StatusUpdate.author_id.in_(following.scalar_subquery()))
+            .order_by(desc(StatusUpdate.created_at))
+            .limit(self.max_length)
+        )
+        return await self._load_feed(db, user_feed_key(user_id), stmt)
+
+    async def rebuild_author_feed(self, db: AsyncSession, author_id: Union[uuid.UUID, str]) -> int:
+        stmt = (
+            select(StatusUpdate.id, StatusUpdate.created_at)
+            .where(StatusUpdate.author_id == author_id)
+            .order_by(desc(StatusUpdate.created_at))
+            .limit(self.max_length)
+        )
+        return await self._load_feed(db, author_feed_key(author_id), stmt)
+
+    async def rebuild_pull_authors(self, db: AsyncSession) -> int:
+        """
+        Restore pull-mode state lost with Redis: the registry of authors at
+        or above the pull threshold, their author feeds, and every
+        follower's pull set. Returns the number of pull authors.
+        """
+        accepted = (Relationship.type == "FRIEND", Relationship.status == "ACCEPTED")
+        result = await db.execute(
+            select(Relationship.to_user_id)
+            .where(*accepted)
+            .group_by(Relationship.to_user_id)
+            .having(func.count() >= self.pull_threshold)
+        )
+        authors = result.scalars().all()
+
+        redis = await get_redis()
+        for author_id in authors:
+            await self.rebuild_author_feed(db, author_id)
+            result = await db.execute(
+                select(Relationship.from_user_id).where(Relationship.to_user_id == author_id, *accepted)
+            )
+            await redis.sadd(PULL_AUTHORS_KEY, str(author_id))
+            await self.register_pull_author(author_id, result.scalars().all())
+        return len(authors)
+
+    async def rebuild_global_feed(self, db: AsyncSession) -> int:
+        stmt = (
+            select(StatusUpdate.id, StatusUpdate.created_at)
+            .order_by(desc(StatusUpdate.created_at))
+            .limit(self.max_length)
+        )
+        return await self._load_feed(db, GLOBAL_FEED_KEY, stmt)
+
+    async def _load_feed(self, db: AsyncSession, key: str, stmt) -> int:
+        result = await db.execute(stmt)
+        mapping = {str(post_id): post_score(created_at) for post_id, created_at in result.all()}
+
+        redis = await get_redis()
+        async with redis.pipeline(transaction=True) as pipe:
+            pipe.delete(key)
+            if mapping:
+                pipe.zadd(key, mapping)
+            await pipe.execute()
+        return len(mapping)
+
+    async def _run_chunked(self, redis, follower_ids, queue, label: str) -> List[Dict[str, float]]:
+        stats = []
+        for offset in range(0, len(follower_ids), self.chunk_size):
+            chunk = follower_ids[offset:offset + self.chunk_size]
+            started = time.perf_counter()
+
+            async with redis.pipeline(transaction=False) as pipe:
+                for follower_id in chunk:
+                    queue(pipe, follower_id)
+                await pipe.execute()
+
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            stats.append({"offset": offset, "size": len(chunk), "elapsed_ms": elapsed_ms})
+            logger.info(
+                "Fan-out of %s: chunk %d (%d followers) in %.1f ms",
+                label, offset // self.chunk_size, len(chunk), elapsed_ms
+            )
+
+        return stats
+
+    async def get_feed(
+        self,
+        user_id: Optional[uuid.UUID] = None,
+        limit: int = 20,
+        cursor: Optional[Tuple[float, str]] = None,
+        db: Optional[AsyncSession] = None
+    ) -> List[FeedEntry]:
+        """
+        Retrieve (post ID, score) pairs newest first using keyset pagination.
+
+        The cursor is the (score, post ID) of the last entry already served and
+        is an exclusive bound, so posts sharing a score are never skipped or
+        repeated. Personalized feeds are a k-way merge of the reader's
+        materialized feed and the author feeds of any pull-mode authors they
+        follow; with db given, those are checked against current
+        relationships. Returns up to limit + 1 entries to detect has_next.
+        """
+        redis = await get_redis()
+
+        if user_id:
+            if db is not None:
+                pull_authors = await self.followed_pull_authors(db, user_id)
+            else:
+                pull_authors = await redis.smembers(pull_sources_key(user_id))
+            keys = [user_feed_key(user_id)] + [author_feed_key(a) for a in pull_authors]
+        else:
+            keys = [GLOBAL_FEED_KEY]
+
+        async with redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                self._queue_page(pipe, key, cursor, limit + 1)
+            results = await pipe.execute()
+
+        step = 2 if cursor else 1
+        sources = [
+            self._after_cursor(results[i:i + step], cursor, limit + 1)
+            for i in range(0, len(results), step)
+        ]
+        if len(sources) == 1:
+            return sources[0]
+        return self._merge(sources, limit + 1)
+
+    @staticmethod
+    def _queue_page(pipe, key: str, cursor: Optional[Tuple[float, str]], count: int):
+        if cursor is None:
+            pipe.zrevrangebyscore(key, "+inf", "-inf", start=0, num=count, withscores=True)
+            return
+        score, _member = cursor
+        # Entries tied with the cursor score, then everything strictly below it
+        pipe.zrevrangebyscore(key, score, score, withscores=True)
+        pipe.zrevrangebyscore(key, f"({score!r}", "-inf", start=0, num=count, withscores=True)
+
+    @staticmethod
+    def _after_cursor(results: List[List[FeedEntry]], cursor: Optional[Tuple[float, str]], count: int) -> List[FeedEntry]:
+        if cursor is None:
+            return results[0]
+        ties, below = results
+        # Ties come back in reverse lexicographic order; keep those past the cursor member
+        _score, member = cursor
+        return ([entry for entry in ties if entry[0] < member] + below)[:count]
+
+    async def get_cached_items(self, post_ids: Sequence[Union[uuid.UUID, str]]) -> Dict[str, StatusUpdateSchema]:
+        """
+        Look up pre-serialized feed items with a single MGET.
+        Returns only the hits, keyed by post ID string.
+        """
+        keys = [str(pid) for pid in post_ids]
+        items = await self.items.get_many(keys, StatusUpdateSchema)
+        return {key: item for key, item in zip(keys, items) if item is not None}
+
+    async def cache_items(self, items: Iterable[StatusUpdateSchema]):
+        """Write-through of hydrated feed items, one pipeline for the batch."""
+        await self.items.set_many({str(item.id): item for item in items})
+
+    async def hydrate_items(self, db: AsyncSession, post_ids: Sequence[str]) -> List[StatusUpdateSchema]:
+        """
+        Feed items in post_ids order: one MGET, then one IN query for the
+        misses. Posts deleted since fan-out are skipped.
+        """
+        async def load(missing: List[str]) -> Dict[str, StatusUpdate]:
+            stmt = select(StatusUpdate).where(StatusUpdate.id.in_([uuid.UUID(pid) for pid in missing]))
+            result = await db.execute(stmt)
+            return {str(update.id): update for update in result.scalars()}
+
+        items = await self.items.get_or_set_many(list(post_ids), StatusUpdateSchema, load)
+        return [item for item in items if item is not None]
+
+    async def remove_post(self, post_id: Union[uuid.UUID, str], author_id: Optional[Union[uuid.UUID, str]] = None):
+        """
+        Drop a deleted or moderated post from the item cache and the shared feeds.
+        Personalized feeds are left to age out; readers skip IDs that no longer hydrate.
+        """
+        post_id_str = str(post_id)
+        # Bumps the item's generation, so a hydrate that loaded the post
+        # before it was removed does not cache it again
+        await self.items.invalidate(post_id_str)
+        redis = await get_redis()
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.zrem(GLOBAL_FEED_KEY, post_id_str)
+            if author_id:
+                pipe.zrem(author_feed_key(author_id), post_id_str)
+            await pipe.execute()
+
+    @staticmethod
+    def _merge(sources: List[List[FeedEntry]], count: int) -> List[FeedEntry]:
+        """
+        Merge descending (member, score) lists, dropping duplicate members
+        (a post may be both pushed and pulled around threshold changes).
+        """
+        merged = []
+        seen = set()
+        for member, score in heapq.merge(*sources, key=lambda entry: (entry[1], entry[0]), reverse=True):
+            if member in seen:
+                continue
+            seen.add(member)
+            merged.append((member, score))
+            if len(merged) == count:
+                break
+        return merged
 
 feed_service = FeedService()
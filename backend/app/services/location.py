@@ -1,7 +1,11 @@
-from typing import Optional, Dict
+from typing import Any, Dict, List, Optional, Tuple
 import httpx
+from sqlalchemy import Float, and_, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.core.config import settings
+from app.core.pagination import decode_score_cursor, encode_score_cursor
 from app.core.redis import get_redis
+from app.models.user import Profile
 import uuid
 
 async def get_location_from_ip(ip: str) -> Optional[Dict]:
@@ -62,3 +66,123 @@ async def search_users_nearby(lat: float, lng: float, radius_km: float = 50):
         # Fallback for older redis versions if needed
         print(f"Redis GeoSearch error: {e}")
         return []
+
+def profile_distance(lat: float, lng: float):
+    """SQL expression: great-circle distance in metres from (lat, lng) to a profile."""
+    return func.earth_distance(
+        func.ll_to_earth(lat, lng),
+        func.ll_to_earth(Profile.location_lat, Profile.location_lng)
+    )
+
+def profile_knn_distance(lat: float, lng: float):
+    """
+    SQL expression: straight-line (chord) distance in metres. Orders exactly
+    like profile_distance but ORDER BY on it is a KNN scan of
+    ix_profiles_location_earth, which stops after the first rows.
+    """
+    return func.ll_to_earth(Profile.location_lat, Profile.location_lng).op("<->", return_type=Float)(
+        func.ll_to_earth(lat, lng)
+    )
+
+def profile_within_radius(lat: float, lng: float, radius_km: float):
+    """
+    SQL condition for profiles within radius_km of (lat, lng). The earth_box
+    test is served by ix_profiles_location_earth; the distance check trims
+    the box corners.
+    """
+    radius_m = radius_km * 1000
+    point = func.ll_to_earth(Profile.location_lat, Profile.location_lng)
+    return and_(
+        func.earth_box(func.ll_to_earth(lat, lng), radius_m).op("@>")(point),
+        profile_distance(lat, lng) <= radius_m
+    )
+
+async def search_users_nearest(lat: float, lng: float, radius_km: float, count: int) -> List[Tuple[str, float]]:
+    """The `count` closest users within the radius as (user ID, metres), nearest first."""
+    redis = await get_redis()
+    results = await redis.geosearch(
+        "geo:users",
+        longitude=lng,
+        latitude=lat,
+        radius=radius_km * 1000,
+        unit="m",
+        sort="ASC",
+        count=count,
+        withdist=True
+    )
+    return sorted(((member, float(dist)) for member, dist in results), key=lambda entry: (entry[1], entry[0]))
+
+def encode_nearest_cursor(dist: float, member: str, scanned: int) -> str:
+    """(distance, user ID) position plus how many geo members precede it."""
+    return encode_score_cursor(dist, f"{member}/{scanned}")
+
+def decode_nearest_cursor(cursor: Optional[str]) -> Tuple[Optional[Tuple[float, str]], int]:
+    decoded = decode_score_cursor(cursor)
+    if decoded is None:
+        return None, 0
+    dist, member = decoded
+    member, _, scanned = member.partition("/")
+    return (dist, member), int(scanned) if scanned.isdigit() else 0
+
+async def paginate_nearest_from_redis(
+    db: AsyncSession,
+    query: select,
+    lat: float,
+    lng: float,
+    radius_km: float,
+    limit: int = 20,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Distance-ordered page from the Redis geo index. Only the closest
+    candidates are fetched (GEOSEARCH ASC COUNT), then filtered in one
+    query; the window grows only when filters reject too many of them.
+    The cursor records how many members precede it, so a page fetches
+    that many plus its own window instead of regrowing from the origin,
+    and at most GEO_NEARBY_MAX_CANDIDATES past the cursor. A page that
+    reaches that cap ends early with has_next set rather than truncating
+    the results. Items are (profile, metres) rows.
+    """
+    position, skip = decode_nearest_cursor(cursor)
+    want = limit + 1
+    window = want * 2
+
+    while True:
+        count = skip + window
+        candidates = await search_users_nearest(lat, lng, radius_km, count)
+        exhausted = len(candidates) < count
+        # (rank among all members, user ID, metres) of the candidates past the cursor
+        after = [
+            (rank, member, dist)
+            for rank, (member, dist) in enumerate(candidates)
+            if position is None or (dist, member) > position
+        ]
+
+        rows = []
+        if after:
+            result = await db.execute(query.where(Profile.id.in_([uuid.UUID(m) for _, m, _ in after])))
+            by_id = {str(profile.id): profile for profile in result.scalars()}
+            rows = [(rank, by_id[member], dist) for rank, member, dist in after if member in by_id]
+
+        capped = window >= settings.GEO_NEARBY_MAX_CANDIDATES
+        if len(rows) >= want or exhausted or capped:
+            break
+        window = min(window * 4, settings.GEO_NEARBY_MAX_CANDIDATES)
+
+    has_next = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_next:
+        rank, profile, dist = rows[-1]
+        next_cursor = encode_nearest_cursor(dist, str(profile.id), rank + 1)
+    elif capped and not exhausted and after:
+        # Filters rejected the whole window: resume after the last candidate read
+        rank, member, dist = after[-1]
+        has_next = True
+        next_cursor = encode_nearest_cursor(dist, member, rank + 1)
+    rows = [(profile, dist) for _rank, profile, dist in rows]
+
+    return {
+        "items": rows,
+        "metadata": {"has_next": has_next, "next_cursor": next_cursor, "count": len(rows)}
+    }
@@ -3,6 +3,13 @@ import uuid
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
 from app.models.community import ContentReport, ForumThread, ForumPost, StatusUpdate
+from app.services.feed_service import feed_service
+
+MODEL_MAP = {
+    "THREAD": ForumThread,
+    "POST": ForumPost,
+    "STATUS": StatusUpdate
+}
 
 class ModerationService:
     REPORT_THRESHOLD = 5
@@ -20,14 +27,8 @@ class ModerationService:
         db.add(new_report)
         
         # Increment report_count on the target model
-        model_map = {
-            "THREAD": ForumThread,
-            "POST": ForumPost,
-            "STATUS": StatusUpdate
-        }
-        
-        if content_type in model_map:
-            model = model_map[content_type]
+        if content_type in MODEL_MAP:
+            model = MODEL_MAP[content_type]
             stmt = select(model).where(model.id == content_id)
             result = await db.execute(stmt)
             target = result.scalars().first()
@@ -40,4 +41,24 @@ class ModerationService:
         await db.commit()
         return new_report
 
+    async def delete_content(self, db: AsyncSession, content_type: str, content_id: uuid.UUID) -> bool:
+        """
+        Delete reported content and evict it from any caches serving it.
+        """
+        model = MODEL_MAP.get(content_type)
+        if not model:
+            return False
+
+        result = await db.execute(select(model).where(model.id == content_id))
+        target = result.scalars().first()
+        if not target:
+            return False
+
+        await db.delete(target)
+        await db.commit()
+
+        if content_type == "STATUS":
+            await feed_service.remove_post(content_id, target.author_id)
+        return True
+
 moderation_service = ModerationService()
@@ -0,0 +1,210 @@
+from typing import Dict, List, Optional
+import asyncio
+import gzip
+import logging
+import os
+import re
+from datetime import date, datetime, time
+from prometheus_client import Gauge
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+PARTITION_BYTES = Gauge(
+    "messages_partition_bytes", "Total on-disk size of a messages partition", ["partition"]
+)
+PARTITION_ROWS = Gauge(
+    "messages_partition_rows", "Estimated row count of a messages partition", ["partition"]
+)
+
+def forget_partition_metrics(name: str):
+    for gauge in (PARTITION_BYTES, PARTITION_ROWS):
+        try:
+            gauge.remove(name)
+        except KeyError:
+            pass
+
+def add_months(day: date, months: int) -> date:
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+class PartitionManager:
+    """
+    Lifecycle of the monthly range partitions of the messages table:
+    create ahead of time, drain the DEFAULT partition, archive and drop
+    partitions past retention, and report sizes.
+    """
+
+    def __init__(
+        self,
+        table: str = "messages",
+        months_ahead: int = settings.MESSAGE_PARTITIONS_AHEAD,
+        retain_months: int = settings.MESSAGE_PARTITION_RETENTION_MONTHS,
+        archive_dir: str = settings.MESSAGE_ARCHIVE_DIR
+    ):
+        self.table = table
+        self.default_partition = f"{table}_default"
+        self.months_ahead = months_ahead
+        self.retain_months = retain_months
+        self.archive_dir = archive_dir
+        self._name_pattern = re.compile(rf"^{table}_y(\d{{4}})m(\d{{2}})$")
+
+    def partition_name(self, month: date) -> str:
+        return f"{self.table}_y{month.year}m{month.month:02d}"
+
+    def partition_month(self, name: str) -> Optional[date]:
+        match = self._name_pattern.match(name)
+        if not match:
+            return None
+        return date(int(match.group(1)), int(match.group(2)), 1)
+
+    async def list_partitions(self, db: AsyncSession) -> List[Dict]:
+        result = await db.execute(text("""
+            SELECT c.relname AS name,
+                   pg_get_expr(c.relpartbound, c.oid) AS bound,
+                   pg_total_relation_size(c.oid) AS bytes,
+                   GREATEST(c.reltuples, 0)::bigint AS rows
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(:table)
+            ORDER BY c.relname
+        """), {"table": self.table})
+        return [dict(row._mapping) for row in result]
+
+    async def create_partition(self, db: AsyncSession, month: date) -> int:
+        """
+        Create and attach the partition for a month, first moving any rows
+        for that range out of the DEFAULT partition (Postgres refuses to
+        attach a range the default partition still holds rows for).
+        Returns the number of rows moved.
+        """
+        name = self.partition_name(month)
+        lower, upper = month, add_months(month, 1)
+
+        # Held until commit so no row for this month can reach the default
+        # partition between the move and the ATTACH
+        await db.execute(text(f"LOCK TABLE {self.default_partition} IN ACCESS EXCLUSIVE MODE"))
+        await db.execute(text(
+            f"CREATE TABLE {name} (LIKE {self.table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        ))
+        result = await db.execute(text(f"""
+            WITH moved AS (
+                DELETE FROM {self.default_partition}
+                WHERE created_at >= :lower AND created_at < :upper
+                RETURNING *
+            )
+            INSERT INTO {name} SELECT * FROM moved
+        """), {"lower": datetime.combine(lower, time.min), "upper": datetime.combine(upper, time.min)})
+        await db.execute(text(
+            f"ALTER TABLE {self.table} ATTACH PARTITION {name} FOR VALUES FROM ('{lower}') TO ('{upper}')"
+        ))
+        await db.commit()
+
+        moved = result.rowcount or 0
+        logger.info("Created partition %s (%d rows moved from default)", name, moved)
+        return moved
+
+    async def ensure_future_partitions(self, db: AsyncSession, today: Optional[date] = None) -> List[str]:
+        """Pre-create partitions for the current month and months_ahead more."""
+        current = (today or date.today()).replace(day=1)
+        existing = {p["name"] for p in await self.list_partitions(db)}
+
+        created = []
+        for offset in range(self.months_ahead + 1):
+            month = add_months(current, offset)
+            if self.partition_name(month) not in existing:
+                await self.create_partition(db, month)
+                created.append(self.partition_name(month))
+        return created
+
+    async def drain_default(self, db: AsyncSession) -> Dict[str, int]:
+        """Move every month of rows sitting in the DEFAULT partition into its own partition."""
+        result = await db.execute(text(
+            f"SELECT DISTINCT date_trunc('month', created_at)::date AS month FROM {self.default_partition}"
+        ))
+        months = sorted(row.month for row in result)
+        existing = {p["name"] for p in await self.list_partitions(db)}
+
+        moved = {}
+        for month in months:
+            name = self.partition_name(month)
+            if name in existing:
+                # Rows can only reach the default partition for months without one
+                continue
+            moved[name] = await self.create_partition(db, month)
+        return moved
+
+    async def archive_old_partitions(self, db: AsyncSession, today: Optional[date] = None) -> List[str]:
+        """
+        Detach partitions older than the retention window, export each to a
+        gzip-compressed CSV in archive_dir and drop it.
+        """
+        cutoff = add_months((today or date.today()).replace(day=1), -self.retain_months)
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+        archived = []
+        for partition in await self.list_partitions(db):
+            month = self.partition_month(partition["name"])
+            if month is None or month >= cutoff:
+                continue
+
+            name = partition["name"]
+            await db.execute(text(f"ALTER TABLE {self.table} DETACH PARTITION {name}"))
+            await db.commit()
+
+            path = os.path.join(self.archive_dir, f"{name}.csv.gz")
+            exported = await self._export_table(db, name, path)
+            expected = (await db.execute(text(f"SELECT count(*) FROM {name}"))).scalar()
+            if exported != expected:
+                logger.error(
+                    "Archive %s has %d of %d rows; keeping detached table %s", path, exported, expected, name
+                )
+                continue
+
+            await db.execute(text(f"DROP TABLE {name}"))
+            await db.commit()
+            forget_partition_metrics(name)
+            archived.append(path)
+            logger.info("Archived partition %s to %s", name, path)
+        return archived
+
+    async def _export_table(self, db: AsyncSession, name: str, path: str) -> int:
+        """COPY a table into a gzip-compressed CSV; returns the number of rows written."""
+        conn = await db.connection()
+        raw = await conn.get_raw_connection()
+        with gzip.open(path, "wb") as archive:
+            async def write_chunk(chunk: bytes):
+                archive.write(chunk)
+
+            status = await raw.driver_connection.copy_from_table(name, output=write_chunk, format="csv", header=True)
+        # asyncpg returns the command tag, e.g. "COPY 1234"
+        return int(status.split()[-1])
+
+    async def collect_metrics(self, db: AsyncSession) -> List[Dict]:
+        partitions = await self.list_partitions(db)
+        for partition in partitions:
+            PARTITION_BYTES.labels(partition=partition["name"]).set(partition["bytes"])
+            PARTITION_ROWS.labels(partition=partition["name"]).set(partition["rows"])
+        return partitions
+
+    async def run_maintenance(self, db: AsyncSession, today: Optional[date] = None) -> Dict:
+        return {
+            "created": await self.ensure_future_partitions(db, today),
+            "drained": await self.drain_default(db),
+            "archived": await self.archive_old_partitions(db, today),
+        }
+
+    async def refresh_metrics_periodically(self, interval: int = 300):
+        """Keep the partition gauges of this process current (run as a background task)."""
+        while True:
+            try:
+                async with SessionLocal() as db:
+                    await self.collect_metrics(db)
+            except Exception as e:
+                logger.warning("Partition metrics refresh failed: %s", e)
+            await asyncio.sleep(interval)
+
+partition_manager = PartitionManager()
@@ -1,47 +1,306 @@
-from typing import List, Optional
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+import asyncio
+import logging
+import os
+import socket
 import time
+import zlib
+from app.core.config import settings
 from app.core.redis import get_redis
 import uuid
 
+logger = logging.getLogger(__name__)
+
+UserId = Union[uuid.UUID, str]
+
+def presence_status_key(user_id: UserId) -> str:
+    return f"presence:status:{user_id}"
+
+def presence_connections_key(user_id: UserId) -> str:
+    """Hash of a user's open socket connections across all nodes: sid -> node ID."""
+    return f"presence:conns:{user_id}"
+
+def presence_node_key(node_id: str) -> str:
+    """Exists while the node is alive; connections of nodes without it are stale."""
+    return f"presence:node:{node_id}"
+
+# Add or remove one connection and report whether it was the user's only live
+# one. Entries of nodes whose liveness key has expired are pruned first, so a
+# node that died without running disconnect handlers cannot pin a user online.
+# KEYS[1]: connection hash; ARGV: sid, node ID, "open" | "close", node key prefix
+UPDATE_CONNECTIONS_SCRIPT = """
+local others = 0
+local entries = redis.call("hgetall", KEYS[1])
+for i = 1, #entries, 2 do
+    if redis.call("exists", ARGV[4] .. entries[i + 1]) == 0 then
+        redis.call("hdel", KEYS[1], entries[i])
+    elseif entries[i] ~= ARGV[1] then
+        others = others + 1
+    end
+end
+if ARGV[3] == "open" then
+    redis.call("hset", KEYS[1], ARGV[1], ARGV[2])
+    redis.call("expire", KEYS[1], 86400)
+else
+    redis.call("hdel", KEYS[1], ARGV[1])
+end
+if others == 0 then
+    return 1
+end
+return 0
+"""
+
+def presence_hll_key(minute: int) -> str:
+    """HyperLogLog of the users seen during one epoch minute."""
+    return f"presence:hll:{minute}"
+
 class PresenceService:
-    def __init__(self):
+    """
+    Last-seen timestamps in a zset sharded by user ID hash, so no single
+    key takes every heartbeat. Heartbeats are buffered per process and
+    written once per flush interval in a single pipeline; connect and
+    disconnect transitions are written immediately. Socket connections are
+    tracked per sid and node, and a node's connections stop counting once
+    it stops refreshing its liveness key.
+    """
+
+    def __init__(
+        self,
+        shards: int = settings.PRESENCE_SHARDS,
+        online_window: int = settings.PRESENCE_ONLINE_WINDOW,
+        flush_interval_ms: int = settings.PRESENCE_FLUSH_INTERVAL_MS,
+        node_ttl: int = settings.PRESENCE_NODE_TTL
+    ):
         self.presence_key = "presence:online"
+        self.shards = shards
+        self.online_window = online_window
+        self.flush_interval = flush_interval_ms / 1000
+        # user_id -> (timestamp, status); the latest heartbeat wins
+        self._pending: Dict[str, Tuple[int, str]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.node_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.node_ttl = node_ttl
+        self._node_task: Optional[asyncio.Task] = None
+
+    def shard_key(self, user_id: UserId) -> str:
+        shard = zlib.crc32(str(user_id).encode()) % self.shards
+        return f"{self.presence_key}:{shard}"
+
+    async def _update_connections(self, user_id: UserId, sid: str, op: str) -> bool:
+        redis = await get_redis()
+        if self._node_task is None or self._node_task.done():
+            await redis.set(presence_node_key(self.node_id), 1, ex=self.node_ttl)
+            self._node_task = asyncio.create_task(self._keep_node_alive())
+        result = await redis.eval(
+            UPDATE_CONNECTIONS_SCRIPT, 1, presence_connections_key(user_id),
+            sid, self.node_id, op, presence_node_key("")
+        )
+        return result == 1
+
+    async def open_connection(self, user_id: UserId, sid: str) -> bool:
+        """Register a socket connection; True if the user just came online."""
+        return await self._update_connections(user_id, sid, "open")
+
+    async def close_connection(self, user_id: UserId, sid: str) -> bool:
+        """Drop a socket connection; True if it was the user's last live one."""
+        return await self._update_connections(user_id, sid, "close")
+
+    async def _keep_node_alive(self):
+        while True:
+            await asyncio.sleep(self.node_ttl / 3)
+            try:
+                redis = await get_redis()
+                await redis.set(presence_node_key(self.node_id), 1, ex=self.node_ttl)
+            except Exception as e:
+                logger.warning("Presence node heartbeat failed: %s", e)
+
+    async def close_node(self):
+        """On shutdown: stop the liveness heartbeat and release this node's connections."""
+        if self._node_task is not None:
+            self._node_task.cancel()
+            self._node_task = None
+        redis = await get_redis()
+        await redis.delete(presence_node_key(self.node_id))
 
     async def update_presence(self, user_id: uuid.UUID, status: str = "online"):
         """
-        Update user's last seen timestamp in Redis.
+        Update user's last seen timestamp in Redis immediately.
         """
+        if status == "offline":
+            # A heartbeat buffered before the disconnect must not mark them online again
+            self._pending.pop(str(user_id), None)
+        await self._write({str(user_id): (int(time.time()), status)})
+
+    def record_heartbeat(self, user_id: UserId, status: str = "online"):
+        """Buffer a heartbeat; written with the next batch flush."""
+        self._pending[str(user_id)] = (int(time.time()), status)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def flush_heartbeats(self) -> int:
+        pending, self._pending = self._pending, {}
+        if pending:
+            await self._write(pending)
+        return len(pending)
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush_heartbeats()
+            except Exception as e:
+                logger.warning("Presence heartbeat flush failed: %s", e)
+
+    async def _write(self, updates: Dict[str, Tuple[int, str]]):
+        online: Dict[str, Dict[str, int]] = {}
+        offline: Dict[str, List[str]] = {}
+        for user_id, (timestamp, status) in updates.items():
+            if status == "offline":
+                offline.setdefault(self.shard_key(user_id), []).append(user_id)
+            else:
+                online.setdefault(self.shard_key(user_id), {})[user_id] = timestamp
+
         redis = await get_redis()
-        timestamp = int(time.time())
-        await redis.zadd(self.presence_key, {str(user_id): timestamp})
-        # Set a secondary key for status if needed (idle, etc)
-        await redis.setex(f"presence:status:{user_id}", 60, status)
+        minute = int(time.time()) // 60
+        async with redis.pipeline(transaction=False) as pipe:
+            for key, mapping in online.items():
+                pipe.zadd(key, mapping)
+            for key, user_ids in offline.items():
+                pipe.zrem(key, *user_ids)
+            for user_id, (_timestamp, status) in updates.items():
+                # Set a secondary key for status if needed (idle, etc)
+                pipe.setex(presence_status_key(user_id), self.online_window, status)
+            seen = [user_id for mapping in online.values() for user_id in mapping]
+            if seen:
+                pipe.pfadd(presence_hll_key(minute), *seen)
+                pipe.expire(presence_hll_key(minute), 3600)
+            await pipe.execute()
 
     async def get_online_users(self) -> List[str]:
         """
-        Get list of user IDs who have been seen in the last 60 seconds.
+        Get list of user IDs who have been seen in the last online_window seconds.
+        Prefer are_users_online or approximate_online_count on hot paths.
         """
         redis = await get_redis()
-        now = int(time.time())
-        cutoff = now - 60
-        return await redis.zrangebyscore(self.presence_key, cutoff, "+inf")
+        cutoff = int(time.time()) - self.online_window
+        async with redis.pipeline(transaction=False) as pipe:
+            for shard in range(self.shards):
+                pipe.zrangebyscore(f"{self.presence_key}:{shard}", cutoff, "+inf")
+            results = await pipe.execute()
+        return [user_id for shard in results for user_id in shard]
 
     async def is_user_online(self, user_id: uuid.UUID) -> bool:
         """
         Check if a specific user is online.
         """
         redis = await get_redis()
-        score = await redis.zscore(self.presence_key, str(user_id))
+        score = await redis.zscore(self.shard_key(user_id), str(user_id))
         if score is None:
             return False
-        return score >= (time.time() - 60)
+        return score >= (time.time() - self.online_window)
+
+    async def are_users_online(self, user_ids: Iterable[UserId]) -> Dict[str, bool]:
+        """Online flags for many users: one ZMSCORE per shard, one round trip."""
+        by_shard: Dict[str, List[str]] = {}
+        for user_id in dict.fromkeys(str(u) for u in user_ids):
+            by_shard.setdefault(self.shard_key(user_id), []).append(user_id)
+        if not by_shard:
+            return {}
+
+        redis = await get_redis()
+        async with redis.pipeline(transaction=False) as pipe:
+            for key, members in by_shard.items():
+                pipe.zmscore(key, members)
+            results = await pipe.execute()
+
+        cutoff = time.time() - self.online_window
+        return {
+            user_id: score is not None and score >= cutoff
+            for members, scores in zip(by_shard.values(), results)
+            for user_id, score in zip(members, scores)
+        }
+
+    async def approximate_online_count(self, minutes: int = 1) -> int:
+        """
+        Distinct users seen in the current minute and the previous `minutes`
+        minutes, from the per-minute HyperLogLogs (about 0.8% error).
+        """
+        redis = await get_redis()
+        current = int(time.time()) // 60
+        return await redis.pfcount(*[presence_hll_key(current - i) for i in range(minutes + 1)])
 
     async def clear_offline_users(self):
         """
-        Optional: Remove users who haven't been seen for a long time.
+        Remove users who haven't been seen for PRESENCE_RETENTION seconds.
         """
         redis = await get_redis()
-        cutoff = int(time.time()) - 3600 # 1 hour
-        await redis.zremrangebyscore(self.presence_key, "-inf", cutoff)
+        cutoff = int(time.time()) - settings.PRESENCE_RETENTION
+        async with redis.pipeline(transaction=False) as pipe:
+            for shard in range(self.shards):
+                pipe.zremrangebyscore(f"{self.presence_key}:{shard}", "-inf", cutoff)
+            removed = await pipe.execute()
+        return sum(removed)
 
 presence_service = PresenceService()
+
+PresenceChange = Dict[str, object]
+
+class PresencePublisher:
+    """
+    Tells online friends when a user comes online or goes offline.
+    Transitions are batched over a short window and grouped per recipient,
+    so each online friend gets at most one presence_changed event per
+    window however many of their friends reconnected.
+    """
+
+    def __init__(
+        self,
+        emit: Callable[[str, Dict[str, List[PresenceChange]]], Awaitable],
+        window_ms: int = settings.PRESENCE_FANOUT_WINDOW_MS,
+        presence: PresenceService = presence_service
+    ):
+        self.emit = emit
+        self.window = window_ms / 1000
+        self.presence = presence
+        # user_id -> (online, friend_ids); the last transition in a window wins
+        self._pending: Dict[str, Tuple[bool, Sequence[str]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def publish(self, user_id: UserId, online: bool, friend_ids: Sequence[str]):
+        if not friend_ids:
+            return
+        self._pending[str(user_id)] = (online, friend_ids)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    @staticmethod
+    def group_by_recipient(
+        pending: Dict[str, Tuple[bool, Sequence[str]]],
+        online: Dict[str, bool]
+    ) -> Dict[str, List[PresenceChange]]:
+        frames: Dict[str, List[PresenceChange]] = {}
+        for user_id, (is_online, friend_ids) in pending.items():
+            for friend_id in friend_ids:
+                if online.get(friend_id):
+                    frames.setdefault(friend_id, []).append({"user_id": user_id, "online": is_online})
+        return frames
+
+    async def flush(self) -> int:
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        recipients = {friend_id for _online, friend_ids in pending.values() for friend_id in friend_ids}
+        online = await self.presence.are_users_online(recipients)
+
+        frames = self.group_by_recipient(pending, online)
+        for friend_id, changes in frames.items():
+            await self.emit(friend_id, {"changes": changes})
+        return len(frames)
+
+    async def _run(self):
+        while self._pending:
+            await asyncio.sleep(self.window)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning("Presence fan-out failed: %s", e)
@@ -0,0 +1,286 @@
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import hashlib
+import json
+import uuid
+from sqlalchemy import and_, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.core.pagination import paginate_by_score, paginate_query
+from app.core.redis import get_redis
+from app.models.user import Profile
+from app.schemas.profile import Profile as ProfileSchema
+from app.schemas.search import SearchFacets, SearchFilters
+from app.services.cache import profile_cache
+from app.services.location import (
+    paginate_nearest_from_redis, profile_distance, profile_knn_distance, profile_within_radius,
+    search_users_nearby
+)
+
+GEO_FIELDS = {"lat", "lng", "radius_km"}
+FACET_FIELDS = ("ethnicity", "position", "build")
+
+def escape_like(value: str) -> str:
+    """Escape LIKE wildcards so user input matches literally."""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def normalize_city(city: str) -> str:
+    """Canonical city name for exact matching and city version keys."""
+    return " ".join(city.split()).lower()
+
+def build_profile_filters(
+    ethnicity: Optional[str] = None,
+    location: Optional[str] = None,
+    exact_city: bool = False,
+    position: Optional[str] = None,
+    build: Optional[str] = None,
+    hiv_status: Optional[str] = None,
+    privacy_mode: Optional[str] = None,
+    trans_interested: Optional[bool] = None
+) -> List:
+    """
+    Attribute filters for profile search, written to match the profile
+    search indexes: equality on the composite btree columns, a trigram
+    match on location_city and a literal boolean test for the partial
+    trans-interested index.
+    """
+    filters = []
+    if ethnicity:
+        filters.append(Profile.ethnicity == ethnicity)
+    if location and exact_city:
+        # Whole-name, case-insensitive match; also served by the trigram index
+        filters.append(Profile.location_city.ilike(escape_like(location), escape="\\"))
+    elif location:
+        # Substring match served by ix_profiles_location_city_trgm
+        filters.append(Profile.location_city.ilike(f"%{escape_like(location)}%", escape="\\"))
+    if position:
+        filters.append(Profile.position == position)
+    if build:
+        filters.append(Profile.build == build)
+    if hiv_status:
+        filters.append(Profile.hiv_status == hiv_status)
+    if privacy_mode:
+        filters.append(Profile.privacy_mode == privacy_mode)
+    if trans_interested is not None:
+        # Rendered as IS true/false so it can match the partial index predicate
+        filters.append(Profile.is_trans_interested.is_(trans_interested))
+    return filters
+
+def normalize_filters(filters: SearchFilters) -> SearchFilters:
+    """
+    Canonical form of a filter set: trimmed strings, blanks dropped, city
+    lowercased (matched case-insensitively anyway) and coordinates rounded
+    to ~100 m. Queries run on the normalized filters, so equal keys always
+    mean equal results.
+    """
+    data = filters.model_dump()
+    for field, value in data.items():
+        if isinstance(value, str):
+            data[field] = value.strip() or None
+    if data["location"]:
+        data["location"] = normalize_city(data["location"])
+
+    if data["lat"] is None or data["lng"] is None:
+        data.update(lat=None, lng=None, radius_km=None)
+    else:
+        data.update(lat=round(data["lat"], 3), lng=round(data["lng"], 3), radius_km=round(data["radius_km"] or 50, 1))
+    return SearchFilters(**data)
+
+def filters_hash(filters: SearchFilters) -> str:
+    """Stable hash of a normalized filter set, for cache keys."""
+    payload = json.dumps(filters.model_dump(exclude_none=True), sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+def facets_cache_key(filters: SearchFilters) -> str:
+    return f"search:facets:{filters_hash(filters)}"
+
+def search_cache_key(filters: SearchFilters, limit: int, cursor: Optional[str]) -> str:
+    page = hashlib.sha1(cursor.encode()).hexdigest()[:16] if cursor else "first"
+    return f"search:results:{filters_hash(filters)}:{limit}:{page}"
+
+def city_version_key(city: str) -> str:
+    """Bumped whenever a profile in the city changes; invalidates exact-city searches."""
+    return f"search:version:city:{normalize_city(city)}"
+
+async def bump_city_versions(*cities: Optional[str]):
+    keys = {city_version_key(city) for city in cities if city and city.strip()}
+    if not keys:
+        return
+    redis = await get_redis()
+    async with redis.pipeline(transaction=False) as pipe:
+        for key in keys:
+            pipe.incr(key)
+        await pipe.execute()
+
+async def search_profiles(
+    db: AsyncSession,
+    filters: SearchFilters,
+    limit: int = 20,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    One page of profile search results as ProfileSchema items. Searches
+    with coordinates are ordered nearest first with a (distance, id)
+    cursor; the rest newest first.
+    """
+    query = select(Profile)
+    lat, lng, radius_km = filters.lat, filters.lng, filters.radius_km
+    conditions = build_profile_filters(**filters.model_dump(exclude=GEO_FIELDS))
+
+    nearest = lat is not None and lng is not None
+    if nearest and settings.GEO_SEARCH_BACKEND == "postgres":
+        # Radius and attribute filters in one plan, served by the earthdistance index
+        conditions.append(profile_within_radius(lat, lng, radius_km))
+
+    if conditions:
+        query = query.where(and_(*conditions))
+
+    if nearest:
+        # Nearest first, keyset over (distance, id)
+        if settings.GEO_SEARCH_BACKEND == "postgres":
+            query = query.add_columns(profile_distance(lat, lng))
+            page = await paginate_by_score(
+                db, query, profile_knn_distance(lat, lng), Profile.id, limit, cursor, parse_member=uuid.UUID
+            )
+        else:
+            page = await paginate_nearest_from_redis(db, query, lat, lng, radius_km, limit, cursor)
+        page["items"] = [
+            ProfileSchema.model_validate(row[0]).model_copy(update={"distance_km": row[1] / 1000})
+            for row in page["items"]
+        ]
+    else:
+        page = await paginate_query(db, query, Profile, limit, cursor)
+        page["items"] = [ProfileSchema.model_validate(profile) for profile in page["items"]]
+    return page
+
+async def get_cached_search(
+    filters: SearchFilters,
+    limit: int,
+    cursor: Optional[str]
+) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Cached page of result IDs for normalized filters, or None. Also returns
+    the current city version, which a fresh page must be stored under.
+    Both are read with one MGET. Only exact-city searches are versioned: a
+    substring can match any number of cities, so those pages (like every
+    other search) are only refreshed when SEARCH_CACHE_TTL expires.
+    """
+    redis = await get_redis()
+    versioned = bool(filters.location and filters.exact_city)
+    keys = [search_cache_key(filters, limit, cursor)]
+    if versioned:
+        keys.append(city_version_key(filters.location))
+    values = await redis.mget(keys)
+
+    version = (values[1] or "0") if versioned else None
+    if not values[0]:
+        return None, version
+    entry = json.loads(values[0])
+    if entry["version"] != version:
+        return None, version
+    return entry, version
+
+async def cache_search_page(
+    filters: SearchFilters,
+    limit: int,
+    cursor: Optional[str],
+    page: Dict[str, Any],
+    version: Optional[str]
+):
+    """
+    Store a page as result IDs. Its profiles are not written to the profile
+    cache: one updated after the query ran would be cached with its old
+    fields, so hydrate_profiles fills them through get_or_set_many,
+    which skips profiles invalidated while it loads.
+    """
+    entry = {
+        "ids": [[str(item.id), item.distance_km] for item in page["items"]],
+        "metadata": page["metadata"],
+        "version": version
+    }
+    redis = await get_redis()
+    await redis.setex(search_cache_key(filters, limit, cursor), settings.SEARCH_CACHE_TTL, json.dumps(entry))
+
+async def hydrate_profiles(db: AsyncSession, ids: Sequence[str]) -> Dict[str, ProfileSchema]:
+    """Profiles by ID from the profile cache (one MGET), loading misses in one query."""
+    async def load(missing: List[str]) -> Dict[str, Profile]:
+        result = await db.execute(select(Profile).where(Profile.id.in_([uuid.UUID(pid) for pid in missing])))
+        return {str(profile.id): profile for profile in result.scalars()}
+
+    profiles = await profile_cache.get_or_set_many(ids, ProfileSchema, load)
+    return {pid: profile for pid, profile in zip(ids, profiles) if profile is not None}
+
+async def cached_search_profiles(
+    db: AsyncSession,
+    filters: SearchFilters,
+    limit: int = 20,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    search_profiles behind a short-lived cache of result IDs keyed by the
+    normalized filter set. Exact-city searches are invalidated when a profile
+    in that city changes; everything else ages out after SEARCH_CACHE_TTL.
+    """
+    filters = normalize_filters(filters)
+    entry, version = await get_cached_search(filters, limit, cursor)
+    if entry is None:
+        page = await search_profiles(db, filters, limit, cursor)
+        await cache_search_page(filters, limit, cursor, page, version)
+        return page
+
+    profiles = await hydrate_profiles(db, [pid for pid, _distance in entry["ids"]])
+    items = [
+        profiles[pid].model_copy(update={"distance_km": distance})
+        for pid, distance in entry["ids"]
+        if pid in profiles
+    ]
+    return {"items": items, "metadata": entry["metadata"]}
+
+async def compute_facets(db: AsyncSession, filters: SearchFilters) -> SearchFacets:
+    """
+    Counts per ethnicity, position and build for a filter set, plus the
+    total, in one GROUPING SETS query.
+    """
+    conditions = build_profile_filters(**filters.model_dump(exclude=GEO_FIELDS))
+    if filters.lat is not None and filters.lng is not None:
+        if settings.GEO_SEARCH_BACKEND == "postgres":
+            conditions.append(profile_within_radius(filters.lat, filters.lng, filters.radius_km))
+        else:
+            nearby_results = await search_users_nearby(filters.lat, filters.lng, filters.radius_km)
+            conditions.append(Profile.id.in_([uuid.UUID(res[0]) for res in nearby_results]))
+
+    columns = [getattr(Profile, field) for field in FACET_FIELDS]
+    stmt = (
+        select(*columns, *[func.grouping(column) for column in columns], func.count())
+        .group_by(func.grouping_sets(*[tuple_(column) for column in columns], tuple_()))
+    )
+    if conditions:
+        stmt = stmt.where(and_(*conditions))
+
+    total = 0
+    facets: Dict[str, Dict[str, int]] = {field: {} for field in FACET_FIELDS}
+    size = len(FACET_FIELDS)
+    for row in await db.execute(stmt):
+        values, grouped, count = row[:size], row[size:2 * size], row[-1]
+        if all(grouped):
+            # The empty grouping set: every column rolled up
+            total = count
+            continue
+        # grouping() is 0 for the one column this row is grouped by
+        index = list(grouped).index(0)
+        if values[index] is not None:
+            facets[FACET_FIELDS[index]][values[index]] = count
+    return SearchFacets(total=total, facets=facets)
+
+async def get_facets(db: AsyncSession, filters: SearchFilters) -> SearchFacets:
+    """compute_facets behind a short-lived Redis cache keyed by the normalized filters."""
+    filters = normalize_filters(filters)
+    key = facets_cache_key(filters)
+
+    redis = await get_redis()
+    cached = await redis.get(key)
+    if cached:
+        return SearchFacets.model_validate_json(cached)
+
+    facets = await compute_facets(db, filters)
+    await redis.setex(key, settings.SEARCH_FACETS_TTL, facets.model_dump_json())
+    return facets
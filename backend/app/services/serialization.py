@@ -0,0 +1,65 @@
+from typing import Any, Union
+import json
+import msgpack
+import orjson
+import zstandard
+from app.core.config import settings
+
+# First byte of a serialized cache entry: the codec, plus a flag bit when
+# the body is zstd-compressed. JSON text written before this format existed
+# always starts with a printable character, so it can never be mistaken
+# for one of these.
+FORMAT_MSGPACK = 0x01
+FORMAT_ORJSON = 0x02
+FORMAT_COMPRESSED = 0x80
+
+CODECS = {
+    FORMAT_MSGPACK: (msgpack.packb, msgpack.unpackb),
+    FORMAT_ORJSON: (orjson.dumps, orjson.loads),
+}
+CODEC_NAMES = {"msgpack": FORMAT_MSGPACK, "orjson": FORMAT_ORJSON}
+
+class Serializer:
+    """
+    Bytes encoding for cached values: a format byte followed by the
+    msgpack or orjson body, zstd-compressed when it is at least
+    compress_min_bytes long (0 disables compression). With codec "json"
+    values are written as plain JSON text, which older readers understand.
+    loads accepts every format regardless of the configured codec.
+    """
+
+    def __init__(
+        self,
+        codec: str = settings.CACHE_SERIALIZER,
+        compress_min_bytes: int = settings.CACHE_COMPRESS_MIN_BYTES,
+        compress_level: int = settings.CACHE_COMPRESS_LEVEL
+    ):
+        if codec != "json" and codec not in CODEC_NAMES:
+            raise ValueError(f"Unknown cache serializer: {codec}")
+        self.codec = codec
+        self.compress_min_bytes = compress_min_bytes
+        self._compressor = zstandard.ZstdCompressor(level=compress_level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def dumps(self, obj: Any) -> bytes:
+        if self.codec == "json":
+            return json.dumps(obj).encode()
+        fmt = CODEC_NAMES[self.codec]
+        body = CODECS[fmt][0](obj)
+        if self.compress_min_bytes and len(body) >= self.compress_min_bytes:
+            return bytes([fmt | FORMAT_COMPRESSED]) + self._compressor.compress(body)
+        return bytes([fmt]) + body
+
+    def loads(self, data: Union[bytes, str]) -> Any:
+        if isinstance(data, str):
+            return json.loads(data)
+        fmt = data[0] & ~FORMAT_COMPRESSED
+        if fmt not in CODECS:
+            # Legacy JSON text
+            return json.loads(data)
+        body = data[1:]
+        if data[0] & FORMAT_COMPRESSED:
+            body = self._decompressor.decompress(body)
+        return CODECS[fmt][1](body)
+
+cache_serializer = Serializer()
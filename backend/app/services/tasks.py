@@ -1,31 +1,111 @@
-from app.core.celery import celery_app
-from app.core.redis import get_redis
-import asyncio
-import time
+from app.core.celery import celery_app, run_async
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.user import Relationship
+from app.services.chat import chat_service
+from app.services.feed_service import feed_service
+from app.services.partitions import partition_manager
+from app.services.presence import presence_service
+from sqlalchemy import select
 import uuid
-from typing import List
+from typing import List, Optional
 
-# Celery tasks are usually synchronous, but we can wrap async calls
-def run_async(coro):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    try:
-        return loop.run_until_complete(coro)
-    finally:
-        loop.close()
+# Celery tasks are synchronous; async work runs on the worker's persistent
+# loop via run_async (see app.core.celery)
 
 @celery_app.task(name="app.services.tasks.fan_out_post")
-def fan_out_post(post_id_str: str, follower_ids_str: List[str]):
-    async def _fan_out():
-        redis = await get_redis()
-        timestamp = int(time.time())
-        
-        # Add to Global Feed
-        await redis.zadd("feed:global", {post_id_str: timestamp})
-        
-        # Add to Follower Feeds
-        for follower_id in follower_ids_str:
-            await redis.zadd(f"feed:user:{follower_id}", {post_id_str: timestamp})
-            await redis.zremrangebyrank(f"feed:user:{follower_id}", 0, -501)
-            
-    run_async(_fan_out())
+def fan_out_post(
+    post_id_str: str,
+    follower_ids_str: List[str],
+    author_id_str: Optional[str] = None,
+    score: Optional[float] = None
+):
+    stats = run_async(
+        feed_service.add_post_to_feeds(post_id_str, author_id_str, follower_ids_str, score=score)
+    )
+    return {
+        "followers": sum(chunk["size"] for chunk in stats),
+        "chunks": len(stats),
+        "elapsed_ms": sum(chunk["elapsed_ms"] for chunk in stats)
+    }
+
+@celery_app.task(name="app.services.tasks.rebuild_user_feed")
+def rebuild_user_feed(user_id_str: str):
+    async def _rebuild():
+        async with SessionLocal() as db:
+            return await feed_service.rebuild_user_feed(db, uuid.UUID(user_id_str))
+
+    return run_async(_rebuild())
+
+@celery_app.task(name="app.services.tasks.backfill_friendship")
+def backfill_friendship(follower_id_str: str, author_id_str: str):
+    """
+    A follow was accepted: make the author's history visible in the
+    follower's feed and keep pull-mode merging in sync.
+    """
+    async def _backfill():
+        await feed_service.follow_author(follower_id_str, author_id_str)
+        async with SessionLocal() as db:
+            return await feed_service.rebuild_user_feed(db, uuid.UUID(follower_id_str))
+
+    return run_async(_backfill())
+
+@celery_app.task(name="app.services.tasks.warm_feeds")
+def warm_feeds(batch_size: int = 1000):
+    """
+    Whole-fleet warmup after a Redis flush or restart. Rebuilds the global
+    feed and the pull-mode authors' feeds and registrations, then schedules
+    one rebuild per reader, staggered so no more than FEED_WARMUP_RATE
+    rebuilds start per second across the worker pool.
+    """
+    async def _warm():
+        scheduled = 0
+        last_id = None
+        async with SessionLocal() as db:
+            await feed_service.rebuild_global_feed(db)
+            # Readers only see pull-mode authors' posts through these
+            await feed_service.rebuild_pull_authors(db)
+
+            while True:
+                stmt = (
+                    select(Relationship.from_user_id)
+                    .where(Relationship.type == "FRIEND", Relationship.status == "ACCEPTED")
+                    .distinct()
+                    .order_by(Relationship.from_user_id)
+                    .limit(batch_size)
+                )
+                if last_id is not None:
+                    stmt = stmt.where(Relationship.from_user_id > last_id)
+                result = await db.execute(stmt)
+                user_ids = result.scalars().all()
+                if not user_ids:
+                    break
+
+                for user_id in user_ids:
+                    rebuild_user_feed.apply_async(
+                        args=[str(user_id)],
+                        countdown=scheduled / settings.FEED_WARMUP_RATE
+                    )
+                    scheduled += 1
+                last_id = user_ids[-1]
+        return scheduled
+
+    return run_async(_warm())
+
+@celery_app.task(name="app.services.tasks.maintain_message_partitions")
+def maintain_message_partitions():
+    async def _maintain():
+        async with SessionLocal() as db:
+            report = await partition_manager.run_maintenance(db)
+            await partition_manager.collect_metrics(db)
+            return report
+
+    return run_async(_maintain())
+
+@celery_app.task(name="app.services.tasks.clear_offline_users")
+def clear_offline_users():
+    return run_async(presence_service.clear_offline_users())
+
+@celery_app.task(name="app.services.tasks.replay_dead_letter_messages")
+def replay_dead_letter_messages():
+    return run_async(chat_service.writer.replay_dead_letters())
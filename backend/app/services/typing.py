@@ -0,0 +1,106 @@
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+import asyncio
+import logging
+import time
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+TypingFrame = Dict[str, object]
+
+class TypingAggregator:
+    """
+    Coalesces typing events per socket room. Keystrokes only refresh a
+    (room, user) timestamp; start/stop transitions are collected and sent
+    as one user_typing frame per room every flush interval, so broadcast
+    traffic follows the number of typists rather than keystrokes. A typist
+    that goes quiet for idle_timeout_ms is reported as stopped.
+    """
+
+    def __init__(
+        self,
+        emit: Callable[[str, TypingFrame], Awaitable],
+        flush_interval_ms: int = settings.TYPING_FLUSH_INTERVAL_MS,
+        idle_timeout_ms: int = settings.TYPING_IDLE_TIMEOUT_MS
+    ):
+        self.emit = emit
+        self.flush_interval = flush_interval_ms / 1000
+        self.idle_timeout = idle_timeout_ms / 1000
+        # room -> user_id -> last keystroke (monotonic seconds)
+        self._typing: Dict[str, Dict[str, float]] = {}
+        # Transitions not yet broadcast
+        self._started: Dict[str, Set[str]] = {}
+        self._stopped: Dict[str, Set[str]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def touch(self, room: str, user_id: str, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        typists = self._typing.setdefault(room, {})
+        if user_id not in typists:
+            stopped = self._stopped.get(room)
+            if stopped and user_id in stopped:
+                # Stopped and restarted within one window: nothing to report
+                stopped.discard(user_id)
+            else:
+                self._started.setdefault(room, set()).add(user_id)
+        typists[user_id] = now
+        self._ensure_running()
+
+    def stop(self, room: str, user_id: str):
+        typists = self._typing.get(room)
+        if not typists or typists.pop(user_id, None) is None:
+            return
+        if not typists:
+            del self._typing[room]
+
+        started = self._started.get(room)
+        if started and user_id in started:
+            started.discard(user_id)
+        else:
+            self._stopped.setdefault(room, set()).add(user_id)
+
+    def stop_user(self, user_id: str):
+        """Stop a user in every room, e.g. on disconnect."""
+        for room in [room for room, typists in self._typing.items() if user_id in typists]:
+            self.stop(room, user_id)
+
+    def collect(self, now: Optional[float] = None) -> Dict[str, TypingFrame]:
+        """Expire idle typists and drain pending transitions into one frame per room."""
+        now = time.monotonic() if now is None else now
+        for room, typists in list(self._typing.items()):
+            for user_id, last_seen in list(typists.items()):
+                if now - last_seen >= self.idle_timeout:
+                    self.stop(room, user_id)
+
+        frames = {}
+        for room in set(self._started) | set(self._stopped):
+            started: List[str] = sorted(self._started.get(room, ()))
+            stopped: List[str] = sorted(self._stopped.get(room, ()))
+            if started or stopped:
+                frames[room] = {"room": room, "started": started, "stopped": stopped}
+        self._started.clear()
+        self._stopped.clear()
+        return frames
+
+    async def flush(self):
+        for room, frame in self.collect().items():
+            await self.emit(room, frame)
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    def _ensure_running(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        # Runs only while someone is typing or transitions are pending
+        while self._typing or self._started or self._stopped:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning("Typing flush failed: %s", e)
@@ -1,20 +1,25 @@
-from typing import Optional
+from typing import List, Optional
 import uuid
-import json
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from app.models.user import User
-from app.core.redis import get_redis
+from sqlalchemy import select, or_
+from app.models.user import User, Relationship
+from app.core.config import settings
+from app.core.redis import get_binary_redis, get_redis
+from app.services.cache import CACHE_NEGATIVE_HITS, NEGATIVE_SENTINEL
+from app.services.serialization import cache_serializer
 from app.schemas.user import User as UserSchema
 
 async def get_user_by_id(db: AsyncSession, user_id: uuid.UUID) -> Optional[User]:
-    redis = await get_redis()
+    redis = await get_binary_redis()
     cache_key = f"user:{user_id}"
     
     # Try Cache
     cached_user = await redis.get(cache_key)
+    if cached_user == NEGATIVE_SENTINEL.encode():
+        CACHE_NEGATIVE_HITS.labels(cache="user").inc()
+        return None
     if cached_user:
-        user_data = json.loads(cached_user)
+        user_data = cache_serializer.loads(cached_user)
         # Reconstruct model or return as dict? Usually better to return model for DB consistency
         # but for performance we might return schema
         return UserSchema(**user_data)
@@ -26,10 +31,25 @@ async def get_user_by_id(db: AsyncSession, user_id: uuid.UUID) -> Optional[User]
     if user:
         # Save to Cache
         user_schema = UserSchema.model_validate(user)
-        await redis.setex(cache_key, 3600, user_schema.model_dump_json())
+        await redis.setex(cache_key, 3600, cache_serializer.dumps(user_schema.model_dump(mode="json")))
+    elif settings.CACHE_NEGATIVE_TTL:
+        # Remember the miss briefly so unknown IDs don't reach Postgres every time
+        await redis.setex(cache_key, settings.CACHE_NEGATIVE_TTL, NEGATIVE_SENTINEL)
     
     return user
 
 async def invalidate_user_cache(user_id: uuid.UUID):
     redis = await get_redis()
     await redis.delete(f"user:{user_id}")
+
+async def get_friend_ids(db: AsyncSession, user_id: uuid.UUID) -> List[str]:
+    """IDs of users with an accepted friendship with user_id, in either direction."""
+    result = await db.execute(select(Relationship.from_user_id, Relationship.to_user_id).where(
+        Relationship.type == "FRIEND",
+        Relationship.status == "ACCEPTED",
+        or_(Relationship.from_user_id == user_id, Relationship.to_user_id == user_id)
+    ))
+    return list({
+        str(to_id if from_id == user_id else from_id)
+        for from_id, to_id in result.all()
+    })
@@ -0,0 +1,59 @@
+import argparse
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+# Add the parent directory to sys.path to allow imports from app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.config import settings
+from app.schemas.profile import Profile as ProfileSchema
+from app.services.cache import CacheService
+from app.services.serialization import Serializer
+
+def sample_profile(bio_words: int) -> ProfileSchema:
+    return ProfileSchema(
+        id=uuid.uuid4(),
+        last_active=datetime.utcnow(),
+        bio=" ".join(["lorem ipsum dolor sit amet"] * (bio_words // 5)),
+        height="5'11\"",
+        weight=175,
+        ethnicity="Mixed",
+        body_type="Athletic",
+        roles=["Versatile"],
+        interests=["hiking", "music", "cooking", "travel"],
+        location_city="Philadelphia",
+        location_state="PA",
+        location_lat=39.9526,
+        location_lng=-75.1652,
+        position="Versatile",
+        build="Athletic",
+        hiv_status="Negative",
+    )
+
+def bench(label, serializer, profile, iterations):
+    cache = CacheService(prefix=f"bench-{label}", serializer=serializer)
+    data = cache.encode(profile)
+    cache.decode(data, ProfileSchema)  # warm up
+    started = time.perf_counter()
+    for _ in range(iterations):
+        cache.decode(data, ProfileSchema)
+    elapsed = time.perf_counter() - started
+    print(f"{label:>14}: {len(data):5d} bytes, {elapsed / iterations * 1e6:6.1f} us/decode")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare cached profile size and decode time per serializer.")
+    parser.add_argument("--iterations", type=int, default=20000)
+    parser.add_argument("--bio-words", type=int, default=60, help="Bio length; longer bios cross the compression threshold")
+    parser.add_argument("--compress-min-bytes", type=int, default=settings.CACHE_COMPRESS_MIN_BYTES)
+    args = parser.parse_args()
+
+    profile = sample_profile(args.bio_words)
+    bench("json", Serializer("json"), profile, args.iterations)
+    bench("orjson", Serializer("orjson", compress_min_bytes=0), profile, args.iterations)
+    bench("msgpack", Serializer("msgpack", compress_min_bytes=0), profile, args.iterations)
+    # As deployed: only bodies at or above the threshold are compressed
+    threshold = args.compress_min_bytes
+    bench(f"msgpack/{threshold}", Serializer("msgpack", compress_min_bytes=threshold), profile, args.iterations)
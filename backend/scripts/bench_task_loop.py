@@ -0,0 +1,63 @@
+import argparse
+import asyncio
+import os
+import sys
+import time
+import uuid
+
+# Add the parent directory to sys.path to allow imports from app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis.asyncio as redis
+from app.core.config import settings
+from app.core.celery import run_async
+from app.core.redis import get_redis
+
+FOLLOWERS = 50
+
+async def feed_task_body(client):
+    """Roughly what a small fan-out task does against Redis."""
+    post_id = str(uuid.uuid4())
+    async with client.pipeline(transaction=False) as pipe:
+        for i in range(FOLLOWERS):
+            pipe.zadd(f"bench:feed:{i}", {post_id: time.time()})
+            pipe.zremrangebyrank(f"bench:feed:{i}", 0, -501)
+        await pipe.execute()
+
+def legacy_call():
+    """Previous behaviour: new loop and new connections per task."""
+    async def _run():
+        client = redis.from_url(settings.REDIS_URL, decode_responses=True)
+        try:
+            await feed_task_body(client)
+        finally:
+            await client.aclose()
+
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(_run())
+    finally:
+        loop.close()
+
+def pooled_call():
+    async def _run():
+        await feed_task_body(await get_redis())
+
+    run_async(_run())
+
+def bench(label, fn, iterations):
+    fn()  # warm up
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = time.perf_counter() - started
+    print(f"{label:>8}: {iterations} tasks in {elapsed:.2f}s "
+          f"({elapsed / iterations * 1000:.2f} ms/task, {iterations / elapsed:.0f} tasks/s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare per-task loop creation with the persistent worker loop.")
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    bench("legacy", legacy_call, args.iterations)
+    bench("pooled", pooled_call, args.iterations)
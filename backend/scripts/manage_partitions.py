@@ -0,0 +1,37 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+# Add the parent directory to sys.path to allow imports from app
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.database import SessionLocal
+from app.services.partitions import partition_manager
+
+async def main(command: str):
+    async with SessionLocal() as db:
+        if command == "ensure":
+            result = await partition_manager.ensure_future_partitions(db)
+        elif command == "drain-default":
+            result = await partition_manager.drain_default(db)
+        elif command == "archive":
+            result = await partition_manager.archive_old_partitions(db)
+        elif command == "maintain":
+            result = await partition_manager.run_maintenance(db)
+        else:
+            result = await partition_manager.list_partitions(db)
+    print(json.dumps(result, indent=2, default=str))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage monthly partitions of the messages table.")
+    parser.add_argument(
+        "command",
+        choices=["stats", "ensure", "drain-default", "archive", "maintain"],
+        help="stats: list partitions with sizes; ensure: pre-create upcoming months; "
+             "drain-default: move rows out of messages_default; archive: export and drop "
+             "partitions past retention; maintain: ensure + drain-default + archive"
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.command))
@@ -2,6 +2,7 @@ import pytest
 import asyncio
 from typing import AsyncGenerator
 from httpx import ASGITransport, AsyncClient
+from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from app.main import app
 from app.core.database import Base, get_db
@@ -31,6 +32,10 @@ def event_loop():
 async def test_engine():
     engine = create_async_engine(TEST_DATABASE_URL, pool_pre_ping=True)
     async with engine.begin() as conn:
+        # Extensions used by model indexes
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS cube"))
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS earthdistance"))
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
         await conn.run_sync(Base.metadata.create_all)
     
     yield engine
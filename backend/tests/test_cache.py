@@ -0,0 +1,299 @@
+import pytest
+import json
+import time
+import uuid
+from pydantic import BaseModel
+from app.core.redis import get_redis
+from app.services.cache import CacheService, LocalCache, apply_invalidation, INVALIDATION_CHANNEL
+
+class Item(BaseModel):
+    id: str
+    name: str
+
+def test_local_cache_lru_and_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("app.services.cache.time.monotonic", lambda: now[0])
+    local = LocalCache(max_size=2, ttl=10)
+
+    assert local.set("a", 1) == 0
+    assert local.set("b", 2) == 0
+    local.get("a")  # a is now most recent
+    assert local.set("c", 3) == 1
+    assert local.get("b") is None and len(local) == 2
+    assert local.get("a") == 1
+
+    now[0] += 11
+    assert local.get("a") is None
+
+@pytest.mark.asyncio
+async def test_local_tier_serves_validated_objects():
+    cache = CacheService(prefix=f"test-{uuid.uuid4()}", ttl=60, local_size=10)
+    item = Item(id="1", name="first")
+    await cache.set_cached_object("1", item)
+
+    # Served from the process without touching Redis
+    redis = await get_redis()
+    await redis.delete(f"{cache.prefix}:1")
+    assert await cache.get_cached_object("1", Item) is item
+
+@pytest.mark.asyncio
+async def test_invalidate_clears_both_tiers_and_broadcasts():
+    cache = CacheService(prefix=f"test-{uuid.uuid4()}", ttl=60, local_size=10)
+    await cache.set_cached_object("1", Item(id="1", name="first"))
+
+    redis = await get_redis()
+    pubsub = redis.pubsub()
+    await pubsub.subscribe(INVALIDATION_CHANNEL)
+    await pubsub.get_message(timeout=1)  # subscribe confirmation
+
+    await cache.invalidate("1")
+    assert await cache.get_cached_object("1", Item) is None
+
+    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1)
+    assert json.loads(message["data"])["key"] == "1"
+    await pubsub.aclose()
+
+@pytest.mark.asyncio
+async def test_writes_broadcast_invalidations():
+    cache = CacheService(prefix=f"test-{uuid.uuid4()}", ttl=60, local_size=10)
+    redis = await get_redis()
+    pubsub = redis.pubsub()
+    await pubsub.subscribe(INVALIDATION_CHANNEL)
+    await pubsub.get_message(timeout=1)  # subscribe confirmation
+
+    await cache.set_cached_object("1", Item(id="1", name="first"))
+    await cache.set_many({"2": Item(id="2", name="second")})
+    keys = []
+    for _ in range(2):
+        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1)
+        keys.append(json.loads(message["data"])["key"])
+        # This process's own messages leave its local tier alone
+        apply_invalidation(message["data"])
+    await pubsub.aclose()
+
+    assert keys == ["1", "2"]
+    await redis.delete(f"{cache.prefix}:1")
+    assert (await cache.get_cached_object("1", Item)).name == "first"
+
+@pytest.mark.asyncio
+async def test_invalidation_message_drops_local_entry():
+    cache = CacheService(prefix=f"test-{uuid.uuid4()}", ttl=60, local_size=10)
+    await cache.set_cached_object("1", Item(id="1", name="first"))
+
+    # As received from another worker
+    apply_invalidation(json.dumps({"prefix": cache.prefix, "key": "1"}))
+    redis = await get_redis()
+    await redis.delete(f"{cache.prefix}:1")
+    assert await cache.get_cached_object("1", Item) is None
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_fetch():
+    import asyncio
+    cache = CacheService(prefix=f"test-{uuid.uuid4()}", ttl=60)
+    calls = []
+
+    async def fetcher():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return Item(id="1", name="fetched")
+
+    results = await asyncio.gather(*[cache.get_or_set("1", Item, fetcher) for _ in range(20)])
+    assert len(calls) == 1
+    assert {result.name for result in results} == {"fetched"}
+
+@pytest.mark.asyncio
+async def test_waits_for_fill_by_another_worker():
+    import asyncio
+    cache = CacheService(prefix=f"test-{uuid.uuid4()}", ttl=60)
+    other_worker = CacheService(prefix=cache.prefix, ttl=60)
+    redis = await get_redis()
+    await redis.set(f"{cache.prefix}:1:lock", "other-worker", px=2000)
+
+    async def fill_later():
+        await asyncio.sleep(0.1)
+        await other_worker.set_cached_object("1", Item(id="1", name="from other worker"))
+
+    async def fetcher():
+        raise AssertionError("the lock holder fills this key")
+
+    filler = asyncio.create_task(fill_later())
+    result = await cache.get_or_set("1", Item, fetcher)
+    await filler
+    assert result.name == "from other worker"
+
+@pytest.mark.asyncio
+async def test_stale_value_served_while_refreshing(monkeypatch):
+    import asyncio
+    cache = CacheService(prefix=f"test-{uuid.uuid4()}", ttl=60, stale_ttl=300, envelope=True)
+    await cache.set_cached_object("1", Item(id="1", name="old"))
+
+    # Past the TTL the entry is stale but still within stale_ttl
+    real_time = time.time
+    monkeypatch.setattr("app.services.cache.time.time", lambda: real_time() + 61)
+    refreshed = asyncio.Event()
+
+    async def fetcher():
+        refreshed.set()
+        return Item(id="1", name="new")
+
+    assert (await cache.get_or_set("1", Item, fetcher)).name == "old"
+    await asyncio.wait_for(refreshed.wait(), 1)
+    await asyncio.sleep(0.05)
+    assert (await cache.get_or_set("1", Item, fetcher)).name == "new"
+
+@pytest.mark.asyncio
+async def test_refresh_started_before_invalidate_is_not_stored():
+    import asyncio
+    cache = CacheService(prefix=f"test-{uuid.uuid4()}", ttl=60, local_size=10)
+    started, release = asyncio.Event(), asyncio.Event()
+
+    async def slow_fetcher():
+        started.set()
+        await release.wait()
+        return Item(id="1", name="before update")
+
+    refresh = asyncio.create_task(cache.get_or_set("1", Item, slow_fetcher))
+    await started.wait()
+    await cache.invalidate("1")
+    release.set()
+    assert (await refresh).name == "before update"
+
+    redis = await get_redis()
+    assert not await redis.exists(f"{cache.prefix}:1")
+
+    async def fetcher():
+        return Item(id="1", name="after update")
+
+    assert (await cache.get_or_set("1", Item, fetcher)).name == "after update"
+    assert await redis.exists(f"{cache.prefix}:1")
+
+@pytest.mark.asyncio
+async def test_bulk_fill_skips_keys_invalidated_meanwhile():
+    cache = CacheService(prefix=f"test-{uuid.uuid4()}", ttl=60)
+
+    async def bulk_fetcher(keys):
+        await cache.invalidate("1")
+        return {key: Item(id=key, name="before update") for key in keys}
+
+    await cache.get_or_set_many(["1", "2"], Item, bulk_fetcher)
+    redis = await get_redis()
+    assert not await redis.exists(f"{cache.prefix}:1")
+    assert await redis.exists(f"{cache.prefix}:2")
+
+def test_entries_without_envelope_are_plain_values():
+    cache = CacheService(prefix=f"test-{uuid.uuid4()}", ttl=60, stale_ttl=300, envelope=False)
+    data = cache.encode(Item(id="1", name="first"), delta=0.5)
+    # What workers from before the envelope expect to find
+    assert Item.model_validate(cache.serializer.loads(data)) == Item(id="1", name="first")
+
+@pytest.mark.asyncio
+async def test_plain_entries_go_stale_by_redis_ttl():
+    import asyncio
+    cache = CacheService(prefix=f"test-{uuid.uuid4()}", ttl=60, stale_ttl=300, envelope=False)
+    redis = await get_redis()
+    # 100 s left of ttl + stale_ttl: past ttl, inside the stale window
+    await redis.setex(f"{cache.prefix}:1", 100, cache.encode(Item(id="1", name="old")).decode())
+    await redis.setex(f"{cache.prefix}:2", 350, cache.encode(Item(id="2", name="fresh")).decode())
+    refreshed = asyncio.Event()
+
+    async def fetcher():
+        refreshed.set()
+        return Item(id="1", name="new")
+
+    assert (await cache.get_or_set("1", Item, fetcher)).name == "old"
+    await asyncio.wait_for(refreshed.wait(), 1)
+    await asyncio.sleep(0.05)
+    assert (await cache.get_or_set("1", Item, fetcher)).name == "new"
+    assert await redis.ttl(f"{cache.prefix}:1") > 300
+
+    entries = await cache._read_many(["2", "1"], Item)
+    assert entries[0].fresh_until > time.time() + 40
+
+def test_early_expiration_probability(monkeypatch):
+    from app.services.cache import CacheEntry
+    cache = CacheService(prefix=f"test-{uuid.uuid4()}", ttl=60, beta=1.0)
+    now = time.time()
+
+    monkeypatch.setattr("app.services.cache.random.random", lambda: 0.5)
+    # -ln(0.5) * delta ~ 0.69 s of jitter
+    assert cache._should_refresh(CacheEntry(None, now + 0.5, 1.0)) is True
+    assert cache._should_refresh(CacheEntry(None, now + 10, 1.0)) is False
+    # A never-measured fetch is only refreshed once expired
+    assert cache._should_refresh(CacheEntry(None, now + 0.5, 0.0)) is False
+
+@pytest.mark.asyncio
+async def test_missing_objects_are_cached_negatively():
+    from app.services.cache import CACHE_NEGATIVE_HITS, NEGATIVE_SENTINEL
+    cache = CacheService(prefix=f"test-{uuid.uuid4()}", ttl=60, negative_ttl=5)
+    calls = []
+
+    async def fetcher():
+        calls.append(1)
+        return None
+
+    assert await cache.get_or_set("gone", Item, fetcher) is None
+    hits = CACHE_NEGATIVE_HITS.labels(cache=cache.prefix)._value.get()
+    assert await cache.get_or_set("gone", Item, fetcher) is None
+    assert len(calls) == 1
+    assert CACHE_NEGATIVE_HITS.labels(cache=cache.prefix)._value.get() == hits + 1
+
+    redis = await get_redis()
+    assert await redis.get(f"{cache.prefix}:gone") == NEGATIVE_SENTINEL
+    assert 0 < await redis.ttl(f"{cache.prefix}:gone") <= 5
+
+    # Creating the object invalidates the negative entry
+    await cache.invalidate("gone")
+
+    async def created():
+        return Item(id="gone", name="back")
+
+    assert (await cache.get_or_set("gone", Item, created)).name == "back"
+
+@pytest.mark.asyncio
+async def test_get_or_set_many_fetches_only_misses_in_order():
+    cache = CacheService(prefix=f"test-{uuid.uuid4()}", ttl=60, local_size=10, negative_ttl=5)
+    await cache.set_many({"2": Item(id="2", name="cached")})
+    requested = []
+
+    async def bulk_fetcher(keys):
+        requested.append(keys)
+        return {key: {"id": key, "name": "loaded"} for key in keys if key != "404"}
+
+    results = await cache.get_or_set_many(["3", "2", "404", "1", "3"], Item, bulk_fetcher)
+    assert requested == [["3", "404", "1"]]
+    assert [r.id if r else None for r in results] == ["3", "2", None, "1", "3"]
+    assert results[1].name == "cached" and results[0].name == "loaded"
+
+    # Everything, including the missing key, is now served without the fetcher
+    results = await cache.get_or_set_many(["1", "404", "2", "3"], Item, bulk_fetcher)
+    assert len(requested) == 1
+    assert [r.id if r else None for r in results] == ["1", None, "2", "3"]
+    assert await cache.get_many(["5", "1"], Item) == [None, results[0]]
+
+def test_serializer_formats_round_trip():
+    from app.services.serialization import FORMAT_COMPRESSED, FORMAT_MSGPACK, FORMAT_ORJSON, Serializer
+    payload = {"f": 1.5, "d": 0.01, "v": {"id": "1", "name": "x" * 2000}}
+
+    packed = Serializer("msgpack", compress_min_bytes=0).dumps(payload)
+    assert packed[0] == FORMAT_MSGPACK
+    compressed = Serializer("orjson", compress_min_bytes=1024).dumps(payload)
+    assert compressed[0] == FORMAT_ORJSON | FORMAT_COMPRESSED
+    assert len(compressed) < 200
+
+    # Any serializer reads every format, including JSON text from before the format byte
+    reader = Serializer("json")
+    legacy = json.dumps(payload)
+    for data in (packed, compressed, legacy, legacy.encode(), reader.dumps(payload)):
+        assert reader.loads(data) == payload
+
+    with pytest.raises(ValueError):
+        Serializer("pickle")
+
+def test_cache_entries_use_configured_serializer():
+    from app.services.serialization import Serializer
+    cache = CacheService(prefix=f"test-{uuid.uuid4()}", serializer=Serializer("msgpack"), envelope=True)
+    data = cache.encode(Item(id="1", name="first"), delta=0.5)
+    assert isinstance(data, bytes)
+    entry = cache.decode(data, Item)
+    assert entry.value == Item(id="1", name="first") and entry.delta == 0.5
+    assert cache.decode(b"!missing", Item).value is None
@@ -1,7 +1,7 @@
 import pytest
 import uuid
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.services.chat import chat_service
+from app.services.chat import chat_service, ChatService, MessageWriter
 from app.models.user import User
 
 @pytest.mark.asyncio
@@ -20,3 +20,230 @@ async def test_get_or_create_conversation(db: AsyncSession):
     u1 = uuid.uuid4()
     u2 = uuid.uuid4()
     assert chat_service.get_or_create_conversation is not None
+
+class RecordingWriter(MessageWriter):
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.batches = []
+
+    async def _write(self, rows, skip_existing=False):
+        self.batches.append(rows)
+
+@pytest.mark.asyncio
+async def test_message_writer_batches_rows():
+    writer = RecordingWriter(batch_size=3, flush_interval_ms=50, max_queue=100, durability="async")
+    for i in range(7):
+        await writer.submit(chat_service.build_message(uuid.uuid4(), f"message {i}"))
+    await writer.stop()
+
+    assert [len(batch) for batch in writer.batches] == [3, 3, 1]
+
+@pytest.mark.asyncio
+async def test_message_writer_retries_with_backoff(monkeypatch):
+    import asyncio
+    sleeps = []
+    real_sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        sleeps.append(delay)
+        await real_sleep(0)
+
+    class FlakyWriter(RecordingWriter):
+        failures = 2
+
+        async def _write(self, rows, skip_existing=False):
+            if self.failures:
+                self.failures -= 1
+                raise ConnectionError("database unavailable")
+            await super()._write(rows)
+
+    monkeypatch.setattr("app.services.chat.asyncio.sleep", fake_sleep)
+    writer = FlakyWriter(batch_size=10, flush_interval_ms=5, max_queue=100, retries=3, backoff_ms=100)
+    await writer.submit(chat_service.build_message(uuid.uuid4(), "hi"))
+    await writer.stop()
+
+    assert sleeps == [0.1, 0.2]
+    assert len(writer.batches) == 1
+
+@pytest.mark.asyncio
+async def test_message_writer_dead_letters_after_retries():
+    import json
+    from app.core.redis import get_redis
+    from app.services.chat import DEAD_LETTER_KEY, deserialize_message
+
+    class BrokenWriter(RecordingWriter):
+        down = True
+
+        async def _write(self, rows, skip_existing=False):
+            if self.down:
+                raise ConnectionError("database unavailable")
+            await super()._write(rows)
+
+    redis = await get_redis()
+    await redis.delete(DEAD_LETTER_KEY)
+    writer = BrokenWriter(batch_size=10, flush_interval_ms=5, max_queue=100, retries=1, backoff_ms=1)
+    row = chat_service.build_message(uuid.uuid4(), "keep me", conversation_id=uuid.uuid4())
+    await writer.submit(row)
+    await writer.stop()
+
+    assert [deserialize_message(json.loads(e)) for e in await redis.lrange(DEAD_LETTER_KEY, 0, -1)] == [row]
+    writer.down = False
+    assert await writer.replay_dead_letters() == 1
+    assert writer.batches == [[row]]
+    assert await redis.llen(DEAD_LETTER_KEY) == 0
+
+class PickyWriter(RecordingWriter):
+    """Rejects any batch containing an over-long type, like the VARCHAR(50) column."""
+
+    async def _write(self, rows, skip_existing=False):
+        from sqlalchemy.exc import DataError
+        if any(len(row["type"]) > 50 for row in rows):
+            raise DataError("INSERT INTO messages", {}, Exception("value too long for type character varying(50)"))
+        await super()._write(rows, skip_existing)
+
+@pytest.mark.asyncio
+async def test_message_writer_parks_rejected_rows():
+    import json
+    from app.core.redis import get_redis
+    from app.services.chat import DEAD_LETTER_KEY, POISON_KEY
+
+    redis = await get_redis()
+    await redis.delete(DEAD_LETTER_KEY, POISON_KEY)
+    writer = PickyWriter(batch_size=10, flush_interval_ms=50, max_queue=100, retries=3, backoff_ms=1000)
+    rows = [chat_service.build_message(uuid.uuid4(), f"message {i}") for i in range(5)]
+    rows[3]["type"] = "X" * 60
+    for row in rows:
+        await writer.submit(row)
+    await writer.stop()
+
+    written = [row["id"] for batch in writer.batches for row in batch]
+    assert sorted(written) == sorted(row["id"] for i, row in enumerate(rows) if i != 3)
+    assert [json.loads(e)["id"] for e in await redis.lrange(POISON_KEY, 0, -1)] == [str(rows[3]["id"])]
+    assert await redis.llen(DEAD_LETTER_KEY) == 0
+
+@pytest.mark.asyncio
+async def test_replay_parks_rejected_rows_and_drains():
+    import json
+    from app.core.redis import get_redis
+    from app.services.chat import DEAD_LETTER_KEY, POISON_KEY, serialize_message
+
+    redis = await get_redis()
+    await redis.delete(DEAD_LETTER_KEY, POISON_KEY)
+    rows = [chat_service.build_message(uuid.uuid4(), f"message {i}") for i in range(3)]
+    rows[0]["type"] = "X" * 60
+    await redis.rpush(DEAD_LETTER_KEY, *[json.dumps(serialize_message(row)) for row in rows])
+
+    writer = PickyWriter()
+    assert await writer.replay_dead_letters(batch_size=2) == 2
+    assert await redis.llen(DEAD_LETTER_KEY) == 0
+    assert [json.loads(e)["id"] for e in await redis.lrange(POISON_KEY, 0, -1)] == [str(rows[0]["id"])]
+
+def test_message_error_checks_type_and_length():
+    from app.core.config import settings
+    from app.services.chat import message_error
+    assert message_error("hi", "TEXT") is None
+    assert message_error("hi", "SYSTEM") is not None
+    assert message_error("hi", "X" * 60) is not None
+    assert message_error("", "TEXT") is not None
+    assert message_error({"not": "text"}, "TEXT") is not None
+    assert message_error("x" * (settings.CHAT_MAX_MESSAGE_LENGTH + 1), "TEXT") is not None
+
+@pytest.mark.asyncio
+async def test_message_writer_sync_mode_waits_for_commit():
+    writer = RecordingWriter(batch_size=10, flush_interval_ms=5, max_queue=100, durability="sync")
+    await writer.submit(chat_service.build_message(uuid.uuid4(), "<b>hi</b>"))
+
+    assert len(writer.batches) == 1
+    assert writer.batches[0][0]["content"] == "hi"
+    await writer.stop()
+
+@pytest.mark.asyncio
+async def test_conversation_cache_hit_skips_lookup():
+    service = ChatService(conversation_cache_size=2)
+    pairs = [tuple(sorted([uuid.uuid4(), uuid.uuid4()])) for _ in range(3)]
+    for pair in pairs:
+        service._remember_conversation(pair, uuid.uuid4())
+
+    # Oldest pair evicted, newest still resolvable in either argument order
+    assert pairs[0] not in service._conversation_ids
+    u1, u2 = pairs[2]
+    assert await service.get_conversation_id(u2, u1) == service._conversation_ids[pairs[2]]
+
+@pytest.mark.asyncio
+async def test_recent_messages_ring_buffer():
+    from app.services.chat import recent_messages_key
+
+    room_id = uuid.uuid4()
+    key = recent_messages_key(room_id=room_id)
+    assert await chat_service.get_recent(key, 20) is None
+
+    await chat_service.fill_recent(key, [], complete=True)
+    for i in range(3):
+        await chat_service.push_recent(chat_service.build_message(uuid.uuid4(), f"line {i}", room_id=room_id))
+
+    recent = await chat_service.get_recent(key, 2)
+    assert [m["content"] for m in recent] == ["line 2", "line 1", "line 0"]
+    assert len(await chat_service.get_recent(key, 20)) == 3
+
+@pytest.mark.asyncio
+async def test_fill_recent_keeps_message_pushed_during_merge(monkeypatch):
+    from redis.asyncio.client import Pipeline
+    from app.services.chat import recent_messages_key, serialize_message
+
+    room_id = uuid.uuid4()
+    key = recent_messages_key(room_id=room_id)
+    from_db = serialize_message(chat_service.build_message(uuid.uuid4(), "from db", room_id=room_id))
+    pushed = chat_service.build_message(uuid.uuid4(), "sent meanwhile", room_id=room_id)
+
+    real_execute = Pipeline.immediate_execute_command
+    pushes = []
+
+    async def push_after_read(self, *args, **options):
+        result = await real_execute(self, *args, **options)
+        if args[0] == "LRANGE" and not pushes:
+            pushes.append(pushed)
+            await chat_service.push_recent(pushed)
+        return result
+
+    monkeypatch.setattr(Pipeline, "immediate_execute_command", push_after_read)
+    await chat_service.fill_recent(key, [from_db], complete=True)
+
+    recent = await chat_service.get_recent(key, 20)
+    assert [m["content"] for m in recent] == ["sent meanwhile", "from db"]
+
+@pytest.mark.asyncio
+async def test_conversation_history_rejects_non_participants(async_client, db_session, auth_headers):
+    from app.models.chat import Conversation
+    users = [
+        User(id=uuid.uuid4(), email=f"dm-{uuid.uuid4()}@example.com", name="DM", hashed_password="x", is_active=True)
+        for _ in range(2)
+    ]
+    db_session.add_all(users)
+    await db_session.flush()
+    conversation = Conversation(user_one_id=users[0].id, user_two_id=users[1].id)
+    db_session.add(conversation)
+    await db_session.flush()
+
+    # auth_headers belong to a third user
+    response = await async_client.get(f"/api/chat/conversations/{conversation.id}/history", headers=auth_headers)
+    assert response.status_code == 403
+
+    response = await async_client.get(f"/api/chat/conversations/{conversation.id}/history")
+    assert response.status_code == 401
+
+@pytest.mark.asyncio
+async def test_get_or_create_conversation_leaves_commit_to_caller(db_session, monkeypatch):
+    users = [
+        User(id=uuid.uuid4(), email=f"conv-{uuid.uuid4()}@example.com", name="Conv", hashed_password="x", is_active=True)
+        for _ in range(2)
+    ]
+    db_session.add_all(users)
+    await db_session.flush()
+
+    async def no_commit():
+        raise AssertionError("the service must not commit the caller's session")
+
+    monkeypatch.setattr(db_session, "commit", no_commit)
+    first = await chat_service.get_or_create_conversation(db_session, users[0].id, users[1].id)
+    again = await chat_service.get_or_create_conversation(db_session, users[1].id, users[0].id)
+    assert first.id == again.id
@@ -0,0 +1,213 @@
+import pytest
+import uuid
+from app.services.feed_service import FeedService, user_feed_key
+from app.core.redis import get_redis
+
+@pytest.mark.asyncio
+async def test_fan_out_is_chunked():
+    service = FeedService(max_length=500, chunk_size=2)
+    post_id = uuid.uuid4()
+    followers = [uuid.uuid4() for _ in range(5)]
+
+    stats = await service.add_post_to_feeds(post_id, uuid.uuid4(), followers)
+
+    assert [chunk["size"] for chunk in stats] == [2, 2, 1]
+    redis = await get_redis()
+    for follower_id in followers:
+        assert await redis.zscore(user_feed_key(follower_id), str(post_id)) is not None
+
+@pytest.mark.asyncio
+async def test_fan_out_trims_feed():
+    service = FeedService(max_length=3, chunk_size=10)
+    follower_id = uuid.uuid4()
+    for score in range(5):
+        await service.add_post_to_feeds(uuid.uuid4(), uuid.uuid4(), [follower_id], score=score)
+
+    redis = await get_redis()
+    assert await redis.zcard(user_feed_key(follower_id)) == 3
+
+def test_merge_orders_and_dedupes():
+    own = [("c", 30.0), ("a", 10.0)]
+    pulled = [("d", 40.0), ("c", 30.0), ("b", 20.0)]
+
+    assert [m for m, _ in FeedService._merge([own, pulled], 10)] == ["d", "c", "b", "a"]
+    assert FeedService._merge([own, pulled], 2) == [("d", 40.0), ("c", 30.0)]
+
+@pytest.mark.asyncio
+async def test_pull_author_is_merged_at_read_time():
+    service = FeedService(max_length=500, chunk_size=10, pull_threshold=2)
+    author_id = uuid.uuid4()
+    followers = [uuid.uuid4(), uuid.uuid4()]
+    post_id = uuid.uuid4()
+
+    stats = await service.add_post_to_feeds(post_id, author_id, followers, score=100)
+    assert stats == []
+
+    redis = await get_redis()
+    assert await redis.zscore(user_feed_key(followers[0]), str(post_id)) is None
+    assert await service.get_feed(user_id=followers[0]) == [(str(post_id), 100.0)]
+
+@pytest.mark.asyncio
+async def test_unfriended_pull_author_is_dropped(db_session):
+    from app.models.user import Relationship, User
+    from app.services.feed_service import pull_sources_key
+    service = FeedService(max_length=500, chunk_size=10, pull_threshold=1)
+    reader, author = [
+        User(id=uuid.uuid4(), email=f"feed-{uuid.uuid4()}@example.com", name="Feed", hashed_password="x", is_active=True)
+        for _ in range(2)
+    ]
+    db_session.add_all([reader, author])
+    await db_session.flush()
+    friendship = Relationship(from_user_id=reader.id, to_user_id=author.id, type="FRIEND", status="ACCEPTED")
+    db_session.add(friendship)
+    await db_session.flush()
+
+    post_id = uuid.uuid4()
+    await service.add_post_to_feeds(post_id, author.id, [reader.id], score=100)
+    assert await service.get_feed(user_id=reader.id, db=db_session) == [(str(post_id), 100.0)]
+
+    # Unfriend: the author's posts disappear and the pull entry is cleaned up
+    await db_session.delete(friendship)
+    await db_session.flush()
+    assert await service.get_feed(user_id=reader.id, db=db_session) == []
+    redis = await get_redis()
+    assert await redis.smembers(pull_sources_key(reader.id)) == set()
+
+@pytest.mark.asyncio
+async def test_item_cache_round_trip():
+    from datetime import datetime
+    from app.schemas.community import StatusUpdateSchema
+
+    service = FeedService()
+    item = StatusUpdateSchema(id=uuid.uuid4(), author_id=uuid.uuid4(), content="hello", created_at=datetime.utcnow())
+    await service.cache_items([item])
+
+    cached = await service.get_cached_items([item.id, uuid.uuid4()])
+    assert list(cached) == [str(item.id)]
+    assert cached[str(item.id)].content == "hello"
+
+    await service.remove_post(item.id, item.author_id)
+    assert await service.get_cached_items([item.id]) == {}
+
+@pytest.mark.asyncio
+async def test_removed_post_is_not_recached_by_inflight_hydrate():
+    from datetime import datetime
+    from app.schemas.community import StatusUpdateSchema
+
+    service = FeedService()
+    item = StatusUpdateSchema(id=uuid.uuid4(), author_id=uuid.uuid4(), content="hello", created_at=datetime.utcnow())
+
+    class RemovedDuringQuery:
+        """Returns the post, but the post is removed while the query runs."""
+        async def execute(self, stmt):
+            await service.remove_post(item.id, item.author_id)
+            return self
+
+        def scalars(self):
+            return [item]
+
+    assert [hydrated.id for hydrated in await service.hydrate_items(RemovedDuringQuery(), [str(item.id)])] == [item.id]
+    assert await service.get_cached_items([item.id]) == {}
+
+@pytest.mark.asyncio
+async def test_cursor_pages_through_tied_scores():
+    service = FeedService(max_length=500, chunk_size=10)
+    follower_id = uuid.uuid4()
+    post_ids = [str(uuid.uuid4()) for _ in range(5)]
+    for post_id in post_ids:
+        await service.add_post_to_feeds(post_id, None, [follower_id], score=1000.5)
+
+    seen = []
+    cursor = None
+    while True:
+        entries = await service.get_feed(user_id=follower_id, limit=2, cursor=cursor)
+        page = entries[:2]
+        seen.extend(member for member, _ in page)
+        if len(entries) <= 2:
+            break
+        last_member, last_score = page[-1]
+        cursor = (last_score, last_member)
+
+    assert sorted(seen) == sorted(post_ids)
+    assert len(seen) == len(set(seen))
+
+async def seed_follow_graph(db_session, followers: int = 2):
+    """An author followed by `followers` readers, a stranger, and a post by each of them."""
+    from datetime import datetime, timedelta
+    from app.models.community import StatusUpdate
+    from app.models.user import Relationship, User
+    users = [
+        User(id=uuid.uuid4(), email=f"feed-{uuid.uuid4()}@example.com", name="Feed", hashed_password="x", is_active=True)
+        for _ in range(followers + 2)
+    ]
+    db_session.add_all(users)
+    await db_session.flush()
+    author, stranger, readers = users[0], users[1], users[2:]
+    db_session.add_all([
+        Relationship(from_user_id=reader.id, to_user_id=author.id, type="FRIEND", status="ACCEPTED")
+        for reader in readers
+    ])
+    now = datetime.utcnow()
+    posts = [
+        StatusUpdate(id=uuid.uuid4(), author_id=author.id, content="first", created_at=now - timedelta(minutes=2)),
+        StatusUpdate(id=uuid.uuid4(), author_id=author.id, content="second", created_at=now - timedelta(minutes=1)),
+        StatusUpdate(id=uuid.uuid4(), author_id=stranger.id, content="unrelated", created_at=now),
+    ]
+    db_session.add_all(posts)
+    await db_session.flush()
+    return author, readers, posts
+
+def run_task_inline(monkeypatch, db_session):
+    """Run Celery task bodies on the test loop against the test session."""
+    from contextlib import nullcontext
+    monkeypatch.setattr("app.services.tasks.run_async", lambda coro: coro)
+    monkeypatch.setattr("app.services.tasks.SessionLocal", lambda: nullcontext(db_session))
+
+@pytest.mark.asyncio
+async def test_rebuild_user_feed_task_loads_followed_posts(db_session, monkeypatch):
+    from app.services.tasks import rebuild_user_feed
+    author, readers, posts = await seed_follow_graph(db_session)
+    run_task_inline(monkeypatch, db_session)
+
+    assert await rebuild_user_feed(str(readers[0].id)) == 2
+    redis = await get_redis()
+    feed = await redis.zrevrange(user_feed_key(readers[0].id), 0, -1)
+    assert feed == [str(posts[1].id), str(posts[0].id)]
+
+@pytest.mark.asyncio
+async def test_backfill_friendship_registers_pull_author(db_session, monkeypatch):
+    from app.services.feed_service import feed_service, pull_sources_key
+    from app.services.tasks import backfill_friendship
+    author, readers, posts = await seed_follow_graph(db_session)
+    run_task_inline(monkeypatch, db_session)
+    monkeypatch.setattr(feed_service, "pull_threshold", 1)
+    # The author went pull-mode with an earlier post
+    await feed_service.add_post_to_feeds(posts[1].id, author.id, [readers[1].id])
+
+    assert await backfill_friendship(str(readers[0].id), str(author.id)) == 2
+    redis = await get_redis()
+    assert await redis.smembers(pull_sources_key(readers[0].id)) == {str(author.id)}
+    assert await redis.zcard(user_feed_key(readers[0].id)) == 2
+
+@pytest.mark.asyncio
+async def test_warm_feeds_restores_pull_authors(db_session, monkeypatch):
+    from app.services.feed_service import PULL_AUTHORS_KEY, author_feed_key, feed_service, pull_sources_key
+    from app.services.tasks import rebuild_user_feed, warm_feeds
+    author, readers, posts = await seed_follow_graph(db_session, followers=2)
+    run_task_inline(monkeypatch, db_session)
+    monkeypatch.setattr(feed_service, "pull_threshold", 2)
+    scheduled = []
+    monkeypatch.setattr(rebuild_user_feed, "apply_async", lambda args, countdown: scheduled.append(args[0]))
+
+    # As after a flush: nothing about the author is left in Redis
+    redis = await get_redis()
+    await redis.srem(PULL_AUTHORS_KEY, str(author.id))
+    await redis.delete(author_feed_key(author.id), *[pull_sources_key(reader.id) for reader in readers])
+
+    await warm_feeds()
+    assert await redis.sismember(PULL_AUTHORS_KEY, str(author.id))
+    assert await redis.zrevrange(author_feed_key(author.id), 0, -1) == [str(posts[1].id), str(posts[0].id)]
+    for reader in readers:
+        assert await redis.smembers(pull_sources_key(reader.id)) == {str(author.id)}
+        assert str(reader.id) in scheduled
+    assert str(posts[2].id) in await redis.zrange("feed:global", 0, -1)
@@ -1,5 +1,5 @@
 import pytest
-from app.core.pagination import encode_cursor, decode_cursor, get_pagination_metadata
+from app.core.pagination import encode_cursor, decode_cursor, get_pagination_metadata, encode_score_cursor, decode_score_cursor
 from datetime import datetime
 
 def test_encode_decode_cursor():
@@ -37,3 +37,9 @@ def test_pagination_metadata():
     metadata = get_pagination_metadata(items[:2], limit, "created_at")
     assert metadata["has_next"] is False
     assert metadata["next_cursor"] is None
+
+def test_encode_decode_score_cursor():
+    cursor = encode_score_cursor(1766224800.123456, "8d0f6a4e-2f1b-4c39-9d6e-0a7b2f3c4d5e")
+    assert decode_score_cursor(cursor) == (1766224800.123456, "8d0f6a4e-2f1b-4c39-9d6e-0a7b2f3c4d5e")
+    assert decode_score_cursor("invalid_base64") is None
+    assert decode_score_cursor(None) is None
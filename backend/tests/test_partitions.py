@@ -0,0 +1,35 @@
+from datetime import date
+from app.services.partitions import PartitionManager, add_months
+
+def test_add_months_rolls_over_years():
+    assert add_months(date(2025, 12, 1), 1) == date(2026, 1, 1)
+    assert add_months(date(2026, 3, 1), -12) == date(2025, 3, 1)
+
+def test_partition_names_round_trip():
+    manager = PartitionManager()
+    name = manager.partition_name(date(2026, 1, 1))
+    assert name == "messages_y2026m01"
+    assert manager.partition_month(name) == date(2026, 1, 1)
+    assert manager.partition_month("messages_default") is None
+
+class RecordingSession:
+    def __init__(self):
+        self.statements = []
+
+    async def execute(self, statement, params=None):
+        self.statements.append(str(statement))
+
+        class Result:
+            rowcount = 0
+        return Result()
+
+    async def commit(self):
+        self.statements.append("COMMIT")
+
+def test_create_partition_locks_default_first():
+    import asyncio
+    db = RecordingSession()
+    asyncio.run(PartitionManager().create_partition(db, date(2026, 1, 1)))
+
+    assert db.statements[0] == "LOCK TABLE messages_default IN ACCESS EXCLUSIVE MODE"
+    assert "ATTACH PARTITION" in db.statements[-2] and db.statements[-1] == "COMMIT"
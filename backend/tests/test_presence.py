@@ -2,7 +2,7 @@ import pytest
 import asyncio
 import time
 import uuid
-from app.services.presence import presence_service
+from app.services.presence import PresencePublisher, presence_service
 
 @pytest.mark.asyncio
 async def test_update_presence():
@@ -22,3 +22,126 @@ async def test_get_online_users():
     online_users = await presence_service.get_online_users()
     assert str(user_1) in online_users
     assert str(user_2) in online_users
+
+@pytest.mark.asyncio
+async def test_online_set_is_sharded():
+    user_ids = [uuid.uuid4() for _ in range(64)]
+    shards = {presence_service.shard_key(u) for u in user_ids}
+    assert len(shards) > 1
+    assert all(key.startswith("presence:online:") for key in shards)
+
+@pytest.mark.asyncio
+async def test_heartbeats_are_batched():
+    user_id = uuid.uuid4()
+    presence_service.record_heartbeat(user_id)
+    assert await presence_service.is_user_online(user_id) is False
+
+    assert await presence_service.flush_heartbeats() >= 1
+    assert await presence_service.is_user_online(user_id) is True
+
+@pytest.mark.asyncio
+async def test_offline_drops_buffered_heartbeat():
+    user_id = uuid.uuid4()
+    presence_service.record_heartbeat(user_id)
+    await presence_service.update_presence(user_id, "offline")
+
+    await presence_service.flush_heartbeats()
+    assert await presence_service.is_user_online(user_id) is False
+
+@pytest.mark.asyncio
+async def test_are_users_online_bulk():
+    online = [uuid.uuid4() for _ in range(5)]
+    offline = uuid.uuid4()
+    for user_id in online:
+        await presence_service.update_presence(user_id, "online")
+
+    flags = await presence_service.are_users_online(online + [offline])
+    assert all(flags[str(u)] for u in online)
+    assert flags[str(offline)] is False
+
+@pytest.mark.asyncio
+async def test_offline_transition_and_count():
+    user_id = uuid.uuid4()
+    await presence_service.update_presence(user_id, "online")
+    assert await presence_service.approximate_online_count() >= 1
+
+    await presence_service.update_presence(user_id, "offline")
+    assert await presence_service.is_user_online(user_id) is False
+
+@pytest.mark.asyncio
+async def test_bulk_presence_endpoint(async_client, auth_headers):
+    online = uuid.uuid4()
+    offline = uuid.uuid4()
+    await presence_service.update_presence(online, "online")
+
+    response = await async_client.post(
+        "/api/presence/bulk",
+        json={"user_ids": [str(online), str(offline)]},
+        headers=auth_headers
+    )
+    assert response.status_code == 200
+    assert response.json()["online"] == {str(online): True, str(offline): False}
+
+    too_many = [str(uuid.uuid4()) for _ in range(501)]
+    response = await async_client.post("/api/presence/bulk", json={"user_ids": too_many}, headers=auth_headers)
+    assert response.status_code == 422
+
+def test_presence_changes_grouped_per_recipient():
+    pending = {
+        "alice": (True, ["carol", "dave"]),
+        "bob": (False, ["carol", "erin"]),
+    }
+    online = {"carol": True, "dave": True, "erin": False}
+
+    frames = PresencePublisher.group_by_recipient(pending, online)
+    assert frames == {
+        "carol": [{"user_id": "alice", "online": True}, {"user_id": "bob", "online": False}],
+        "dave": [{"user_id": "alice", "online": True}],
+    }
+
+@pytest.mark.asyncio
+async def test_presence_publisher_batches_reconnects():
+    friend = uuid.uuid4()
+    await presence_service.update_presence(friend, "online")
+    emitted = []
+
+    async def emit(room, frame):
+        emitted.append((room, frame))
+
+    publisher = PresencePublisher(emit, window_ms=60000)
+    for _ in range(3):
+        user_id = str(uuid.uuid4())
+        publisher.publish(user_id, False, [str(friend)])
+        publisher.publish(user_id, True, [str(friend)])
+
+    assert await publisher.flush() == 1
+    assert len(emitted) == 1
+    room, frame = emitted[0]
+    assert room == str(friend)
+    assert [change["online"] for change in frame["changes"]] == [True, True, True]
+
+@pytest.mark.asyncio
+async def test_connection_transitions():
+    user_id = uuid.uuid4()
+    assert await presence_service.open_connection(user_id, "sid-1") is True
+    assert await presence_service.open_connection(user_id, "sid-2") is False
+    assert await presence_service.close_connection(user_id, "sid-1") is False
+    assert await presence_service.close_connection(user_id, "sid-2") is True
+
+@pytest.mark.asyncio
+async def test_connections_of_dead_nodes_are_ignored():
+    from app.core.redis import get_redis
+    from app.services.presence import PresenceService, presence_node_key
+    user_id = uuid.uuid4()
+    other_node = PresenceService()
+    assert await other_node.open_connection(user_id, "sid-other") is True
+    assert await presence_service.open_connection(user_id, "sid-1") is False
+
+    # The other node dies without running its disconnect handlers
+    other_node._node_task.cancel()
+    redis = await get_redis()
+    await redis.delete(presence_node_key(other_node.node_id))
+
+    assert await presence_service.close_connection(user_id, "sid-1") is True
+    assert await presence_service.open_connection(user_id, "sid-2") is True
+    await presence_service.close_connection(user_id, "sid-2")
@@ -0,0 +1,233 @@
+import pytest
+import uuid
+from httpx import AsyncClient
+from app.models.user import User, Profile
+
+# Points roughly 0, 5, 10 and 100 km north of the search origin
+ORIGIN = (40.7128, -74.0060)
+OFFSETS_KM = [0, 5, 10, 100]
+
+async def seed_profiles(db_session, ethnicity: str):
+    profiles = []
+    for km in OFFSETS_KM:
+        user = User(id=uuid.uuid4(), email=f"geo-{uuid.uuid4()}@example.com", is_active=True)
+        profile = Profile(
+            id=user.id,
+            ethnicity=ethnicity,
+            location_lat=ORIGIN[0] + km / 111.2,
+            location_lng=ORIGIN[1]
+        )
+        db_session.add_all([user, profile])
+        profiles.append(profile)
+    await db_session.flush()
+    return profiles
+
+@pytest.mark.asyncio
+async def test_nearby_search_is_distance_ordered(client: AsyncClient, db_session):
+    tag = f"geo-{uuid.uuid4()}"
+    profiles = await seed_profiles(db_session, tag)
+
+    response = await client.get(
+        "/api/search/",
+        params={"lat": ORIGIN[0], "lng": ORIGIN[1], "radius_km": 50, "ethnicity": tag, "limit": 2}
+    )
+    assert response.status_code == 200
+    page = response.json()
+    assert [item["id"] for item in page["items"]] == [str(profiles[0].id), str(profiles[1].id)]
+    assert page["items"][1]["distance_km"] == pytest.approx(5, abs=0.1)
+    assert page["metadata"]["has_next"] is True
+
+    response = await client.get(
+        "/api/search/",
+        params={
+            "lat": ORIGIN[0], "lng": ORIGIN[1], "radius_km": 50, "ethnicity": tag,
+            "limit": 2, "cursor": page["metadata"]["next_cursor"]
+        }
+    )
+    page = response.json()
+    # The 100 km profile is outside the radius
+    assert [item["id"] for item in page["items"]] == [str(profiles[2].id)]
+    assert page["metadata"]["has_next"] is False
+
+@pytest.mark.asyncio
+async def test_nearby_search_from_redis_pages_by_distance(client: AsyncClient, db_session, monkeypatch):
+    from app.core.config import settings
+    from app.services.location import index_user_location
+
+    monkeypatch.setattr(settings, "GEO_SEARCH_BACKEND", "redis")
+    tag = f"geo-{uuid.uuid4()}"
+    profiles = await seed_profiles(db_session, tag)
+    for profile in profiles:
+        await index_user_location(profile.id, profile.location_lat, profile.location_lng)
+
+    params = {"lat": ORIGIN[0], "lng": ORIGIN[1], "radius_km": 50, "ethnicity": tag, "limit": 1}
+    seen = []
+    cursor = None
+    while True:
+        response = await client.get("/api/search/", params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        page = response.json()
+        seen += [item["id"] for item in page["items"]]
+        cursor = page["metadata"]["next_cursor"]
+        if not page["metadata"]["has_next"]:
+            break
+
+    assert seen == [str(p.id) for p in profiles[:3]]
+
+class MatchingProfiles:
+    """Stands in for the session: returns the profiles in the IN list that pass a filter."""
+    def __init__(self, accepted):
+        self.accepted = accepted
+
+    async def execute(self, stmt):
+        from types import SimpleNamespace
+        ids = next(iter(stmt.compile().params.values()))
+        found = [SimpleNamespace(id=i) for i in ids if i in self.accepted]
+        return SimpleNamespace(scalars=lambda: found)
+
+@pytest.mark.asyncio
+async def test_nearest_pages_resume_from_cursor_and_never_truncate(monkeypatch):
+    from sqlalchemy import select
+    from app.core.config import settings
+    from app.services.location import paginate_nearest_from_redis
+
+    members = [(str(uuid.uuid4()), float(i)) for i in range(60)]
+    counts = []
+
+    async def nearest(lat, lng, radius_km, count):
+        counts.append(count)
+        return members[:count]
+
+    monkeypatch.setattr("app.services.location.search_users_nearest", nearest)
+    monkeypatch.setattr(settings, "GEO_NEARBY_MAX_CANDIDATES", 12)
+    # Only every tenth member passes the filters
+    db = MatchingProfiles({uuid.UUID(m) for m, _ in members[::10]})
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        page = await paginate_nearest_from_redis(db, select(Profile), 0, 0, 50, limit=2, cursor=cursor)
+        seen += [str(profile.id) for profile, _dist in page["items"]]
+        pages += 1
+        if not page["metadata"]["has_next"]:
+            break
+        cursor = page["metadata"]["next_cursor"]
+
+    assert seen == [m for m, _ in members[::10]]
+    # Every request reads at most the cap past where the previous page stopped
+    assert max(counts) <= 60 + 12 and pages > 3
+
+async def explain(db_session, **filters) -> str:
+    from sqlalchemy import and_, desc, select, text
+    from sqlalchemy.dialects import postgresql
+    from app.services.search_service import build_profile_filters
+
+    stmt = (
+        select(Profile)
+        .where(and_(*build_profile_filters(**filters)))
+        .order_by(desc(Profile.created_at))
+        .limit(21)
+    )
+    sql = str(stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    result = await db_session.execute(text(f"EXPLAIN {sql}"))
+    return "\n".join(row[0] for row in result)
+
+@pytest.mark.asyncio
+async def test_search_filters_use_indexes(db_session):
+    from sqlalchemy import text
+
+    cities = ["New York", "Los Angeles", "Chicago", "Houston", "Atlanta"]
+    for i in range(500):
+        user = User(id=uuid.uuid4(), email=f"idx-{uuid.uuid4()}@example.com", is_active=True)
+        db_session.add_all([user, Profile(
+            id=user.id,
+            ethnicity=f"ethnicity-{i % 10}",
+            position=f"position-{i % 4}",
+            build=f"build-{i % 5}",
+            location_city=cities[i % len(cities)],
+            is_trans_interested=(i % 20 == 0)
+        )])
+    await db_session.flush()
+    await db_session.execute(text("ANALYZE profiles"))
+    # Small tables favour sequential scans; check the indexes are usable at all
+    await db_session.execute(text("SET LOCAL enable_seqscan = off"))
+
+    plan = await explain(db_session, location="lanta")
+    assert "ix_profiles_location_city_trgm" in plan
+
+    plan = await explain(db_session, ethnicity="ethnicity-3", position="position-1")
+    assert "ix_profiles_ethnicity_position_build_created_at" in plan
+
+    plan = await explain(db_session, trans_interested=True)
+    assert "ix_profiles_trans_interested_created_at" in plan
+
+def test_filters_normalize_to_one_key():
+    from app.schemas.search import SearchFilters
+    from app.services.search_service import filters_hash, normalize_filters
+
+    a = normalize_filters(SearchFilters(location=" Atlanta ", position="top", lat=33.74901, lng=-84.38798))
+    b = normalize_filters(SearchFilters(location="atlanta", position="top", lat=33.7490, lng=-84.3880, radius_km=50))
+    c = normalize_filters(SearchFilters(location="atlanta", position="bottom"))
+    assert filters_hash(a) == filters_hash(b)
+    assert filters_hash(a) != filters_hash(c)
+    # Radius is meaningless without coordinates
+    assert c.radius_km is None
+
+@pytest.mark.asyncio
+async def test_facet_counts(client: AsyncClient, db_session):
+    tag = f"facet-{uuid.uuid4()}"
+    for i in range(6):
+        user = User(id=uuid.uuid4(), email=f"facet-{uuid.uuid4()}@example.com", is_active=True)
+        db_session.add_all([user, Profile(
+            id=user.id,
+            location_city=tag,
+            ethnicity="A" if i < 4 else "B",
+            position="top" if i % 2 else "bottom",
+            build=None
+        )])
+    await db_session.flush()
+
+    response = await client.get("/api/search/facets", params={"location": tag})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["total"] == 6
+    assert data["facets"]["ethnicity"] == {"A": 4, "B": 2}
+    assert data["facets"]["position"] == {"top": 3, "bottom": 3}
+    assert data["facets"]["build"] == {}
+
+@pytest.mark.asyncio
+async def test_search_results_cached_until_city_changes(client: AsyncClient, db_session):
+    from app.services.search_service import bump_city_versions
+
+    city = f"city-{uuid.uuid4()}"
+    user = User(id=uuid.uuid4(), email=f"cache-{uuid.uuid4()}@example.com", is_active=True)
+    db_session.add_all([user, Profile(id=user.id, location_city=city)])
+    await db_session.flush()
+
+    params = {"location": city.upper(), "exact_city": True}
+    first = (await client.get("/api/search/", params=params)).json()
+    assert [item["id"] for item in first["items"]] == [str(user.id)]
+
+    # A new profile in the city is not visible while the cached page is valid
+    other = User(id=uuid.uuid4(), email=f"cache-{uuid.uuid4()}@example.com", is_active=True)
+    db_session.add_all([other, Profile(id=other.id, location_city=city)])
+    await db_session.flush()
+    cached = (await client.get("/api/search/", params={"location": f" {city} ", "exact_city": True})).json()
+    assert cached["items"] == first["items"]
+
+    await bump_city_versions(city)
+    fresh = (await client.get("/api/search/", params=params)).json()
+    assert {item["id"] for item in fresh["items"]} == {str(user.id), str(other.id)}
+
+@pytest.mark.asyncio
+async def test_only_exact_city_searches_are_versioned():
+    from app.schemas.search import SearchFilters
+    from app.services.search_service import get_cached_search, normalize_filters
+
+    exact = normalize_filters(SearchFilters(location="  New   York ", exact_city=True))
+    assert exact.location == "new york"
+    _entry, version = await get_cached_search(exact, 20, None)
+    assert version == "0"
+
+    # "york" also matches other cities, whose changes never bump this key
+    _entry, version = await get_cached_search(normalize_filters(SearchFilters(location="york")), 20, None)
+    assert version is None
@@ -0,0 +1,73 @@
+import pytest
+import uuid
+import socketio
+from jose import jwt
+from app.core.config import settings
+from app.core.socket import connect, extract_token, get_identity, disconnect
+
+def test_extract_token_sources():
+    assert extract_token({}, {"token": "abc"}) == "abc"
+    assert extract_token({"HTTP_AUTHORIZATION": "Bearer xyz"}, None) == "xyz"
+    cookie = "theme=dark; next-auth.session-token=cookie-token"
+    assert extract_token({"HTTP_COOKIE": cookie}, None) == "cookie-token"
+    assert extract_token({}, None) is None
+
+@pytest.mark.asyncio
+async def test_connect_rejects_missing_or_invalid_token():
+    with pytest.raises(socketio.exceptions.ConnectionRefusedError):
+        await connect("sid-anon", {}, None)
+    with pytest.raises(socketio.exceptions.ConnectionRefusedError):
+        await connect("sid-bad", {}, {"token": "not-a-jwt"})
+    assert get_identity("sid-bad") is None
+
+class FakeSession:
+    def __init__(self, users):
+        self.users = users
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def get(self, model, user_id):
+        return self.users.get(user_id)
+
+def signed_token(user_id):
+    secret = settings.NEXTAUTH_SECRET if settings.NEXTAUTH_SECRET else settings.SECRET_KEY
+    return jwt.encode({"sub": str(user_id)}, secret, algorithm=settings.ALGORITHM)
+
+@pytest.fixture
+def socket_users(monkeypatch):
+    users = {}
+
+    async def no_friends(db, user_id):
+        return []
+    monkeypatch.setattr("app.core.socket.get_friend_ids", no_friends)
+    monkeypatch.setattr("app.core.socket.SessionLocal", lambda: FakeSession(users))
+    return users
+
+@pytest.mark.asyncio
+async def test_connect_binds_identity(socket_users):
+    from types import SimpleNamespace
+    user_id = uuid.uuid4()
+    socket_users[user_id] = SimpleNamespace(is_active=True)
+    await connect("sid-ok", {}, {"token": signed_token(user_id)})
+
+    identity = get_identity("sid-ok")
+    assert identity.user_uuid == user_id
+    assert identity.user_id == str(user_id)
+
+    await disconnect("sid-ok")
+    assert get_identity("sid-ok") is None
+
+@pytest.mark.asyncio
+async def test_connect_rejects_deleted_or_inactive_users(socket_users):
+    from types import SimpleNamespace
+    inactive_id = uuid.uuid4()
+    socket_users[inactive_id] = SimpleNamespace(is_active=False)
+
+    for user_id in (inactive_id, uuid.uuid4()):
+        with pytest.raises(socketio.exceptions.ConnectionRefusedError):
+            await connect("sid-denied", {}, {"token": signed_token(user_id)})
+    assert get_identity("sid-denied") is None
@@ -0,0 +1,63 @@
+import pytest
+from app.services.typing import TypingAggregator
+
+class RecordingEmitter:
+    def __init__(self):
+        self.frames = []
+
+    async def __call__(self, room, frame):
+        self.frames.append((room, frame))
+
+def make_aggregator():
+    # Long interval: the tests drive collect()/flush() themselves
+    return TypingAggregator(RecordingEmitter(), flush_interval_ms=60000, idle_timeout_ms=5000)
+
+@pytest.mark.asyncio
+async def test_keystrokes_coalesce_into_one_start():
+    typing = make_aggregator()
+    for i in range(50):
+        typing.touch("room-1", "alice", now=100 + i * 0.05)
+    typing.touch("room-1", "bob", now=101)
+
+    frames = typing.collect(now=102)
+    assert frames == {"room-1": {"room": "room-1", "started": ["alice", "bob"], "stopped": []}}
+    # Still typing, nothing new to report
+    typing.touch("room-1", "alice", now=102.5)
+    assert typing.collect(now=103) == {}
+    await typing.close()
+
+@pytest.mark.asyncio
+async def test_idle_typist_is_stopped():
+    typing = make_aggregator()
+    typing.touch("room-1", "alice", now=100)
+    typing.collect(now=100.5)
+
+    assert typing.collect(now=104) == {}
+    assert typing.collect(now=105) == {"room-1": {"room": "room-1", "started": [], "stopped": ["alice"]}}
+    await typing.close()
+
+@pytest.mark.asyncio
+async def test_transitions_within_one_window_cancel_out():
+    typing = make_aggregator()
+    typing.touch("room-1", "alice", now=100)
+    typing.stop("room-1", "alice")
+    assert typing.collect(now=100.5) == {}
+
+    typing.touch("room-1", "alice", now=101)
+    typing.collect(now=101.5)
+    typing.stop_user("alice")
+    typing.touch("room-1", "alice", now=102)
+    assert typing.collect(now=102.5) == {}
+    await typing.close()
+
+@pytest.mark.asyncio
+async def test_flush_emits_one_frame_per_room():
+    typing = make_aggregator()
+    typing.touch("room-1", "alice")
+    typing.touch("room-1", "bob")
+    typing.touch("user-9", "carol")
+
+    await typing.flush()
+    rooms = sorted(room for room, _frame in typing.emit.frames)
+    assert rooms == ["room-1", "user-9"]
+    await typing.close()
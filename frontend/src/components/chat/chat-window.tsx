@@ -25,6 +25,7 @@ export function ChatWindow({ conversationId, roomId, recipientName, currentUserI
   const [isUploading, setIsUploading] = useState(false);
   const lastTypingTime = useRef<number>(0);
   const scrollRef = useRef<HTMLDivElement>(null);
+  const otherTypists = Array.from(typingUsers).filter((id) => id !== currentUserId);
 
   useEffect(() => {
     if (scrollRef.current) {
@@ -128,9 +129,9 @@ export function ChatWindow({ conversationId, roomId, recipientName, currentUserI
             ))}
           </div>
         </ScrollArea>
-        {typingUsers.size > 0 && (
+        {otherTypists.length > 0 && (
           <div className="absolute bottom-0 left-0 w-full bg-background/80 backdrop-blur-sm border-t">
-            <TypingIndicator username={Array.from(typingUsers)[0].slice(0, 8)} />
+            <TypingIndicator username={otherTypists[0].slice(0, 8)} />
           </div>
         )}
       </CardContent>
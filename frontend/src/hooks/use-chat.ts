@@ -40,24 +40,15 @@ export const useChat = (roomId?: string, conversationId?: string) => {
       });
     }
 
-    socket.on("user_typing", ({ user_id, is_typing }: { user_id: string, is_typing: boolean }) => {
+    // One frame per room per flush interval with typing transitions only
+    socket.on("user_typing", ({ room, started, stopped }: { room: string, started: string[], stopped: string[] }) => {
+      if (roomId && room !== roomId) return;
       setTypingUsers((prev) => {
         const next = new Set(prev);
-        if (is_typing) next.add(user_id);
-        else next.delete(user_id);
+        started.forEach((id) => next.add(id));
+        stopped.forEach((id) => next.delete(id));
         return next;
       });
-
-      // Auto-clear typing indicator after 5s if no stop event
-      if (is_typing) {
-        setTimeout(() => {
-          setTypingUsers((prev) => {
-            const next = new Set(prev);
-            next.delete(user_id);
-            return next;
-          });
-        }, 5000);
-      }
     });
 
     return () => {
@@ -27,6 +27,8 @@ export const SocketProvider = ({ children }: { children: React.ReactNode }) => {
       transports: ["websocket", "polling"],
       reconnectionAttempts: 5,
       timeout: 10000,
+      // Evaluated on every (re)connect so a refreshed token is picked up
+      auth: (cb) => cb({ token: localStorage.getItem("access_token") }),
     });
 
     socketInstance.on("connect", () => {